@@ -67,6 +67,15 @@ export default function UserDashboard() {
         console.log('Message end')
       } else if (data.event === 'notification') {
         setNotifications((notifications) => [...notifications, data.data])
+      } else if (data.event === 'notification_update') {
+        // The rewritten text of a notification sent from a template
+        setNotifications((notifications) =>
+          notifications.map((notification) =>
+            notification.id === data.data.id
+              ? {...notification, message: data.data.message}
+              : notification,
+          ),
+        )
       }
     }
   }, [messages])
@@ -1,6 +1,6 @@
 'use client'
 
-import {useState, useMemo, useEffect} from 'react'
+import {useState, useMemo, useEffect, useRef} from 'react'
 import {GoogleMap, useJsApiLoader, Marker, DirectionsRenderer} from '@react-google-maps/api'
 import {X, BarChart3, PieChart, Utensils, Truck, DollarSign} from 'lucide-react'
 import {Badge} from '@/components/ui/badge'
@@ -196,6 +196,8 @@ export default function MissionControl() {
   const [connected, setConnected] = useState(false)
   const [socket, setSocket] = useState(null)
   const [assignments, setAssignments] = useState([])
+  // which db version we hold, so the server only sends what changed since
+  const dbVersion = useRef({epoch: null, version: null})
 
   useEffect(() => {
     const socket = new WebSocket(
@@ -217,9 +219,25 @@ export default function MissionControl() {
       console.log('Received:', event.data)
       const data = JSON.parse(event.data)
       if (data.event === 'db_response') {
+        dbVersion.current = {epoch: data.epoch, version: data.version}
         setLocations(data.data)
+      } else if (data.event === 'db_delta') {
+        const delta = data.data
+        const current = dbVersion.current
+        if (delta.epoch !== current.epoch || delta.since_version > current.version) {
+          // missed a change, catch up from the version we have
+          socket.send(JSON.stringify({event: 'get_db', since_version: current.version, epoch: current.epoch}))
+          return
+        }
+        if (delta.version <= current.version) return
+        dbVersion.current = {epoch: delta.epoch, version: delta.version}
+        setLocations((prev) => {
+          const next = {...prev, ...delta.keys, locations: {...prev.locations, ...delta.locations}}
+          delta.deleted.forEach((name) => delete next.locations[name])
+          delta.deleted_keys.forEach((key) => delete next[key])
+          return next
+        })
       } else if (data.event === 'assignments') {
-        socket.send(JSON.stringify({event: 'get_db'}))
         setAssignments((prevAssignments) => [...prevAssignments, ...data.data])
       }
     }
@@ -5,15 +5,94 @@ import os
 load_dotenv()
 from openai import OpenAI
 openai_client = OpenAI()
-import math
-import heapq
 from typing import Dict, List, Tuple
 import asyncio
+import functools
+import inspect
+import json
 import threading
+import time
+import uuid
+import collections
+from cache import TTLCache
+from changes import ChangeLog
+from db import get_book, get_changes, get_db, get_lock, get_store
+from matching import MatchConflict
+from metrics import Counter, Histogram
+from notifications import NOTIFICATION_FORMAT, SIDES, batch_prompt, parse_batch, render
+from routing import plan_tours
+from scheduler import MatchScheduler
+from streaming import stream_in_thread
+from tools import CountingExecutor, ToolCancelled, ToolRunner, ToolTimeout
 
 # Initialize the Swarm client
 client = Swarm()
 
+# Dispatch notifications are written in parallel. The pool is shared by every connection,
+# so this also caps how many notification LLM calls are in flight at once.
+DISPATCH_CONCURRENCY = int(os.getenv("DISPATCH_CONCURRENCY", "8"))
+dispatch_executor = CountingExecutor(max_workers=DISPATCH_CONCURRENCY, thread_name_prefix="dispatch")
+
+# The same supplier -> pantry dispatches repeat every day, so generated texts are reused.
+# Set NOTIFICATION_CACHE_PATH to keep them across restarts.
+notification_cache = TTLCache(
+    maxsize=int(os.getenv("NOTIFICATION_CACHE_SIZE", "1024")),
+    ttl=float(os.getenv("NOTIFICATION_CACHE_TTL", str(24 * 60 * 60))),
+    path=os.getenv("NOTIFICATION_CACHE_PATH") or None,
+)
+
+# Notifications go out from templates at once. With NOTIFICATION_REWRITE=1 the LLM rewrites them
+# afterwards, this many dispatchs per call (0 writes each one with its own call). A batch is one
+# long reply, generated token by token, so its latency grows with its size.
+NOTIFICATION_REWRITE = os.getenv("NOTIFICATION_REWRITE", "1") == "1"
+NOTIFICATION_BATCH_SIZE = int(os.getenv("NOTIFICATION_BATCH_SIZE", "16"))
+
+# Per-stage latency of the agent pipeline, served on /metrics
+turn_seconds = Histogram("swarm_turn_seconds", "Chat turns, from the user message to the last streamed chunk.")
+agent_seconds = Histogram("swarm_agent_seconds", "Time an agent held a chat turn before it handed off or the turn ended.", ["agent"])
+agent_handoffs = Counter("swarm_agent_handoffs_total", "Handoffs from one agent to the next.", ["source", "target"])
+match_conflicts = Counter("match_round_conflicts_total",
+                          "Matching round batches that conflicted with a write, by whether the round retried or gave up.",
+                          ["outcome"])
+tour_seconds = Histogram("tour_planning_seconds", "Planning the pickup tours of a matching round.")
+tool_seconds = Histogram("swarm_tool_seconds", "Tool functions called by the agents.", ["tool"])
+tool_errors = Counter("swarm_tool_errors_total", "Tool functions that raised.", ["tool"])
+llm_seconds = Histogram("llm_call_seconds", "LLM completions, by the agent they were made for (or notification).", ["agent"])
+llm_first_token_seconds = Histogram("llm_first_token_seconds", "Streamed LLM completions, until the first token.", ["agent"])
+llm_tokens = Counter("llm_tokens_total", "LLM tokens. Streamed completions count one per chunk, as they carry no usage.",
+                     ["agent", "kind"])
+notification_fallbacks = Counter("notification_batch_fallbacks_total",
+                                 "Notifications a batched call left out, written one call each instead.")
+
+_MISSING = object()
+
+
+def timed_tool(tool):
+    """
+    Record a tool's calls in swarm_tool_seconds.
+
+    Swarm passes context_variables by keyword to a function whose code object names it, so the
+    wrapper names it, and hands it on only to tools that take it. Calls that pass it
+    positionally go through unchanged.
+    """
+    takes_context = "context_variables" in inspect.signature(tool).parameters
+
+    @functools.wraps(tool)
+    def wrapper(self, *args, **kwargs):
+        context_variables = kwargs.pop("context_variables", _MISSING)
+        if takes_context and context_variables is not _MISSING:
+            kwargs["context_variables"] = context_variables
+        start = time.perf_counter()
+        try:
+            return tool(self, *args, **kwargs)
+        except Exception:
+            tool_errors.labels(tool.__name__).inc()
+            raise
+        finally:
+            tool_seconds.labels(tool.__name__).observe(time.perf_counter() - start)
+    return wrapper
+
+
 dispatch_agent_instructions = """
 You are a Dispatch Agent responsible dispatching announcements to the corresponding locations.
 
@@ -55,11 +134,50 @@ If there are no assignments found, explain to the user that there were no surplu
 
 
 class AgentSwarm:
+    """
+    The agent runtime, built once per process and shared by every connection.
 
-    def __init__(self, db, manager, websocket):
-        self.db = db
+    The agents and their tools are defined once, every chat turn runs on one shared
+    worker pool, and tools broadcast on the server's own event loop (see bind_loop).
+    """
+
+    def __init__(self, manager, db=None, book=None, store=None, changes=None, lock=None, match_mode=None, loop=None,
+                 workers=None):
+        self._db = db
+        self._book = book
+        self._store = store
+        self._changes = changes if changes is not None or db is None else ChangeLog()
+        self._lock = lock if lock is not None or db is None else threading.RLock()
+        # how many times a matching round is redone when its batch conflicts with a write
+        self.match_retries = int(os.getenv("MATCH_RETRIES", "3"))
+        # "greedy" (nearest first) or "optimal" (min-cost flow), see matching.MATCH_MODES
+        self.match_mode = match_mode or os.getenv("MATCH_MODE", "greedy")
         self.manager = manager
-        self.websocket = websocket
+        self.loop = loop
+        # Pickup tours of a round: stops and items per tour, and the time spent improving them all
+        self.tour_max_stops = int(os.getenv("TOUR_MAX_STOPS", "8"))
+        self.tour_capacity = int(os.getenv("TOUR_CAPACITY")) if os.getenv("TOUR_CAPACITY") else None
+        self.tour_time_budget = float(os.getenv("TOUR_TIME_BUDGET_MS", "50")) / 1000
+        # Matching and dispatching run on their own pool, a turn stops waiting after TOOL_TIMEOUT_S
+        self.tools = ToolRunner(
+            workers=int(os.getenv("TOOL_WORKERS", "16")),
+            timeout=float(os.getenv("TOOL_TIMEOUT_S", "30")),
+        )
+        # Rounds requested within MATCH_WINDOW_MS of each other, up to MATCH_BATCH of them, run as one.
+        # Each round takes one worker of the tool pool, the requests in it only wait on its result.
+        self.scheduler = MatchScheduler(
+            self.match_round,
+            window=float(os.getenv("MATCH_WINDOW_MS", "50")) / 1000,
+            max_batch=int(os.getenv("MATCH_BATCH", "32")),
+            executor=self.tools.executor,
+        )
+        # The turn each worker thread is running, see stream
+        self._turn = threading.local()
+        # Each streaming chat holds a worker for its whole turn, this caps concurrent chats
+        self.executor = CountingExecutor(
+            max_workers=workers or int(os.getenv("SWARM_WORKERS", "64")),
+            thread_name_prefix="swarm"
+        )
         self.dispatch_agent = Agent(
             name="Dispatch Agent",
             instructions=dispatch_agent_instructions,
@@ -75,19 +193,36 @@ class AgentSwarm:
             instructions=supply_agent_instructions,
             functions=[self.save_items]
         )
-        
-        # Create a new event loop
-        self.loop = asyncio.new_event_loop()
-        
-        # Start the event loop in a separate daemon thread
-        self.loop_thread = threading.Thread(target=self.start_event_loop, daemon=True)
-        self.loop_thread.start()
-        
-    def start_event_loop(self):
-        """Run the event loop forever."""
-        asyncio.set_event_loop(self.loop)
-        self.loop.run_forever()
-    
+
+    @property
+    def db(self):
+        return self._db if self._db is not None else get_db()
+
+    @property
+    def book(self):
+        return self._book if self._book is not None else get_book()
+
+    @property
+    def store(self):
+        # a swarm given its own db only writes to the store it was given
+        return self._store if self._db is not None or self._store is not None else get_store()
+
+    @property
+    def changes(self):
+        return self._changes if self._changes is not None else get_changes()
+
+    @property
+    def lock(self):
+        # every read-modify-write of the db runs under this, see db.lock
+        return self._lock if self._lock is not None else get_lock()
+
+    def bind_loop(self, loop):
+        """Broadcast from tools on `loop`, the loop that owns the websockets."""
+        self.loop = loop
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.tools.shutdown()
 
     def run(self, messages, stream=False):
         
@@ -98,6 +233,56 @@ class AgentSwarm:
         )
         return response
 
+    def stream(self, messages):
+        """Stream a chat turn from the shared worker pool without blocking the event loop."""
+        stopped = threading.Event()
+
+        def turn():
+            # Swarm calls the tools on this thread, they give up once the consumer is gone
+            self._turn.stopped = stopped
+            return self.measured(self.run(messages, stream=True))
+        return stream_in_thread(turn, self.executor, stopped)
+
+    def turn_stopped(self):
+        """Set once the consumer of the turn running on this thread is gone, None outside a streamed turn."""
+        return getattr(self._turn, "stopped", None)
+
+    def measured(self, chunks):
+        """
+        Pass a streamed turn through, timing each agent and LLM call on the way.
+
+        Swarm marks every completion with {"delim": "start"} and {"delim": "end"}, and the
+        first delta of each carries the sender, so a changed sender is a handoff.
+        """
+        agent = self.supply_agent.name
+        turn_start = agent_start = time.perf_counter()
+        call_start = None
+        first_token = False
+        for chunk in chunks:
+            now = time.perf_counter()
+            delim = chunk.get("delim")
+            if delim == "start":
+                call_start, first_token = now, False
+            elif delim == "end" and call_start is not None:
+                llm_seconds.labels(agent).observe(now - call_start)
+                call_start = None
+            elif "response" not in chunk:
+                sender = chunk.get("sender")
+                if sender and sender != agent:
+                    agent_seconds.labels(agent).observe(now - agent_start)
+                    agent_handoffs.labels(agent, sender).inc()
+                    agent, agent_start = sender, now
+                if chunk.get("content") or chunk.get("tool_calls"):
+                    if not first_token and call_start is not None:
+                        llm_first_token_seconds.labels(agent).observe(now - call_start)
+                        first_token = True
+                    llm_tokens.labels(agent, "completion").inc()
+            yield chunk
+        now = time.perf_counter()
+        agent_seconds.labels(agent).observe(now - agent_start)
+        turn_seconds.observe(now - turn_start)
+
+    @timed_tool
     def send_dispatch_multiple(self, context_variables):
         """
         This function sends dispatch messages to the origin and destination for each dispatch in the context variables.
@@ -109,263 +294,321 @@ class AgentSwarm:
         Returns:
             str: A message indicating that all dispatch messages have been sent.
         """
-        context_variables = self.db
-        for dispatch in context_variables["dispatchs"]:
-            self.send_dispatch(context_variables, dispatch)
-            
-        # Remove the 'dispatchs' array after dispatching
-        if "dispatchs" in self.db:
-            del self.db["dispatchs"]
+        try:
+            return self.tools.run("send_dispatch_multiple", self.dispatch_pending, cancel=self.turn_stopped())
+        except ToolTimeout:
+            return "Dispatching is taking longer than usual, the remaining messages will be sent as soon as they are written."
+        except ToolCancelled:
+            return "The conversation was closed, the messages that were started will still be sent."
 
+    def dispatch_pending(self):
+        """Send the notifications of every pending dispatch, and take them out of the db."""
+        # Take the pending dispatchs, so a round committed meanwhile is kept for the next call
+        with self.lock:
+            context_variables = self.db
+            dispatchs = context_variables.get("dispatchs", [])
+            records = [dispatch_record(context_variables, dispatch) for dispatch in dispatchs]
+            prompts = [dispatch_prompts(context_variables, dispatch) for dispatch in dispatchs]
+            delta = None
+            if "dispatchs" in context_variables:
+                del context_variables["dispatchs"]
+                delta = self.publish(keys=["dispatchs"])
+        if delta is not None:
+            self.broadcast(delta)
+
+        self.send_notifications(records, prompts)
         return "Finished dispatching all items."
 
     def send_dispatch(self, context_variables, dispatch):
-        origin, destination, category, items = dispatch
-        
-        sending_prompt = f"""
-        Write a friendly text message to the {origin} location, notifying them that {destination} will be coming to pick up {items} of {category} from them. They should be prepared to package the items neatly.
+        self.send_notifications([dispatch_record(context_variables, dispatch)],
+                                [dispatch_prompts(context_variables, dispatch)])
+        return True
+
+    def send_notifications(self, records, prompts):
         """
-        
-        receiving_prompt = f"""
-        Write a friendly text message to the {destination} location, notifying them the {origin} location has extra food of {category} that they can use. They have {items} available. They should be prepared to send someone to pick it up.
-        
-        Origin location: {context_variables["locations"][origin]["data"]["address"]}
+        Broadcast both notifications of every dispatch record, prompts[i] being dispatch_prompts()
+        of records[i].
+
+        Each one goes out straight away: the text the LLM wrote for the same dispatch before if
+        it is cached, or else the template. With NOTIFICATION_REWRITE on, the LLM then rewrites the
+        templated ones in the background, and each rewrite is broadcast as a notification_update
+        with the id of the notification it replaces.
         """
-        
-        sending_completion = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": sending_prompt}],
-            temperature=0.8
-        )
-        
+        rewrites = []  # (record, [(side, recipient, key, prompt, id)]) of the templated notifications
+        for record, notes in zip(records, prompts):
+            templates = render(record)
+            templated = []
+            for side, (recipient, key, prompt) in zip(SIDES, notes):
+                id = uuid.uuid4().hex[:12]
+                message = notification_cache.get(key)
+                if message is None:
+                    message = templates[side]
+                    templated.append((side, recipient, key, prompt, id))
+                self.send_notification(recipient, message, id)
+            if templated:
+                rewrites.append((record, templated))
+        if NOTIFICATION_REWRITE and rewrites:
+            self.rewrite(rewrites)
+
+    def rewrite(self, rewrites):
+        """
+        Rewrite templated notifications with the LLM on the shared dispatch pool, without waiting.
+
+        Records are written NOTIFICATION_BATCH_SIZE at a time, one LLM call per batch, and only
+        the notifications a reply left out are written with a call each.
+        """
+        if NOTIFICATION_BATCH_SIZE > 0:
+            for i in range(0, len(rewrites), NOTIFICATION_BATCH_SIZE):
+                future = dispatch_executor.submit(self.rewrite_batch, rewrites[i:i + NOTIFICATION_BATCH_SIZE])
+                future.add_done_callback(self._rewrite_rest)
+        else:
+            self._rewrite_each([note for _, notes in rewrites for note in notes])
+
+    def _rewrite_rest(self, future):
+        # what a batch left out, once it is done
+        if future.cancelled() or future.exception() is not None:
+            _report_failure(future)
+        else:
+            self._rewrite_each(future.result())
+
+    def _rewrite_each(self, notes):
+        for _, recipient, key, prompt, id in notes:
+            dispatch_executor.submit(self.notify, recipient, prompt, key, id).add_done_callback(_report_failure)
+
+    def rewrite_batch(self, rewrites):
+        """
+        Rewrite the templated notifications of a batch of dispatch records with one LLM call, and
+        broadcast them as updates.
+
+        Returns:
+            The (side, recipient, cache key, prompt, id) of every notification the reply did not
+            cover, to be written one by one. All of them if the call failed.
+        """
+        batch = [record for record, _ in rewrites]
+        written = {}
         try:
-            # Schedule the broadcast coroutine to run on the event loop
-            future = asyncio.run_coroutine_threadsafe(
-                self.manager.broadcast({
-                    "event": "notification",
-                    "data": {
-                        "recipient": origin,
-                        "message": sending_completion.choices[0].message.content
-                    }
-                }),
-                self.loop
-            )
-            
-            # Wait for the result with a timeout
-            result = future.result(timeout=10)
-            print(f"Broadcast result: {result}")
-        
-        except asyncio.TimeoutError:
-            print("Broadcast failed: Operation timed out.")
+            with llm_seconds.labels("notification_batch").time():
+                completion = openai_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[{"role": "user", "content": batch_prompt(batch)}],
+                    response_format=NOTIFICATION_FORMAT,
+                    temperature=0.8
+                )
+            if completion.usage is not None:
+                llm_tokens.labels("notification_batch", "prompt").inc(completion.usage.prompt_tokens)
+                llm_tokens.labels("notification_batch", "completion").inc(completion.usage.completion_tokens)
+            written = parse_batch(completion.choices[0].message.content, batch)
         except Exception as e:
-            print(f"Broadcast failed: {e}")
-        
-        
-        receiving_completion = openai_client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[{"role": "user", "content": receiving_prompt}],
-            temperature=0.8
-        )   
-        
+            print(f"Batched notifications failed, writing them one by one: {e}")
+
+        left = []
+        for j, (_, notes) in enumerate(rewrites):
+            for note in notes:
+                side, recipient, key, _, id = note
+                message = written.get(j, {}).get(side)
+                if message is None:
+                    left.append(note)
+                    continue
+                notification_cache.set(key, message)
+                self.send_notification(recipient, message, id, update=True)
+        notification_fallbacks.inc(len(left))
+        return left
+
+    def notify(self, recipient, prompt, key=None, id=None):
+        """
+        Write a notification with the LLM and broadcast it to the recipient, as an update of
+        notification `id` if given. A text cached under `key` is broadcast straight away instead.
+        """
+        message = notification_cache.get(key) if key is not None else None
+        if message is None:
+            with llm_seconds.labels("notification").time():
+                completion = openai_client.chat.completions.create(
+                    model="gpt-4o-mini",
+                    messages=[{"role": "user", "content": prompt}],
+                    temperature=0.8
+                )
+            if completion.usage is not None:
+                llm_tokens.labels("notification", "prompt").inc(completion.usage.prompt_tokens)
+                llm_tokens.labels("notification", "completion").inc(completion.usage.completion_tokens)
+            message = completion.choices[0].message.content
+            if key is not None:
+                notification_cache.set(key, message)
+        return self.send_notification(recipient, message, id, update=id is not None)
+
+    def send_notification(self, recipient, message, id=None, update=False):
+        return self.broadcast({
+            "event": "notification_update" if update else "notification",
+            "data": {
+                "id": id or uuid.uuid4().hex[:12],
+                "recipient": recipient,
+                "message": message,
+                "sent_at": time.time()
+            }
+        })
+
+    def broadcast(self, data):
+        if self.loop is None:
+            print("Broadcast failed: no event loop bound.")
+            return None
         try:
             # Schedule the broadcast coroutine to run on the event loop
             future = asyncio.run_coroutine_threadsafe(
-                self.manager.broadcast({
-                    "event": "notification",
-                    "data": {
-                        "recipient": destination,
-                        "message": receiving_completion.choices[0].message.content
-                    }
-                }),
+                self.manager.broadcast(data),
                 self.loop
             )
             
             # Wait for the result with a timeout
             result = future.result(timeout=10)
-            print(f"Broadcast result: {result}")
+            print(f"Broadcast result: {dict(collections.Counter(result.values()))}")
+            return result
         
         except asyncio.TimeoutError:
             print("Broadcast failed: Operation timed out.")
         except Exception as e:
             print(f"Broadcast failed: {e}")
-        return True
     
-    def logistics_agent_match(self) -> Tuple[List[Tuple[str, str, str, List[str]]], 
+    def publish(self, locations=(), keys=()):
+        """
+        Finish a write to the db: save what changed to the store and give the write a version.
+        Call it under the lock, and broadcast the db_delta event it returns once the lock is released.
+        """
+        if self.store is not None:
+            self.store.save(self.db, locations, keys)
+        version = self.changes.record(locations, keys)
+        return {
+            "event": "db_delta",
+            "data": self.changes.delta(self.db, version - 1)
+        }
+
+    def match_round(self):
+        """
+        Match the supply and demand saved since the last round, commit the assignments and broadcast them.
+
+        Returns:
+            assignments, remaining_supplies, remaining_demands: as in MatchBook.match.
+        """
+        # Rounds run one at a time on the book. Each matches a snapshot of the db, and writers are only
+        # held off while its batch is checked against the live db and committed.
+        book = self.book
+        version = None
+        assignments, remaining_supplies, remaining_demands = [], {}, {}
+        with book.lock:
+            for attempt in range(self.match_retries + 1):
+                with self.lock:
+                    if book is not self.book:
+                        # set_db replaced the db and its book since this round started
+                        break
+                    locations = self.changes.snapshot(self.db)["locations"]
+                    snapshot_version = (self.changes.epoch, self.changes.version)
+                    written = book.written()
+                book.sync(locations, written)
+                assignments, remaining_supplies, remaining_demands = book.match(self.match_mode, locations=locations)
+                if len(assignments) == 0:
+                    version = snapshot_version
+                    break
+                with self.lock:
+                    if book is not self.book:
+                        assignments = []
+                        break
+                    try:
+                        changed = book.commit(assignments)
+                    except MatchConflict as e:
+                        assignments = []
+                        if attempt < self.match_retries:
+                            match_conflicts.labels("retried").inc()
+                            print(f"Match conflict, retrying ({attempt + 1}/{self.match_retries}): {e}")
+                            continue
+                        # The queued supply and demand stay in the book for the next round
+                        match_conflicts.labels("gave_up").inc()
+                        print(f"Match conflict, giving up after {self.match_retries} retries: {e}")
+                        break
+                    # Keep the dispatchs of a round that has not been sent yet
+                    self.db['dispatchs'] = self.db.get('dispatchs', []) + assignments
+                    delta = self.publish(changed, ['dispatchs'])
+                    positions = {
+                        name: (self.db["locations"][name]["data"]["lat"], self.db["locations"][name]["data"]["lon"])
+                        for name in changed
+                    }
+                    version = (self.changes.epoch, self.changes.version)
+                break
+        result = assignments, remaining_supplies, remaining_demands
+        if version is not None:
+            # Until the next write, the db is what this round left, and another round would find nothing new
+            self.tools.store("match", version, result)
+
+        if len(assignments) > 0:
+            self.broadcast(delta)
+            self.broadcast({
+                "event": "assignments",
+                "data": assignments
+            })
+            # One trip per pantry instead of one per pickup
+            with tour_seconds.time():
+                tours = plan_tours(positions, assignments, book.suppliers.metric, book.travel,
+                                   self.tour_max_stops, self.tour_capacity, self.tour_time_budget)
+            self.broadcast({
+                "event": "tours",
+                "data": tours
+            })
+        return result
+
+    @timed_tool
+    def logistics_agent_match(self, context_variables) -> Tuple[List[Tuple[str, str, str, List[str]]],
            Dict[str, Dict[str, List[str]]], 
            Dict[str, List[str]]]:
         """
         Match suppliers to demanders based on category and proximity.
+        Only the supply and demand saved since the last round is matched, against the open
+        book kept between rounds. Pairs are taken nearest first, or the total distance is
+        minimised per category when match_mode is "optimal".
 
         Args:
             locations: Dictionary containing suppliers and demanders data.
 
         Returns:
             assignments: List of tuples (supplier, demander, category, list of items assigned).
-            remaining_supplies: Dictionary of suppliers with their remaining surplus_mapping.
-            remaining_demands: Dictionary of demanders with their remaining unmet categories.
+            remaining_supplies: Dictionary of this round's suppliers with their remaining surplus_mapping.
+            remaining_demands: Dictionary of this round's demanders with their remaining unmet categories.
         """
-        suppliers = {}
-        demanders = {}
-        demand_centers = {}  # category: list of demanders
-        
-        locations = self.db
-        # Separate suppliers and demanders
-        for name, info in locations["locations"].items():
-            if "surplus_mapping" in info:
-                suppliers[name] = {
-                    "surplus_mapping": {k: v.copy() for k, v in info["surplus_mapping"].items()},
-                    "data": info["data"].copy()
-                }
-            elif "demand" in info:
-                # Count the number of demands per category
-                demand_count = {}
-                for category in info["demand"]:
-                    if category in demand_count:
-                        demand_count[category] += 1
-                    else:
-                        demand_count[category] = 1
-                    # Populate demand_centers
-                    if category in demand_centers:
-                        demand_centers[category].append(name)
-                    else:
-                        demand_centers[category] = [name]
-                demanders[name] = {
-                    "demand_count": demand_count.copy(),
-                    "data": info["data"].copy()
-                }
-        
-        # Initialize priority queue
-        # Each entry is (distance, demander_name, supplier_name, category)
-        pq = []
-        
-        # Populate the priority queue
-        for category, demander_list in demand_centers.items():
-            for demander in demander_list:
-                if demander not in demanders:
-                    continue  # Skip if demander not in dataset
-                if category not in demanders[demander]["demand_count"]:
-                    continue  # Skip if demander doesn't need this category
-                for supplier, s_info in suppliers.items():
-                    if category in s_info["surplus_mapping"]:
-                        distance = calculate_distance(
-                            demanders[demander]["data"]["lat"],
-                            demanders[demander]["data"]["lon"],
-                            suppliers[supplier]["data"]["lat"],
-                            suppliers[supplier]["data"]["lon"]
-                        )
-                        heapq.heappush(pq, (distance, demander, supplier, category))
-        
-        assignments = []  # List to store assignments
-        
-        # Process the priority queue
-        while pq:
-            distance, demander, supplier, category = heapq.heappop(pq)
-            
-            # Check if the supplier still has surplus in this category
-            if category not in suppliers[supplier]["surplus_mapping"] or not suppliers[supplier]["surplus_mapping"][category]:
-                continue  # No surplus left in this category
-            
-            # Check if the demander still needs this category
-            if category not in demanders[demander]["demand_count"] or demanders[demander]["demand_count"][category] <= 0:
-                continue  # Demand already fulfilled
-            
-            # Determine how many items can be assigned
-            quantity_available = len(suppliers[supplier]["surplus_mapping"][category])
-            quantity_needed = demanders[demander]["demand_count"][category]
-            assigned_quantity = min(quantity_available, quantity_needed)
-            
-            # Assign specific items
-            assigned_items = suppliers[supplier]["surplus_mapping"][category][:assigned_quantity]
-            
-            # Record the assignment
-            assignments.append((supplier, demander, category, assigned_items))
-            
-            # Update supplier's surplus
-            suppliers[supplier]["surplus_mapping"][category] = suppliers[supplier]["surplus_mapping"][category][assigned_quantity:]
-            if not suppliers[supplier]["surplus_mapping"][category]:
-                del suppliers[supplier]["surplus_mapping"][category]  # Remove category if no items left
-            
-            # Update demander's needs
-            demanders[demander]["demand_count"][category] -= assigned_quantity
-            if demanders[demander]["demand_count"][category] == 0:
-                del demanders[demander]["demand_count"][category]  # Remove category if demand fulfilled
-        
-        # Prepare remaining supplies
-        remaining_supplies = {}
-        for supplier, s_info in suppliers.items():
-            if s_info["surplus_mapping"]:
-                remaining_supplies[supplier] = s_info["surplus_mapping"]
-        
-        # Prepare remaining demands
-        remaining_demands = {}
-        for demander, d_info in demanders.items():
-            if d_info["demand_count"]:
-                remaining_demands[demander] = list(d_info["demand_count"].keys())
-            
+        with self.lock:
+            version = (self.changes.epoch, self.changes.version)
+        # Nothing was written since the last round, so its result still holds
+        result = self.tools.cached("match", version)
+        if result is None:
+            # Conversations asking at about the same time share one round, each gets the part about its location
+            try:
+                result = self.tools.wait("match", self.scheduler.schedule(), cancel=self.turn_stopped())
+            except ToolTimeout:
+                return "Matching is taking longer than usual. Its assignments will be dispatched once it finishes, ask the user to check back shortly."
+            except ToolCancelled:
+                return "The conversation was closed, the matching round will still finish and be dispatched."
+        assignments, remaining_supplies, remaining_demands = result
+        location = context_variables.get("location_name") if context_variables else None
+        if location is not None:
+            assignments = [assignment for assignment in assignments if location in assignment[:2]]
+            remaining_supplies = {location: remaining_supplies[location]} if location in remaining_supplies else {}
+            remaining_demands = {location: remaining_demands[location]} if location in remaining_demands else {}
+
         if len(assignments) ==  0:
+            with self.lock:
+                pending = bool(self.db.get("dispatchs"))
+            # The round may have matched a location whose own conversation has not asked yet
+            if pending:
+                return Result(
+                    value="No assignments found for this location, but other assignments are waiting to be dispatched.",
+                    agent=self.dispatch_agent
+                )
             return Result(
                 value="No assignments found.",
             )
-            
-        for assignment in assignments:
-            supplier, demander, category, items = assignment
-
-            # Remove items from supplier's surplus_mapping
-            if supplier in self.db["locations"]:
-                if "surplus_mapping" in self.db["locations"][supplier]:
-                    # Remove the assigned items
-                    current_items = self.db["locations"][supplier]["surplus_mapping"].get(category, [])
-                    updated_items = current_items[assigned_quantity:]
-                    if updated_items:
-                        self.db["locations"][supplier]["surplus_mapping"][category] = updated_items
-                    else:
-                        # If no items left in category, remove the category
-                        del self.db["locations"][supplier]["surplus_mapping"][category]
-                # Optionally, remove the category from 'surplus' if 'surplus_mapping' is empty for that category
-                if "surplus" in self.db["locations"][supplier]:
-                    if category in self.db["locations"][supplier]["surplus"]:
-                        # Remove the category from 'surplus' if no items remain
-                        if category not in self.db["locations"][supplier]["surplus_mapping"]:
-                            self.db["locations"][supplier]["surplus"].remove(category)
-
-            # Remove items from demander’s demand
-            if demander in self.db["locations"]:
-                if "demand" in self.db["locations"][demander]:
-                    # Remove the assigned category as many times as items were assigned
-                    for _ in range(len(items)):
-                        try:
-                            self.db["locations"][demander]["demand"].remove(category)
-                        except ValueError:
-                            # In case the category isn't present enough times
-                            pass
-
-        self.db['dispatchs'] = assignments
 
-        try:
-            # Schedule the broadcast coroutine to run on the event loop
-            future = asyncio.run_coroutine_threadsafe(
-                self.manager.broadcast({
-                    "event": "assignments",
-                    "data": assignments
-                }),
-                self.loop
-            )
-            
-            # Wait for the result with a timeout
-            result = future.result(timeout=10)
-            print(f"Broadcast result: {result}")
-        
-        except asyncio.TimeoutError:
-            print("Broadcast failed: Operation timed out.")
-        except Exception as e:
-            print(f"Broadcast failed: {e}")
-        
         return Result(
             value=f"Assignments: {assignments}, Remaining Supplies: {remaining_supplies}, Remaining Demands: {remaining_demands}",
             agent=self.dispatch_agent
         )
 
 
+    @timed_tool
     def save_items(self, context_variables, location_name: str, type: str, groups: list[str], food_mapping: dict = {}):
         """
         Processes and saves surplus or demand data for a given location.
@@ -393,48 +636,96 @@ class AgentSwarm:
         if not isinstance(groups, list) or not all(isinstance(item, str) and item in allowed_categories for item in groups):
             return "Groups must be a list of allowed category strings."
         
-        context_variables = self.db
+        with self.lock:
+            context_variables = self.db
         
-        # Initialize location in context_variables if not present
-        if 'locations' not in context_variables:
-            context_variables['locations'] = {}
+            # Initialize location in context_variables if not present
+            if 'locations' not in context_variables:
+                context_variables['locations'] = {}
         
-        if location_name not in context_variables['locations']:
-            return "Location not found. Inform the user that we currently only support the locations in the database: " + str(context_variables['locations'].keys())
+            if location_name not in context_variables['locations']:
+                return "Location not found. Inform the user that we currently only support the locations in the database: " + str(context_variables['locations'].keys())
             
-        # Now, based on the type, we update the context variables accordingly
-        if type == "supply":
-            if "surplus" in context_variables['locations'][location_name]:
-                context_variables['locations'][location_name]["surplus"].extend(groups)
-            else:
-                context_variables['locations'][location_name]["surplus"] = groups
-
-            if "surplus_mapping" in context_variables['locations'][location_name]:
-                context_variables['locations'][location_name]["surplus_mapping"].update(food_mapping)
-            else:
-                context_variables['locations'][location_name]["surplus_mapping"] = food_mapping
+            # Now, based on the type, we update the context variables accordingly
+            if type == "supply":
+                if "surplus" in context_variables['locations'][location_name]:
+                    context_variables['locations'][location_name]["surplus"].extend(groups)
+                else:
+                    context_variables['locations'][location_name]["surplus"] = groups
+
+                if "surplus_mapping" in context_variables['locations'][location_name]:
+                    context_variables['locations'][location_name]["surplus_mapping"].update(food_mapping)
+                else:
+                    context_variables['locations'][location_name]["surplus_mapping"] = food_mapping
         
-        if type == "demand":
-            if "demand" in context_variables['locations'][location_name]:
-                context_variables['locations'][location_name]["demand"].extend(groups)
-            else:
-                context_variables['locations'][location_name]["demand"] = groups
+            if type == "demand":
+                if "demand" in context_variables['locations'][location_name]:
+                    context_variables['locations'][location_name]["demand"].extend(groups)
+                else:
+                    context_variables['locations'][location_name]["demand"] = groups
+
+            # Queue the change for the next matching round
+            self.book.record(location_name, list(groups) + list(food_mapping))
+            delta = self.publish([location_name])
+        self.broadcast(delta)
             
         return Result(
             value=f"Parsed {type} data for Location {location_name}: {groups}",
-            agent=self.logistics_agent
+            agent=self.logistics_agent,
+            context_variables={"location_name": location_name}
         )
 
 
-def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+
+class Session:
+    """Per-connection state. Everything heavy lives on the shared AgentSwarm."""
+
+    __slots__ = ("client_id", "websocket", "swarm")
+
+    def __init__(self, client_id, websocket, swarm):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.swarm = swarm
+
+    def stream(self, messages):
+        return self.swarm.stream(messages)
+
+def _report_failure(future):
+    if not future.cancelled() and future.exception() is not None:
+        print(f"Dispatch failed: {future.exception()}")
+
+def dispatch_record(context_variables, dispatch):
+    """The (origin, destination, category, items, origin address) the notifications of a dispatch are written from."""
+    origin, destination, category, items = dispatch
+    return origin, destination, category, items, context_variables["locations"][origin]["data"]["address"]
+
+def dispatch_prompts(context_variables, dispatch):
+    """The (recipient, cache key, prompt) of the two notifications sent for one dispatch."""
+    origin, destination, category, items, address = dispatch_record(context_variables, dispatch)
+
+    sending_prompt = f"""
+    Write a friendly text message to the {origin} location, notifying them that {destination} will be coming to pick up {items} of {category} from them. They should be prepared to package the items neatly.
     """
-    Calculate the Euclidean distance between two geographical points.
     
-    Args:
-        lat1, lon1: Latitude and Longitude of the first point.
-        lat2, lon2: Latitude and Longitude of the second point.
+    receiving_prompt = f"""
+    Write a friendly text message to the {destination} location, notifying them the {origin} location has extra food of {category} that they can use. They have {items} available. They should be prepared to send someone to pick it up.
     
-    Returns:
-        Euclidean distance as a float.
+    Origin location: {address}
     """
-    return math.sqrt((lat1 - lat2) ** 2 + (lon1 - lon2) ** 2)
\ No newline at end of file
+    return [
+        (origin, notification_key("sending", origin, destination, category, items, address), sending_prompt),
+        (destination, notification_key("receiving", origin, destination, category, items, address), receiving_prompt),
+    ]
+
+
+def notification_key(kind, origin, destination, category, items, address):
+    """Cache key of a notification: its prompt inputs, with case, spacing and item order normalised."""
+    normalize = lambda value: " ".join(str(value).split()).lower()
+    return json.dumps([
+        kind,
+        normalize(origin),
+        normalize(destination),
+        normalize(category),
+        sorted(normalize(item) for item in items),
+        normalize(address),
+    ])
@@ -0,0 +1,58 @@
+"""
+Greedy heap vs min-cost flow on the problem from Leetcode_problem.md.
+
+Run from the server directory:
+    python -m benchmarks.bench_flow --providers 100 --recipients 100 --items 10 --max-quantity 1000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from flow import greedy_transportation, solve_transportation, transportation_cost
+
+
+def random_instance(providers: int, recipients: int, items: int, max_quantity: int, seed: int):
+    rng = np.random.default_rng(seed)
+    provider_xy = rng.uniform(0, 100, (providers, 2))
+    recipient_xy = rng.uniform(0, 100, (recipients, 2))
+    # Unique positive edge weights
+    weights = rng.permutation(providers * recipients).reshape(providers, recipients) + 1
+    distance = np.sqrt(((provider_xy[:, None, :] - recipient_xy[None, :, :]) ** 2).sum(axis=2))
+    supply = rng.integers(0, max_quantity + 1, (items, providers))
+    demand = rng.integers(0, max_quantity + 1, (items, recipients))
+    return distance * weights, supply, demand
+
+
+def run(cost, supply, demand, solver):
+    start = time.perf_counter()
+    total = 0.0
+    for item in range(supply.shape[0]):
+        total += transportation_cost(cost, solver(cost, supply[item], demand[item]))
+    return total, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--providers", type=int, default=100)
+    parser.add_argument("--recipients", type=int, default=100)
+    parser.add_argument("--items", type=int, default=10)
+    parser.add_argument("--max-quantity", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(f"{args.providers} providers x {args.recipients} recipients x {args.items} item types, "
+          f"quantities up to {args.max_quantity}")
+    print(f"{'run':>4} {'greedy cost':>16} {'greedy s':>9} {'optimal cost':>16} {'optimal s':>10} {'saving':>7}")
+    for repeat in range(args.repeat):
+        cost, supply, demand = random_instance(args.providers, args.recipients, args.items,
+                                               args.max_quantity, args.seed + repeat)
+        greedy_cost, greedy_time = run(cost, supply, demand, greedy_transportation)
+        optimal_cost, optimal_time = run(cost, supply, demand, solve_transportation)
+        saving = 1 - optimal_cost / greedy_cost if greedy_cost else 0.0
+        print(f"{repeat:>4} {greedy_cost:>16.1f} {greedy_time:>9.3f} {optimal_cost:>16.1f} {optimal_time:>10.3f} {saving:>7.1%}")
+
+
+if __name__ == "__main__":
+    main()
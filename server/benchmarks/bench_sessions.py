@@ -0,0 +1,38 @@
+"""
+Memory and threads held per idle websocket connection.
+
+Run from the server directory:
+    python -m benchmarks.bench_sessions --connections 1000
+"""
+import argparse
+import gc
+import threading
+import tracemalloc
+
+from agents import AgentSwarm, Session
+from socket_manager import ConnectionManager
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--connections", type=int, default=1000)
+    args = parser.parse_args()
+
+    swarm = AgentSwarm(ConnectionManager())
+    threads_before = threading.active_count()
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    sessions = [Session(f"client-{i}", object(), swarm) for i in range(args.connections)]
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"{len(sessions)} idle sessions")
+    print(f"memory per session: {(after - before) / len(sessions):.0f} bytes (including the client id string)")
+    print(f"threads per session: {(threading.active_count() - threads_before) / len(sessions):.3f}")
+    swarm.shutdown()
+
+
+if __name__ == "__main__":
+    main()
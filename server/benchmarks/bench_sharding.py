@@ -0,0 +1,84 @@
+"""
+A full matching round by geographic shard, in this process and on process pools of growing
+size, against the unsharded match.
+
+Run from the server directory:
+    python -m benchmarks.bench_sharding --count 100000 --workers 1,2,4,8
+"""
+import argparse
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from benchmarks.workload import generate
+from distance import distances_from
+from matching import match
+from sharding import partition, sharded_match
+from spatial import SpatialIndex
+
+
+def summary(locations: dict, assignments: list, metric: str):
+    """Units assigned, and the distance they travel in total."""
+    units, total = 0, 0.0
+    for supplier, demander, _, items in assignments:
+        a, b = locations[supplier]["data"], locations[demander]["data"]
+        units += len(items)
+        total += len(items) * float(distances_from(a["lat"], a["lon"], [b["lat"]], [b["lon"]], metric)[0])
+    return units, total
+
+
+def report(label: str, seconds: float, baseline, units: int, total: float, reference):
+    speedup = f"{baseline / seconds:.2f}x" if baseline else "-"
+    extra = f"{(total / reference[1] - 1) * 100:+.2f}%" if reference else "-"
+    print(f"  {label:<24} {seconds:>9.2f} {speedup:>8} {units:>10} {extra:>10}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--radius-km", type=float, default=250, help="of the area the locations are spread over")
+    parser.add_argument("--shard-size", type=float, default=0.25, help="degrees")
+    parser.add_argument("--workers", default="1,2,4,8")
+    parser.add_argument("--metric", default="haversine")
+    parser.add_argument("--mode", default="greedy")
+    parser.add_argument("--skip-global", action="store_true", help="skip the unsharded match, slow at large counts")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    locations = generate(args.count // 3, args.count - args.count // 3, args.seed, radius_km=args.radius_km)
+    shards = partition(locations, args.shard_size)
+    sizes = sorted(map(len, shards.values()), reverse=True)
+    print(f"{args.count} locations in {len(shards)} shards, largest {sizes[0]}, median {sizes[len(sizes) // 2]}")
+    print(f"{os.cpu_count()} CPUs")
+    print(f"  {'':<24} {'seconds':>9} {'speedup':>8} {'units':>10} {'distance':>10}")
+
+    reference = baseline = None
+    if not args.skip_global:
+        start = time.perf_counter()
+        index = SpatialIndex.from_suppliers(locations, metric=args.metric)
+        assignments = match(locations, index, args.mode)[0]
+        baseline = time.perf_counter() - start
+        reference = summary(locations, assignments, args.metric)
+        report("unsharded", baseline, baseline, *reference, reference)
+
+    start = time.perf_counter()
+    assignments = sharded_match(locations, args.mode, args.metric, shard_size=args.shard_size)[0]
+    seconds = time.perf_counter() - start
+    baseline = baseline or seconds
+    report("sharded, in process", seconds, baseline, *summary(locations, assignments, args.metric), reference)
+
+    for workers in map(int, args.workers.split(",")):
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+            # start the workers before timing, as the server does once at startup
+            list(pool.map(abs, range(workers)))
+            start = time.perf_counter()
+            assignments = sharded_match(locations, args.mode, args.metric, shard_size=args.shard_size,
+                                        executor=pool)[0]
+            seconds = time.perf_counter() - start
+        report(f"sharded, {workers} workers", seconds, baseline, *summary(locations, assignments, args.metric),
+               reference)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""
+The SQLite store against the plain in-memory dict, at growing numbers of locations.
+
+Run from the server directory:
+    python -m benchmarks.bench_store --sizes 10000,100000
+"""
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from benchmarks.workload import generate
+from store import SQLiteStore
+
+
+def timed(fn, repeat: int = 1) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def report(label: str, memory, sqlite: float):
+    memory = "-" if memory is None else f"{memory * 1e6:.1f}"
+    print(f"  {label:<38} {memory:>12} {sqlite * 1e6:>12.1f}")
+
+
+def bench(count: int, seed: int, directory: str):
+    rng = random.Random(seed)
+    locations = generate(count // 2, count - count // 2, seed)
+    db = {"locations": locations}
+    names = list(locations)
+    store = SQLiteStore(os.path.join(directory, f"bench-{count}.db"))
+
+    print(f"\n{count} locations{'':<24} {'dict us':>12} {'sqlite us':>12}")
+    report("bulk load (set_db)", None, timed(lambda: store.replace(db)))
+    report("startup (load everything)", None, timed(store.load))
+
+    sample = rng.sample(names, 1000)
+    report("read one location", timed(lambda: [locations[name] for name in sample]) / len(sample),
+           timed(lambda: [store.load_location(name) for name in sample]) / len(sample))
+    report("suppliers of one category",
+           timed(lambda: [name for name, info in locations.items() if "dairy" in info.get("surplus", ())], 5),
+           timed(lambda: store.locations_with("dairy"), 5))
+    report("locations in a 0.05 degree box",
+           timed(lambda: [name for name, info in locations.items()
+                          if 42.2 <= info["data"]["lat"] <= 42.25 and -83.3 <= info["data"]["lon"] <= -83.25], 5),
+           timed(lambda: store.locations_within(42.2, 42.25, -83.3, -83.25), 5))
+
+    def save_items(name):
+        info = locations[name]
+        info.setdefault("demand", []).append("fruits")
+
+    def save_items_stored(name):
+        save_items(name)
+        store.save(db, [name])
+
+    report("save_items write", timed(lambda: [save_items(name) for name in sample]) / len(sample),
+           timed(lambda: [save_items_stored(name) for name in sample]) / len(sample))
+    batches = [rng.sample(names, 200) for _ in range(20)]
+    report("matcher commit (200 locations)", None, timed(lambda: [store.save(db, batch) for batch in batches]) / len(batches))
+
+    # Readers on their own connections while one thread keeps committing
+    stop = threading.Event()
+
+    def writer():
+        while not stop.is_set():
+            store.save(db, rng.sample(names, 50))
+
+    reads = []
+
+    def reader():
+        start = time.perf_counter()
+        for name in random.Random(threading.get_ident()).sample(names, 500):
+            store.load_location(name)
+        reads.append((time.perf_counter() - start) / 500)
+
+    write_thread = threading.Thread(target=writer)
+    write_thread.start()
+    readers = [threading.Thread(target=reader) for _ in range(4)]
+    for thread in readers:
+        thread.start()
+    for thread in readers:
+        thread.join()
+    stop.set()
+    write_thread.join()
+    report("read one location, 4 readers + writer", None, max(reads))
+    print(f"  file size: {os.path.getsize(store.path) / 1e6:.1f} MB")
+    store.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print("- where the dict has nothing to do (it is already in memory)")
+    with tempfile.TemporaryDirectory() as directory:
+        for count in map(int, args.sizes.split(",")):
+            bench(count, args.seed, directory)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Memory and lookup cost of the LocationTable that counts the book's supply and demand, against
+the dicts it replaced: per category, a dict of location to count.
+
+Both are indexes kept next to db["locations"], so the memory reported is what each adds on top
+of it, not a saving.
+
+Run from the server directory:
+    python -m benchmarks.bench_table --sizes 10000,100000
+"""
+import argparse
+import gc
+import time
+import tracemalloc
+
+from benchmarks.workload import generate
+from table import LocationTable, needs, supplies
+
+
+def measured(build):
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = build()
+    gc.collect()
+    after, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, after - before
+
+
+def dict_index(locations: dict) -> dict:
+    index = {"supply": {}, "demand": {}, "supply_total": {}, "demand_total": {}}
+    for name, info in locations.items():
+        for side, counts in (("supply", supplies(info)), ("demand", needs(info))):
+            for category, quantity in counts.items():
+                index[side].setdefault(category, {})[name] = quantity
+                index[side + "_total"][category] = index[side + "_total"].get(category, 0) + quantity
+    return index
+
+
+def timed(fn, repeat: int = 5) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - start) / repeat
+
+
+def bench(count: int, seed: int):
+    locations = generate(count // 2, count - count // 2, seed)
+    index, index_bytes = measured(lambda: dict_index(locations))
+    table, table_bytes = measured(lambda: LocationTable.from_locations(locations))
+
+    print(f"\n{count} locations")
+    print(f"  {'memory added to the locations':<40} {'bytes/location':>15}")
+    print(f"  {'dicts by category':<40} {index_bytes / count:>15.0f}")
+    print(f"  {'LocationTable':<40} {table_bytes / count:>15.0f}   (count matrices {table.nbytes / count:.0f})")
+
+    name = next(iter(locations))
+    info = locations[name]
+
+    def table_update():
+        table.update(name, info)
+
+    def dict_suppliers():
+        return dict(index["supply"]["dairy"])
+
+    def table_suppliers():
+        return table.suppliers("dairy")
+
+    def dict_summary():
+        return {category: len(members) for category, members in index["demand"].items()}
+
+    def table_summary():
+        return {category: counts["demanders"] for category, counts in table.summary().items() if counts["demanders"]}
+
+    assert dict_suppliers() == table_suppliers()
+    assert dict_summary() == table_summary()
+    assert index["demand_total"] == table.demand_total
+
+    print(f"  {'lookup':<40} {'dicts ms':>15} {'table ms':>10}")
+    for label, with_dicts, with_table in [
+        ("dairy suppliers and their counts", dict_suppliers, table_suppliers),
+        ("demanders per category", dict_summary, table_summary),
+    ]:
+        print(f"  {label:<40} {timed(with_dicts) * 1e3:>15.2f} {timed(with_table) * 1e3:>10.2f}")
+    print(f"  {'re-sync one location':<40} {'':>15} {timed(table_update, 1000) * 1e3:>10.4f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    for count in map(int, args.sizes.split(",")):
+        bench(count, args.seed)
+
+
+if __name__ == "__main__":
+    main()
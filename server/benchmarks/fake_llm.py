@@ -0,0 +1,223 @@
+"""
+A stand-in for the OpenAI chat completions API, for load tests that must not spend real calls.
+
+Both the Swarm agents and the notification writer use the OpenAI SDK, which reads
+OPENAI_BASE_URL, so the server is pointed at this one without code changes:
+
+    python -m benchmarks.fake_llm --port 8001 --latency-ms 400 --token-ms 15
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=fake python main.py
+
+Replies are scripted. When the last user message is a JSON object, every tool the agent offers
+is called once, in order, with the arguments it needs taken from that object (tools whose
+required arguments are missing are skipped). Once the agent has no tool left to call, or the
+message is plain text, a canned reply is streamed word by word. So a user message of
+
+    {"location_name": "Kroger", "type": "supply", "groups": ["dairy"], "food_mapping": {"dairy": ["milk"]}}
+
+walks the real pipeline: save_items, then logistics_agent_match, then send_dispatch_multiple,
+with each agent's closing text streamed back, and every notification written by a plain
+(non-streaming) completion.
+
+A request for the "notifications" JSON schema (see notifications.py) gets one entry per
+dispatch listed in its prompt, less a `--batch-drop` fraction left out at random to exercise
+the per-notification fallback. Plain completions take `--token-ms` per word on top of the
+latency, as a streamed one does, so one long batched reply costs what its length does.
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = ("Thanks for letting us know, everything is recorded and nearby partners will be told "
+         "right away so the food gets where it is needed").split()
+
+
+class Script:
+    """Timing of the fake model, in seconds."""
+
+    def __init__(self, latency: float = 0.3, token_interval: float = 0.02, reply_words: int = 40,
+                 jitter: float = 0.2, seed: Optional[int] = None, batch_drop: float = 0.0):
+        self.latency = latency
+        self.token_interval = token_interval
+        self.reply_words = reply_words
+        self.jitter = jitter
+        self.batch_drop = batch_drop
+        self.rng = random.Random(seed)
+
+    def delay(self, seconds: float) -> float:
+        return max(0.0, seconds * (1 + self.rng.uniform(-self.jitter, self.jitter)))
+
+
+def _arguments(request: dict) -> Optional[dict]:
+    """The JSON object of the last user message, if it is one."""
+    for message in reversed(request.get("messages", [])):
+        if message.get("role") != "user":
+            continue
+        try:
+            arguments = json.loads(message.get("content") or "")
+        except (TypeError, ValueError):
+            return None
+        return arguments if isinstance(arguments, dict) else None
+    return None
+
+
+def _called(request: dict) -> set:
+    """Names of the tools called since the last user message."""
+    called = set()
+    for message in reversed(request.get("messages", [])):
+        if message.get("role") == "user":
+            break
+        for call in message.get("tool_calls") or ():
+            called.add(call["function"]["name"])
+    return called
+
+
+def next_tool_call(request: dict) -> Optional[dict]:
+    """The {"name", "arguments"} the model should call next, or None to answer with text."""
+    arguments = _arguments(request)
+    if arguments is None:
+        return None
+    called = _called(request)
+    for tool in request.get("tools") or ():
+        function = tool["function"]
+        if function["name"] in called:
+            continue
+        parameters = function.get("parameters", {})
+        if not all(name in arguments for name in parameters.get("required", ())):
+            continue
+        taken = {name: arguments[name] for name in parameters.get("properties", {}) if name in arguments}
+        return {"name": function["name"], "arguments": json.dumps(taken)}
+    return None
+
+
+def structured_reply(request: dict, script: Script) -> Optional[List[str]]:
+    """The words of the JSON answer to a batched notification request, None for any other request."""
+    json_schema = (request.get("response_format") or {}).get("json_schema") or {}
+    if json_schema.get("name") != "notifications":
+        return None
+    prompt = next(message.get("content") or "" for message in reversed(request["messages"]) if message.get("role") == "user")
+    dispatches = json.loads(prompt[prompt.index("["):prompt.rindex("]") + 1])
+    message = "".join(_reply(script)).strip()
+    entries = [
+        {"id": dispatch["id"], "origin": dispatch["origin"], "destination": dispatch["destination"],
+         "origin_message": message, "destination_message": message}
+        for dispatch in dispatches
+        if script.rng.random() >= script.batch_drop
+    ]
+    return json.dumps({"notifications": entries}).split(" ")
+
+
+def _usage(request: dict, completion_tokens: int) -> dict:
+    prompt_tokens = sum(len(str(message.get("content") or "").split()) for message in request.get("messages", []))
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+
+
+def _reply(script: Script) -> List[str]:
+    return [WORDS[i % len(WORDS)] + " " for i in range(script.reply_words)]
+
+
+def create_app(script: Script) -> FastAPI:
+    app = FastAPI()
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        call = next_tool_call(body)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        created = int(time.time())
+        model = body.get("model", "fake")
+
+        if not body.get("stream"):
+            message = {"role": "assistant", "content": None}
+            structured = structured_reply(body, script)
+            if structured is not None:
+                words = structured
+                message["content"] = " ".join(words)
+            elif call is None:
+                words = _reply(script)
+                message["content"] = "".join(words).strip()
+            else:
+                words = []
+                message["tool_calls"] = [{"id": f"call_{uuid.uuid4().hex[:12]}", "type": "function", "function": call}]
+            await asyncio.sleep(script.delay(script.latency) + script.delay(script.token_interval) * len(words))
+            return JSONResponse({
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": message,
+                    "finish_reason": "stop" if call is None else "tool_calls",
+                }],
+                "usage": _usage(body, len(words)),
+            })
+
+        def chunk(delta: dict, finish_reason: Optional[str] = None, usage: Optional[dict] = None) -> str:
+            data = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": created,
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            if usage is not None:
+                data["usage"] = usage
+            return f"data: {json.dumps(data)}\n\n"
+
+        async def events():
+            await asyncio.sleep(script.delay(script.latency))
+            yield chunk({"role": "assistant", "content": ""})
+            if call is None:
+                words = _reply(script)
+                for word in words:
+                    yield chunk({"content": word})
+                    await asyncio.sleep(script.delay(script.token_interval))
+            else:
+                words = []
+                yield chunk({"tool_calls": [{
+                    "index": 0,
+                    "id": f"call_{uuid.uuid4().hex[:12]}",
+                    "type": "function",
+                    "function": call,
+                }]})
+            yield chunk({}, "stop" if call is None else "tool_calls")
+            if (body.get("stream_options") or {}).get("include_usage"):
+                yield chunk({}, usage=_usage(body, len(words)))
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def main():
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency-ms", type=float, default=300, help="before the first token")
+    parser.add_argument("--token-ms", type=float, default=20, help="per generated word")
+    parser.add_argument("--reply-words", type=int, default=40)
+    parser.add_argument("--jitter", type=float, default=0.2, help="+/- fraction applied to every delay")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--batch-drop", type=float, default=0.0, help="fraction of batched notifications left out")
+    args = parser.parse_args()
+    script = Script(args.latency_ms / 1000, args.token_ms / 1000, args.reply_words, args.jitter, args.seed,
+                    args.batch_drop)
+    uvicorn.run(create_app(script), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Websocket load driver for /ws.
+
+Opens many concurrent clients, each with its own client_id. A share of them ("active") chat:
+every turn sends a `message` event asking the Supply Agent to save a seeded write against a
+location of the server's db, and some turns also send `get_db`. The others only listen, the way
+dashboards do. Reported, as p50/p95/p99:
+
+    first_response       from sending `message` to the first `message_response`
+    message_end          from sending `message` to `message_end`
+    get_db               from sending `get_db` to `db_response`
+    notification         from the server broadcasting a `notification` to a client receiving it
+    notification_update  the same for the `notification_update` carrying its LLM rewrite
+
+Run the server against the LLM stand-in (see benchmarks.fake_llm), then from the server directory:
+    python -m benchmarks.load_ws --clients 2000 --active 200 --turns 5 --output load.json
+
+Thousands of clients need as many file descriptors on both ends (ulimit -n).
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+import websockets
+
+from benchmarks.workload import writes
+
+METRICS = ("first_response", "message_end", "get_db", "notification", "notification_update")
+
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[float]] = {metric: [] for metric in METRICS}
+        self.errors: Dict[str, int] = {}
+        self.events: Dict[str, int] = {}
+
+    def add(self, metric: str, seconds: float):
+        self.samples[metric].append(seconds)
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+    def summary(self) -> dict:
+        result = {}
+        for metric, values in self.samples.items():
+            if not values:
+                continue
+            p50, p95, p99 = np.percentile(values, [50, 95, 99]).tolist()
+            result[metric] = {"count": len(values), "p50": p50, "p95": p95, "p99": p99, "max": max(values)}
+        return result
+
+
+class Turn:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.first: Optional[float] = None
+        self.done = asyncio.Event()
+
+
+class LoadClient:
+    """One websocket connection, with a reader that times whatever it is waiting for."""
+
+    def __init__(self, url: str, client_id: str, recorder: Recorder):
+        self.url = url
+        self.client_id = client_id
+        self.recorder = recorder
+        self.websocket = None
+        self.reader = None
+        self.turn: Optional[Turn] = None
+        self.db_waiter: Optional[asyncio.Future] = None
+
+    async def connect(self):
+        self.websocket = await websockets.connect(f"{self.url}?client_id={self.client_id}", max_size=None)
+        self.reader = asyncio.create_task(self.read())
+
+    async def read(self):
+        try:
+            async for raw in self.websocket:
+                received = time.perf_counter()
+                message = json.loads(raw)
+                event = message.get("event")
+                self.recorder.events[event] = self.recorder.events.get(event, 0) + 1
+                if event == "message_response" and self.turn is not None and self.turn.first is None:
+                    self.turn.first = received
+                elif event == "message_end" and self.turn is not None:
+                    self.turn.done.set()
+                elif event == "db_response" and self.db_waiter is not None and not self.db_waiter.done():
+                    self.db_waiter.set_result(message)
+                elif event in ("notification", "notification_update"):
+                    sent_at = message.get("data", {}).get("sent_at")
+                    if sent_at is not None:
+                        self.recorder.add(event, time.time() - sent_at)
+        except websockets.ConnectionClosed:
+            pass
+
+    async def get_db(self, timeout: float) -> Optional[dict]:
+        self.db_waiter = asyncio.get_running_loop().create_future()
+        start = time.perf_counter()
+        await self.websocket.send(json.dumps({"event": "get_db"}))
+        try:
+            message = await asyncio.wait_for(self.db_waiter, timeout)
+        except asyncio.TimeoutError:
+            self.recorder.error("get_db_timeout")
+            return None
+        self.recorder.add("get_db", time.perf_counter() - start)
+        return message["data"]
+
+    async def chat(self, content: str, timeout: float):
+        self.turn = turn = Turn()
+        await self.websocket.send(json.dumps({"event": "message", "messages": [{"role": "user", "content": content}]}))
+        try:
+            await asyncio.wait_for(turn.done.wait(), timeout)
+        except asyncio.TimeoutError:
+            self.recorder.error("message_timeout")
+            return
+        finally:
+            self.turn = None
+        if turn.first is not None:
+            self.recorder.add("first_response", turn.first - turn.start)
+        self.recorder.add("message_end", time.perf_counter() - turn.start)
+
+    async def close(self):
+        if self.websocket is not None:
+            await self.websocket.close()
+        if self.reader is not None:
+            await self.reader
+
+
+async def run(args) -> dict:
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+
+    probe = LoadClient(args.url, "load-probe", recorder)
+    await probe.connect()
+    db = await probe.get_db(args.timeout)
+    await probe.close()
+    if db is None:
+        raise SystemExit("The server did not answer get_db")
+    recorder.samples["get_db"].clear()
+    turns = [
+        json.dumps({"location_name": name, "type": kind, "groups": groups, "food_mapping": mapping})
+        for name, kind, groups, mapping in writes(db["locations"], args.active * args.turns, args.seed)
+    ]
+
+    clients = [LoadClient(args.url, f"load-{i:05d}", recorder) for i in range(args.clients)]
+    connecting = asyncio.Semaphore(args.connect_concurrency)
+
+    async def connect(client):
+        async with connecting:
+            try:
+                await client.connect()
+            except (OSError, websockets.WebSocketException):
+                recorder.error("connect")
+
+    start = time.perf_counter()
+    await asyncio.gather(*(connect(client) for client in clients))
+    connected = [client for client in clients if client.websocket is not None]
+    print(f"{len(connected)}/{len(clients)} clients connected in {time.perf_counter() - start:.1f}s", flush=True)
+
+    async def converse(client, contents):
+        for i, content in enumerate(contents):
+            await asyncio.sleep(rng.uniform(0, args.think_ms / 1000))
+            if args.get_db_every and i % args.get_db_every == 0:
+                await client.get_db(args.timeout)
+            await client.chat(content, args.timeout)
+
+    active = connected[:args.active]
+    start = time.perf_counter()
+    await asyncio.gather(*(
+        converse(client, turns[i * args.turns:(i + 1) * args.turns]) for i, client in enumerate(active)
+    ))
+    elapsed = time.perf_counter() - start
+    # notifications of the last rounds are still being written and broadcast
+    await asyncio.sleep(args.drain)
+    await asyncio.gather(*(client.close() for client in connected), return_exceptions=True)
+
+    return {
+        "clients": len(connected),
+        "active": len(active),
+        "turns": len(recorder.samples["message_end"]),
+        "elapsed": elapsed,
+        "turns_per_second": len(recorder.samples["message_end"]) / elapsed if elapsed else 0.0,
+        "latency": recorder.summary(),
+        "errors": recorder.errors,
+        "events": recorder.events,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="ws://127.0.0.1:8000/ws")
+    parser.add_argument("--clients", type=int, default=1000)
+    parser.add_argument("--active", type=int, default=100, help="clients that chat, the rest only listen")
+    parser.add_argument("--turns", type=int, default=3, help="messages per active client")
+    parser.add_argument("--get-db-every", type=int, default=2, help="also send get_db every this many turns, 0 never")
+    parser.add_argument("--think-ms", type=float, default=1000, help="up to this long between turns")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--drain", type=float, default=5, help="seconds to keep listening after the last turn")
+    parser.add_argument("--connect-concurrency", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print(f"{report['turns']} turns from {report['active']} of {report['clients']} clients "
+          f"in {report['elapsed']:.1f}s ({report['turns_per_second']:.1f}/s)")
+    print(f"{'metric':<20} {'count':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    for metric, stats in report["latency"].items():
+        print(f"{metric:<20} {stats['count']:>7} {stats['p50'] * 1e3:>9.1f} {stats['p95'] * 1e3:>9.1f} "
+              f"{stats['p99'] * 1e3:>9.1f} {stats['max'] * 1e3:>9.1f}")
+    if report["errors"]:
+        print(f"errors: {report['errors']}")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
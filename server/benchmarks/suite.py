@@ -0,0 +1,301 @@
+"""
+Benchmark suite for matching, ingestion (save_items) and broadcast at several scales.
+
+Every case is timed over a number of rounds after a warm-up round, with fresh state built (and
+not timed) before each round. Results are printed and can be written to JSON, in the same shape
+as pytest-benchmark's, to compare runs across commits.
+
+Run from the server directory:
+    python -m benchmarks.suite --scales 1000,10000 --output results.json
+    python -m benchmarks.suite --scales 1000,10000 --compare results.json
+    python -m benchmarks.suite --filter matching --rounds 10
+"""
+import argparse
+import asyncio
+import copy
+import datetime
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.workload import generate, writes
+from matching import MatchBook
+
+# Above this many locations the dense per-category problems of "optimal" take too long to repeat
+OPTIMAL_MAX_LOCATIONS = 5000
+
+
+class Case:
+    def __init__(self, group: str, name: str, params: Dict[str, Any], setup: Callable[[], Any],
+                 run: Callable[[Any], Any], teardown: Optional[Callable[[Any], None]] = None,
+                 extra: Optional[Callable[[Any, Any], dict]] = None):
+        self.group = group
+        self.name = name
+        self.params = params
+        self.setup = setup
+        self.run = run
+        self.teardown = teardown
+        self.extra = extra
+
+    @property
+    def fullname(self) -> str:
+        params = ",".join(f"{key}={value}" for key, value in self.params.items())
+        return f"{self.group}.{self.name}[{params}]"
+
+
+def measure(case: Case, rounds: int, warmup: int = 1) -> dict:
+    times = []
+    extra = {}
+    for i in range(warmup + rounds):
+        state = case.setup()
+        start = time.perf_counter()
+        result = case.run(state)
+        elapsed = time.perf_counter() - start
+        if i >= warmup:
+            times.append(elapsed)
+            if case.extra is not None:
+                extra = case.extra(state, result)
+        if case.teardown is not None:
+            case.teardown(state)
+    return {
+        "group": case.group,
+        "name": case.fullname,
+        "params": case.params,
+        "stats": {
+            "min": min(times),
+            "max": max(times),
+            "mean": statistics.fmean(times),
+            "median": statistics.median(times),
+            "stddev": statistics.stdev(times) if len(times) > 1 else 0.0,
+            "rounds": len(times),
+            "ops": 1 / statistics.fmean(times),
+        },
+        "extra": extra,
+    }
+
+
+# Matching
+
+def matching_cases(scale: int, seed: int) -> List[Case]:
+    suppliers = scale // 3
+    locations = generate(suppliers, scale - suppliers, seed)
+
+    def fresh_book():
+        return MatchBook(copy.deepcopy(locations), metric="haversine")
+
+    def matched_book():
+        # A book whose full round is already committed, with a batch of new writes queued
+        book = fresh_book()
+        book.commit(book.match()[0])
+        for name, kind, groups, mapping in writes(book.locations, 100, seed + 1):
+            info = book.locations[name]
+            if kind == "supply":
+                info["surplus"].extend(groups)
+                info["surplus_mapping"].update(mapping)
+            else:
+                info["demand"].extend(groups)
+            book.record(name, groups)
+        return book
+
+    def round_and_commit(book):
+        assignments = book.match()[0]
+        book.commit(assignments)
+        return assignments
+
+    def assigned(_, result):
+        return {"assignments": len(result[0] if isinstance(result, tuple) else result)}
+
+    cases = [
+        Case("matching", "greedy_full", {"n": scale}, fresh_book, lambda book: book.match("greedy"), extra=assigned),
+        Case("matching", "incremental_100_writes", {"n": scale}, matched_book, round_and_commit, extra=assigned),
+    ]
+    if scale <= OPTIMAL_MAX_LOCATIONS:
+        cases.append(Case("matching", "optimal_full", {"n": scale}, fresh_book,
+                          lambda book: book.match("optimal"), extra=assigned))
+    return cases
+
+
+# Ingestion
+
+def ingestion_cases(scale: int, seed: int, calls: int = 1000) -> List[Case]:
+    from agents import AgentSwarm
+    from store import SQLiteStore
+
+    class QuietSwarm(AgentSwarm):
+        # No sockets to deliver to, the delta is still built
+        def broadcast(self, data):
+            return None
+
+    suppliers = scale // 3
+    locations = generate(suppliers, scale - suppliers, seed)
+    batch = list(writes(locations, calls, seed + 1))
+
+    def setup(with_store: bool):
+        def build():
+            db = {"locations": copy.deepcopy(locations)}
+            store = None
+            if with_store:
+                directory = tempfile.mkdtemp()
+                store = SQLiteStore(os.path.join(directory, "bench.db"))
+                store.replace(db)
+            swarm = QuietSwarm(None, db=db, book=MatchBook(db["locations"]), store=store, workers=1)
+            return swarm
+        return build
+
+    def run(swarm):
+        for name, kind, groups, mapping in batch:
+            swarm.save_items({}, name, kind, list(groups), mapping)
+
+    def teardown(swarm):
+        swarm.shutdown()
+        if swarm.store is not None:
+            swarm.store.close()
+            shutil.rmtree(os.path.dirname(swarm.store.path))
+
+    def per_call(_, __):
+        return {"calls": calls}
+
+    return [
+        Case("ingestion", "save_items", {"n": scale, "calls": calls}, setup(False), run, teardown, per_call),
+        Case("ingestion", "save_items_sqlite", {"n": scale, "calls": calls}, setup(True), run, teardown, per_call),
+    ]
+
+
+# Broadcast
+
+class FakeWebSocket:
+    """Accepts everything instantly, so only the manager's own cost is measured."""
+
+    def __init__(self, delivered: Callable[[], None]):
+        self.delivered = delivered
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text: str):
+        self.delivered()
+
+    async def send_json(self, data):
+        self.delivered()
+
+    async def close(self, code: int = 1000):
+        pass
+
+
+def broadcast_cases(scale: int, seed: int) -> List[Case]:
+    from socket_manager import ConnectionManager
+
+    clients = max(1, scale // 10)
+    locations = generate(scale // 3, scale - scale // 3, seed)
+    name = next(iter(locations))
+    # A typical db_delta for one location
+    message = {"event": "db_delta", "data": {"version": 1, "locations": {name: locations[name]}}}
+
+    def setup():
+        loop = asyncio.new_event_loop()
+        state = {"loop": loop, "count": 0, "done": None}
+
+        def delivered():
+            state["count"] += 1
+            if state["count"] == clients:
+                state["done"].set()
+
+        async def connect():
+            manager = ConnectionManager()
+            for i in range(clients):
+                await manager.connect(FakeWebSocket(delivered), f"client-{i}")
+            state["done"] = asyncio.Event()
+            return manager
+
+        state["manager"] = loop.run_until_complete(connect())
+        return state
+
+    def run(state):
+        async def fan_out():
+            report = await state["manager"].broadcast(message)
+            await state["done"].wait()
+            return report
+        return state["loop"].run_until_complete(fan_out())
+
+    def teardown(state):
+        async def close():
+            for client_id in list(state["manager"].active_connections):
+                await state["manager"].disconnect(client_id)
+            await asyncio.sleep(0)
+        state["loop"].run_until_complete(close())
+        state["loop"].close()
+
+    def delivered_count(state, report):
+        return {"clients": clients, "delivered": state["count"], "queued": sum(v == "queued" for v in report.values())}
+
+    return [Case("broadcast", "fan_out", {"clients": clients}, setup, run, teardown, delivered_count)]
+
+
+SUITES = {
+    "matching": matching_cases,
+    "ingestion": ingestion_cases,
+    "broadcast": broadcast_cases,
+}
+
+
+def machine_info() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "commit": commit,
+        "datetime": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "system": platform.system(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", default="1000,10000", help="numbers of locations, comma separated")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--filter", default="", help="only run cases whose name contains this")
+    parser.add_argument("--output", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="compare medians against a previous JSON file")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare) as f:
+            previous = {bench["name"]: bench for bench in json.load(f)["benchmarks"]}
+
+    results = []
+    print(f"{'case':<58} {'median ms':>10} {'min ms':>9} {'stddev':>8}  extra")
+    for scale in map(int, args.scales.split(",")):
+        for make_cases in SUITES.values():
+            for case in make_cases(scale, args.seed):
+                if args.filter not in case.fullname:
+                    continue
+                result = measure(case, args.rounds)
+                results.append(result)
+                stats = result["stats"]
+                line = (f"{result['name']:<58} {stats['median'] * 1e3:>10.2f} {stats['min'] * 1e3:>9.2f} "
+                        f"{stats['stddev'] * 1e3:>8.2f}  {result['extra']}")
+                before = previous.get(result["name"])
+                if before is not None:
+                    line += f"  {stats['median'] / before['stats']['median'] - 1:+.1%} vs previous"
+                print(line, flush=True)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"machine_info": machine_info(), "benchmarks": results}, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+"""
+Seeded synthetic workloads in the db["locations"] format.
+
+Locations are spread over a metro area the way real ones are: grouped around a number of
+neighbourhood centres, some much busier than others. Suppliers carry a few categories each with
+a handful of items, demanders ask for a few categories, and common categories (produce, baked
+goods) show up far more often than rare ones (seafood). The same seed always gives the same data.
+"""
+import math
+import random
+from typing import Dict, Iterator, List, Optional, Tuple
+
+CATEGORIES = ["fruits", "vegetables", "grains", "dairy", "meat", "seafood", "baked goods"]
+# How often each category comes up, relative to the others
+CATEGORY_WEIGHTS = [0.22, 0.22, 0.16, 0.14, 0.09, 0.04, 0.13]
+
+ITEMS = {
+    "fruits": ["apple", "banana", "strawberry", "orange", "grapes", "pear"],
+    "vegetables": ["carrot", "lettuce", "potato", "onion", "tomato", "broccoli"],
+    "grains": ["rice", "bread", "pasta", "oats", "flour"],
+    "dairy": ["milk", "cheese", "yogurt", "butter"],
+    "meat": ["chicken", "beef", "pork", "turkey"],
+    "seafood": ["salmon", "shrimp", "tuna", "cod"],
+    "baked goods": ["muffins", "cookies", "bagels", "croissants", "pie"],
+}
+
+# Detroit, where the seed data in db.py lives
+CENTER = (42.33, -83.15)
+KM_PER_DEGREE = 111.32
+
+
+def clusters(count: int, rng: random.Random, center: Tuple[float, float] = CENTER,
+             radius_km: float = 40.0) -> List[Tuple[float, float]]:
+    """Neighbourhood centres, uniformly spread over a disc around `center`."""
+    result = []
+    for _ in range(count):
+        distance = radius_km * math.sqrt(rng.random())
+        angle = rng.uniform(0, 2 * math.pi)
+        result.append(_offset(center, distance * math.cos(angle), distance * math.sin(angle)))
+    return result
+
+
+def _offset(origin: Tuple[float, float], north_km: float, east_km: float) -> Tuple[float, float]:
+    lat = origin[0] + north_km / KM_PER_DEGREE
+    lon = origin[1] + east_km / (KM_PER_DEGREE * math.cos(math.radians(origin[0])))
+    return lat, lon
+
+
+def _place(rng: random.Random, centres: List[Tuple[float, float]], weights: List[float], spread_km: float):
+    centre = rng.choices(centres, weights)[0]
+    return _offset(centre, rng.gauss(0, spread_km), rng.gauss(0, spread_km))
+
+
+def _categories(rng: random.Random, low: int, high: int) -> List[str]:
+    count = rng.randint(low, high)
+    chosen = []
+    while len(chosen) < count:
+        category = rng.choices(CATEGORIES, CATEGORY_WEIGHTS)[0]
+        if category not in chosen:
+            chosen.append(category)
+    return chosen
+
+
+def surplus(rng: random.Random, max_categories: int = 4, max_items: int = 8) -> Dict[str, List[str]]:
+    """A surplus_mapping: a few categories, each with a skewed number of items (mostly small)."""
+    mapping = {}
+    for category in _categories(rng, 1, max_categories):
+        count = min(max_items, 1 + int(rng.expovariate(1 / 2.5)))
+        mapping[category] = [f"{rng.choice(ITEMS[category])}-{rng.randrange(10 ** 6):06d}" for _ in range(count)]
+    return mapping
+
+
+def demand(rng: random.Random, max_units: int = 6) -> List[str]:
+    """A demand list: categories drawn by weight, repeats meaning more than one unit."""
+    return rng.choices(CATEGORIES, CATEGORY_WEIGHTS, k=rng.randint(1, max_units))
+
+
+def generate(suppliers: int, demanders: int, seed: int = 0, neighbourhoods: Optional[int] = None,
+             spread_km: float = 2.0, radius_km: float = 40.0) -> Dict[str, dict]:
+    """
+    `suppliers` + `demanders` locations, as in db["locations"].
+
+    Args:
+        neighbourhoods: How many clusters the locations are grouped in, about one per 200
+            locations if None. Cluster sizes follow a Zipf-like curve.
+        spread_km: Standard deviation of a location around its cluster centre.
+        radius_km: Radius of the area the cluster centres are spread over.
+    """
+    rng = random.Random(seed)
+    count = neighbourhoods or max(1, (suppliers + demanders) // 200)
+    centres = clusters(count, rng, radius_km=radius_km)
+    weights = [1 / (rank + 1) for rank in range(count)]
+    locations = {}
+    for i in range(suppliers):
+        lat, lon = _place(rng, centres, weights, spread_km)
+        mapping = surplus(rng)
+        locations[f"supplier-{i:06d}"] = {
+            "surplus": list(mapping),
+            "surplus_mapping": mapping,
+            "data": {"lat": lat, "lon": lon, "address": f"{i} Supplier St"},
+        }
+    for i in range(demanders):
+        lat, lon = _place(rng, centres, weights, spread_km)
+        locations[f"demander-{i:06d}"] = {
+            "demand": demand(rng),
+            "data": {"lat": lat, "lon": lon, "address": f"{i} Demander Ave"},
+        }
+    return locations
+
+
+def writes(locations: Dict[str, dict], count: int, seed: int = 0) -> Iterator[tuple]:
+    """
+    `count` save_items calls as (location_name, type, groups, food_mapping), against existing locations.
+
+    Suppliers report new surplus and demanders new demand, as the Supply Agent would.
+    """
+    rng = random.Random(seed)
+    suppliers = [name for name, info in locations.items() if "surplus_mapping" in info]
+    demanders = [name for name, info in locations.items() if "surplus_mapping" not in info]
+    share = len(suppliers) / max(1, len(suppliers) + len(demanders))
+    for _ in range(count):
+        if suppliers and rng.random() < share:
+            mapping = surplus(rng, max_categories=2, max_items=4)
+            yield rng.choice(suppliers), "supply", list(mapping), mapping
+        elif demanders:
+            yield rng.choice(demanders), "demand", demand(rng, max_units=3), {}
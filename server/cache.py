@@ -0,0 +1,128 @@
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Thread-safe LRU cache whose entries also expire `ttl` seconds after they were stored.
+
+    With a `path`, every entry is written through to a SQLite file as well, so the cache
+    survives restarts: a key that is not loaded yet is looked up on disk before it counts as a
+    miss. An entry evicted from memory is deleted from the file too, and the file keeps at most
+    the `maxsize` newest entries, also counting those left from before a restart. Values must
+    be JSON serialisable to be stored on disk.
+    """
+
+    def __init__(self, maxsize: int = 1024, ttl: Optional[float] = None, path: Optional[str] = None,
+                 clock: Callable[[], float] = time.time):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key: (value, stored_at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+        self._disk = None
+        if path:
+            self._disk = sqlite3.connect(path, check_same_thread=False)
+            self._disk.execute("CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value TEXT, stored_at REAL)")
+            if ttl is not None:
+                self._disk.execute("DELETE FROM cache WHERE stored_at < ?", (self.clock() - ttl,))
+            self._trim()
+            self._disk.commit()
+
+    def _expired(self, stored_at: float) -> bool:
+        return self.ttl is not None and self.clock() - stored_at > self.ttl
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and self._expired(entry[1]):
+                del self._entries[key]
+                self.expirations += 1
+                entry = None
+            if entry is None and self._disk is not None:
+                entry = self._load(key)
+                if entry is not None:
+                    self._store(key, entry)
+            if entry is None:
+                self.misses += 1
+                return default
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any):
+        with self._lock:
+            entry = (value, self.clock())
+            self._store(key, entry)
+            if self._disk is not None:
+                self._disk.execute(
+                    "INSERT OR REPLACE INTO cache (key, value, stored_at) VALUES (?, ?, ?)",
+                    (_disk_key(key), json.dumps(value), entry[1]),
+                )
+                self._trim()
+                self._disk.commit()
+
+    def _store(self, key: Hashable, entry: tuple):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        evicted = []
+        while len(self._entries) > self.maxsize:
+            evicted.append(self._entries.popitem(last=False)[0])
+            self.evictions += 1
+        if evicted and self._disk is not None:
+            self._disk.executemany("DELETE FROM cache WHERE key = ?", [(_disk_key(key),) for key in evicted])
+            self._disk.commit()
+
+    def _trim(self):
+        self._disk.execute(
+            "DELETE FROM cache WHERE key NOT IN (SELECT key FROM cache ORDER BY stored_at DESC LIMIT ?)",
+            (self.maxsize,),
+        )
+
+    def _load(self, key: Hashable) -> Optional[tuple]:
+        row = self._disk.execute("SELECT value, stored_at FROM cache WHERE key = ?", (_disk_key(key),)).fetchone()
+        if row is None:
+            return None
+        if self._expired(row[1]):
+            self.expirations += 1
+            return None
+        return (json.loads(row[0]), row[1])
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self._lock:
+            entry = self._entries.get(key)
+            return entry is not None and not self._expired(entry[1])
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            if self._disk is not None:
+                self._disk.execute("DELETE FROM cache")
+                self._disk.commit()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "size": len(self._entries),
+        }
+
+
+def _disk_key(key: Hashable) -> str:
+    return key if isinstance(key, str) else json.dumps(key)
@@ -0,0 +1,184 @@
+import copy
+import operator
+import threading
+import uuid
+from collections import deque
+from typing import Any, Dict, Iterable, Optional, Set, Tuple
+
+
+class ChangeLog:
+    """
+    A version number for the db and a bounded log of what each version changed.
+
+    Every write records the locations (and top-level keys such as "dispatchs") it touched and
+    gets the next version. A client that last saw version N can then be sent only what changed
+    after N. Once the log holds more than `size` names the oldest versions are dropped, and a
+    client behind them gets a full snapshot instead.
+
+    The epoch changes whenever versions stop being comparable (a restart, or set_db replacing
+    everything), so a client holding a version from another epoch also gets a snapshot.
+
+    Everything delta() returns is a copy, so it can be serialised after the db lock is released
+    while writers carry on. Copies are shared between readers and must not be modified.
+
+    Snapshots are copied on write: the one for the current version is cached, and the next one
+    only copies the locations and top-level keys changed since. Within a top-level list such as
+    "dispatchs", only the elements that were not there before are copied; writers replace list
+    elements, they never change them in place.
+    """
+
+    def __init__(self, size: int = 10000):
+        self.size = size
+        self.epoch = uuid.uuid4().hex[:12]
+        self.version = 0
+        # the log covers every change made after this version
+        self.floor = 0
+        self._log: deque = deque()  # (version, locations, keys)
+        self._names = 0
+        self._lock = threading.Lock()
+        self._snapshot = None  # (epoch, version, db copy)
+        self._keys = None  # (epoch, version, {top-level key: (value, copy)})
+
+    def record(self, locations: Iterable[str] = (), keys: Iterable[str] = ()) -> int:
+        """Log a write and return its version."""
+        locations, keys = tuple(locations), tuple(keys)
+        with self._lock:
+            self.version += 1
+            self._log.append((self.version, locations, keys))
+            self._names += len(locations) + len(keys)
+            while self._names > self.size and len(self._log) > 1:
+                version, dropped, dropped_keys = self._log.popleft()
+                self._names -= len(dropped) + len(dropped_keys)
+                self.floor = version
+            return self.version
+
+    def reset(self):
+        """Forget the log, every client gets a snapshot next time."""
+        with self._lock:
+            self.epoch = uuid.uuid4().hex[:12]
+            self.version += 1
+            self.floor = self.version
+            self._log.clear()
+            self._names = 0
+            self._snapshot = None
+            self._keys = None
+
+    def changed_since(self, version: Optional[int], epoch: Optional[str] = None) -> Optional[Tuple[int, Set[str], Set[str]]]:
+        """
+        The current version and the locations and keys changed after `version`.
+
+        Returns None when the log cannot answer that, because `version` is missing, older than
+        the log, newer than the current version, or from another epoch.
+        """
+        with self._lock:
+            if version is None or (epoch is not None and epoch != self.epoch) or not self.floor <= version <= self.version:
+                return None
+            locations, keys = set(), set()
+            for logged, names, logged_keys in reversed(self._log):
+                if logged <= version:
+                    break
+                locations.update(names)
+                keys.update(logged_keys)
+            return self.version, locations, keys
+
+    def delta(self, db: Dict[str, Any], since_version: Optional[int], epoch: Optional[str] = None) -> Dict[str, Any]:
+        """
+        What a client at `since_version` needs to catch up with `db`.
+
+        Either {"full": False, "locations": changed locations, "deleted": removed location names,
+        "keys": changed top-level keys, "deleted_keys": removed keys} or, when the log cannot
+        answer, {"full": True, "db": db}. Both also carry the epoch and the version they bring
+        the client to.
+        """
+        changed = self.changed_since(since_version, epoch)
+        if changed is None:
+            return {"epoch": self.epoch, "version": self.version, "full": True, "db": self.snapshot(db)}
+        version, names, keys = changed
+        locations = db.get("locations", {})
+        copies = self._copy_keys(db) if keys else {}
+        return {
+            "epoch": self.epoch,
+            "version": version,
+            "since_version": since_version,
+            "full": False,
+            "locations": {name: copy.deepcopy(locations[name]) for name in sorted(names) if name in locations},
+            "deleted": sorted(name for name in names if name not in locations),
+            "keys": {key: copies[key] for key in sorted(keys) if key in copies},
+            "deleted_keys": sorted(key for key in keys if key not in db),
+        }
+
+    def cached(self, since_version: Optional[int], epoch: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """
+        The full delta() for a client that needs a snapshot, when the one for the current version
+        is already cached. Does not need the db lock; None if the client can get a delta instead,
+        or if the snapshot has to be made first.
+        """
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot[:2] != (self.epoch, self.version):
+                return None
+        if self.changed_since(since_version, epoch) is not None:
+            return None
+        return {"epoch": snapshot[0], "version": snapshot[1], "full": True, "db": snapshot[2]}
+
+    def snapshot(self, db: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        A copy of `db` as of the current version, shared by every reader until the next write.
+
+        Must be called while writers are held off (under the db lock) and must not be modified.
+        """
+        previous = self._snapshot
+        if previous is not None and previous[:2] == (self.epoch, self.version):
+            return previous[2]
+        changed = None
+        if previous is not None and previous[0] == self.epoch:
+            changed = self.changed_since(previous[1])
+        locations = db.get("locations", {})
+        if changed is None:
+            snapshot_locations = copy.deepcopy(locations)
+        else:
+            # Reuse the copies of every location that did not change since the last snapshot
+            snapshot_locations = dict(previous[2]["locations"])
+            for name in changed[1]:
+                if name in locations:
+                    snapshot_locations[name] = copy.deepcopy(locations[name])
+                else:
+                    snapshot_locations.pop(name, None)
+        snapshot = self._copy_keys(db)
+        snapshot["locations"] = snapshot_locations
+        self._snapshot = (self.epoch, self.version, snapshot)
+        return snapshot
+
+    def _copy_keys(self, db: Dict[str, Any]) -> Dict[str, Any]:
+        # Copies of the top-level keys other than "locations" as of the current version, made from
+        # those of the last version copied, under the db lock like snapshot()
+        previous = self._keys
+        if previous is None or previous[0] != self.epoch:
+            previous, changed = None, None
+        elif previous[1] == self.version:
+            changed = (self.version, set(), set())
+        else:
+            changed = self.changed_since(previous[1])
+        copies = {}
+        for key, value in db.items():
+            if key == "locations":
+                continue
+            last = previous[2].get(key) if previous is not None else None
+            if changed is not None and key not in changed[2] and last is not None and last[0] is value:
+                copies[key] = last
+            else:
+                copies[key] = (value, _copy(value, last))
+        self._keys = (self.epoch, self.version, copies)
+        return {key: copied for key, (_, copied) in copies.items()}
+
+
+def _copy(value: Any, last: Optional[Tuple[Any, Any]]) -> Any:
+    # A deep copy, reusing the copies of the list elements `last` (value, copy) already had
+    if not isinstance(value, list) or last is None or not isinstance(last[0], list):
+        return copy.deepcopy(value)
+    old, old_copy = last
+    if len(value) >= len(old) and all(map(operator.is_, value, old)):
+        # appended to, the usual case
+        return old_copy + [copy.deepcopy(item) for item in value[len(old):]]
+    reuse = {id(item): copied for item, copied in zip(old, old_copy)}
+    return [reuse[id(item)] if id(item) in reuse else copy.deepcopy(item) for item in value]
@@ -1,3 +1,32 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from changes import ChangeLog
+from matching import MatchBook
+from store import SQLiteStore
+from travel import TravelMatrix
+
+# "euclidean" (raw degrees), "haversine" or "equirectangular", see distance.METRICS
+DISTANCE_METRIC = os.getenv("DISTANCE_METRIC", "euclidean")
+
+# Path of a SQLite file that keeps the database across restarts, memory only if unset
+DB_PATH = os.getenv("DB_PATH")
+
+# Path of a travel time matrix built with travel.py, to match by drive time instead of DISTANCE_METRIC
+TRAVEL_MATRIX_PATH = os.getenv("TRAVEL_MATRIX_PATH")
+travel = TravelMatrix(TRAVEL_MATRIX_PATH) if TRAVEL_MATRIX_PATH else None
+
+# Worker processes that match large rounds by geographic shard, see sharding.py; 0 matches in-process
+MATCH_SHARD_WORKERS = int(os.getenv("MATCH_SHARD_WORKERS", "0"))
+SHARD_SIZE_DEG = float(os.getenv("SHARD_SIZE_DEG", "0.25"))
+SHARD_THRESHOLD = int(os.getenv("SHARD_THRESHOLD", "5000"))
+# spawn, as forking a process that runs threads can copy a held lock into the child
+shard_executor = ProcessPoolExecutor(
+    MATCH_SHARD_WORKERS, mp_context=multiprocessing.get_context("spawn")
+) if MATCH_SHARD_WORKERS > 0 else None
+
 db = {
     "locations": {
         # Suppliers
@@ -65,11 +94,60 @@ db = {
     }
 }
 
+# get_db() is always served from memory, the store only gets written through
+store = SQLiteStore(DB_PATH) if DB_PATH else None
+if store is not None:
+    if store.is_empty():
+        store.replace(db)
+    else:
+        db = store.load()
+
+# Versions every write so clients can fetch only what changed, see changes.ChangeLog
+changes = ChangeLog(int(os.getenv("CHANGELOG_SIZE", "10000")))
+
+# Held by every write to db, the store and the change log, and by reads that need a consistent
+# view. Reentrant, so a tool can call helpers that take it again. The book's indexes have their
+# own lock, see MatchBook, which is always taken before this one.
+lock = threading.RLock()
+
+def new_book(locations):
+    return MatchBook(locations, metric=DISTANCE_METRIC, travel=travel, executor=shard_executor,
+                     shard_size=SHARD_SIZE_DEG, shard_threshold=SHARD_THRESHOLD)
+
+# Open supply and demand by category, kept in sync with db["locations"] by save_items and the matcher
+book = new_book(db["locations"])
+
 def get_db():
     return db
 
+def get_book():
+    return book
+
+def get_store():
+    return store
+
+def get_changes():
+    return changes
+
+def get_lock():
+    return lock
+
+def read(since_version=None, epoch=None):
+    """A consistent delta or snapshot of the db for a client, see ChangeLog.delta."""
+    # Clients that need a snapshot share the cached one without waiting for writers
+    cached = changes.cached(since_version, epoch)
+    if cached is not None:
+        return cached
+    with lock:
+        return changes.delta(db, since_version, epoch)
+
 def set_db(new_db):
-    global db
-    db = new_db 
+    global db, book
+    with lock:
+        db = new_db
+        book = new_book(db.setdefault("locations", {}))
+        if store is not None:
+            store.replace(db)
+        changes.reset()
     return True
 
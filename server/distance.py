@@ -0,0 +1,124 @@
+import math
+from typing import Tuple
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Euclidean works on raw degrees (the original matcher metric), the others return kilometres
+METRICS = ("euclidean", "haversine", "equirectangular")
+
+
+def calculate_distance(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """
+    Calculate the Euclidean distance between two geographical points.
+
+    Args:
+        lat1, lon1: Latitude and Longitude of the first point.
+        lat2, lon2: Latitude and Longitude of the second point.
+
+    Returns:
+        Euclidean distance as a float.
+    """
+    return math.sqrt((lat1 - lat2) ** 2 + (lon1 - lon2) ** 2)
+
+
+def check_metric(metric: str):
+    if metric not in METRICS:
+        raise ValueError(f"Unknown distance metric {metric!r}, expected one of {METRICS}")
+
+
+def _distance(lat1, lon1, lat2, lon2, metric: str) -> np.ndarray:
+    """Element-wise distance between broadcastable coordinate arrays."""
+    if metric == "euclidean":
+        return np.sqrt((lat1 - lat2) ** 2 + (lon1 - lon2) ** 2)
+
+    lat1, lon1, lat2, lon2 = (np.radians(x) for x in (lat1, lon1, lat2, lon2))
+    if metric == "haversine":
+        a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+    if metric == "equirectangular":
+        x = (lon2 - lon1) * np.cos((lat1 + lat2) / 2)
+        return EARTH_RADIUS_KM * np.sqrt(x ** 2 + (lat2 - lat1) ** 2)
+    check_metric(metric)
+
+
+def distances_from(lat: float, lon: float, lats, lons, metric: str = "euclidean") -> np.ndarray:
+    """
+    Distances from one point to many.
+
+    Args:
+        lat, lon: The query point.
+        lats, lons: Array-likes of the other points' coordinates.
+        metric: One of METRICS.
+
+    Returns:
+        1-D array with one distance per point.
+    """
+    check_metric(metric)
+    return _distance(lat, lon, np.asarray(lats, dtype=np.float64), np.asarray(lons, dtype=np.float64), metric)
+
+
+def distance_matrix(origins, destinations, metric: str = "euclidean") -> np.ndarray:
+    """
+    Distances between every origin and every destination in one vectorised call.
+
+    Args:
+        origins: (n, 2) array-like of (lat, lon) rows, e.g. the demanders.
+        destinations: (m, 2) array-like of (lat, lon) rows, e.g. the suppliers.
+        metric: One of METRICS.
+
+    Returns:
+        (n, m) array where [i, j] is the distance from origins[i] to destinations[j].
+    """
+    check_metric(metric)
+    origins = np.asarray(origins, dtype=np.float64).reshape(-1, 2)
+    destinations = np.asarray(destinations, dtype=np.float64).reshape(-1, 2)
+    return _distance(origins[:, :1], origins[:, 1:], destinations[:, 0], destinations[:, 1], metric)
+
+
+def nearest_k(origins, destinations, k: int, metric: str = "euclidean") -> Tuple[np.ndarray, np.ndarray]:
+    """
+    The k nearest destinations of every origin.
+
+    Rows are ordered nearest first, with ties broken by destination index.
+
+    Returns:
+        indices: (n, k) array of destination indices.
+        distances: (n, k) array of the matching distances.
+    """
+    matrix = distance_matrix(origins, destinations, metric)
+    n, m = matrix.shape
+    k = min(k, m)
+    if k == 0:
+        return np.empty((n, 0), dtype=np.intp), np.empty((n, 0))
+    if k < m:
+        part = np.argpartition(matrix, k - 1, axis=1)[:, :k]
+    else:
+        part = np.broadcast_to(np.arange(m), (n, m))
+    dists = np.take_along_axis(matrix, part, axis=1)
+    # Sort each row by distance, then by index
+    order = np.lexsort((part, dists), axis=1)
+    return np.take_along_axis(part, order, axis=1), np.take_along_axis(dists, order, axis=1)
+
+
+def lower_bound(degrees: float, max_abs_lat: float, metric: str = "euclidean") -> float:
+    """
+    Smallest possible distance between two points that differ by at least `degrees`
+    in latitude or in longitude, with both points within `max_abs_lat` of the equator.
+
+    Used by the spatial index to decide when a grid search can stop. Longitude
+    differences are not wrapped at the antimeridian.
+    """
+    if degrees <= 0:
+        return 0.0
+    if metric == "euclidean":
+        return degrees
+    d = math.radians(degrees)
+    cos_lat = math.cos(math.radians(min(max_abs_lat, 90.0)))
+    if metric == "haversine":
+        along_lon = 2 * math.asin(min(1.0, cos_lat * math.sin(min(d, math.pi) / 2)))
+        return EARTH_RADIUS_KM * min(d, along_lon)
+    if metric == "equirectangular":
+        return EARTH_RADIUS_KM * d * cos_lat
+    check_metric(metric)
@@ -0,0 +1,216 @@
+import math
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+
+def greedy_transportation(cost, supply, demand) -> np.ndarray:
+    """
+    Nearest-first allocation, the same rule as the greedy heap in matching.greedy_match.
+
+    Cells are taken cheapest first (ties by row, then column) and each gets as much as both
+    its supplier and its demander still allow.
+
+    Args:
+        cost: (m, n) array of per-unit costs.
+        supply: m quantities available.
+        demand: n quantities needed.
+
+    Returns:
+        (m, n) integer array of shipped quantities.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    supply = np.array(supply, dtype=np.int64)
+    demand = np.array(demand, dtype=np.int64)
+    m, n = cost.shape
+    flow = np.zeros((m, n), dtype=np.int64)
+    left_supply, left_demand = supply.tolist(), demand.tolist()
+    remaining = min(sum(left_supply), sum(left_demand))
+    for cell in np.argsort(cost, axis=None, kind="stable").tolist():
+        if remaining == 0:
+            break
+        i, j = divmod(cell, n)
+        quantity = min(left_supply[i], left_demand[j])
+        if quantity > 0:
+            flow[i, j] = quantity
+            left_supply[i] -= quantity
+            left_demand[j] -= quantity
+            remaining -= quantity
+    return flow
+
+
+def solve_transportation(cost, supply, demand, max_iterations: Optional[int] = None) -> np.ndarray:
+    """
+    Minimum-cost allocation of supply to demand (the transportation problem).
+
+    Ships as many units as possible, min(sum(supply), sum(demand)), at the lowest total
+    cost. Solved with the transportation simplex (network simplex on the bipartite graph):
+    it starts from the greedy allocation and pivots on the most negative reduced cost until
+    no pivot improves the cost, which certifies the result is optimal.
+
+    Args:
+        cost: (m, n) array of per-unit costs.
+        supply: m quantities available.
+        demand: n quantities needed.
+        max_iterations: Pivot limit; the best allocation found so far is returned when it is hit.
+
+    Returns:
+        (m, n) integer array of shipped quantities.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    supply = np.array(supply, dtype=np.int64)
+    demand = np.array(demand, dtype=np.int64)
+    m, n = cost.shape
+    if m == 0 or n == 0:
+        return np.zeros((m, n), dtype=np.int64)
+
+    # Balance the problem with a dummy row or column. Every dummy cell costs the same, so it
+    # does not change which real cells are optimal; making it the most expensive keeps the
+    # greedy start from routing real units through it.
+    excess = int(supply.sum() - demand.sum())
+    dummy_cost = (cost.max() + 1) if cost.size else 1.0
+    if excess > 0:
+        cost = np.hstack([cost, np.full((m, 1), dummy_cost)])
+        demand = np.append(demand, excess)
+    elif excess < 0:
+        cost = np.vstack([cost, np.full((1, n), dummy_cost)])
+        supply = np.append(supply, -excess)
+    rows, cols = cost.shape
+
+    flow = greedy_transportation(cost, supply, demand)
+    basis = _spanning_basis(cost, flow)
+
+    if max_iterations is None:
+        max_iterations = 50 * (rows + cols)
+    tolerance = 1e-9 * max(1.0, float(np.abs(cost).max()))
+    for _ in range(max_iterations):
+        u, v, parent, depth = _potentials(cost, basis, rows, cols)
+        reduced = cost - u[:, None] - v[None, :]
+        entering = int(np.argmin(reduced))
+        if reduced.flat[entering] >= -tolerance:
+            break
+        i, j = divmod(entering, cols)
+
+        # The cycle closed by the entering cell runs row i -> ... -> column j through the tree,
+        # its cells alternate between losing and gaining flow starting with a loss
+        path = _tree_path(i, rows + j, parent, depth)
+        cells = [_cell(a, b, rows) for a, b in zip(path, path[1:])]
+        losing = cells[0::2]
+        theta, leaving = min((flow[cell], k) for k, cell in enumerate(losing))
+        for cell in losing:
+            flow[cell] -= theta
+        for cell in cells[1::2]:
+            flow[cell] += theta
+        flow[i, j] += theta
+        basis.discard(losing[leaving])
+        basis.add((i, j))
+
+    return flow[:m, :n]
+
+
+def _cell(a: int, b: int, rows: int) -> Tuple[int, int]:
+    """Grid cell of the tree edge between nodes a and b (rows first, then columns)."""
+    if a < rows:
+        return (a, b - rows)
+    return (b, a - rows)
+
+
+def _spanning_basis(cost: np.ndarray, flow: np.ndarray) -> set:
+    """
+    The cells carrying flow, padded with zero-flow cells into a spanning tree of the
+    rows + columns graph, as the simplex needs rows + columns - 1 basic cells.
+    """
+    rows, cols = cost.shape
+    root = list(range(rows + cols))
+
+    def find(x):
+        while root[x] != x:
+            root[x] = root[root[x]]
+            x = root[x]
+        return x
+
+    basis = set()
+    for i, j in zip(*np.nonzero(flow)):
+        i, j = int(i), int(j)
+        root[find(i)] = find(rows + j)
+        basis.add((i, j))
+    for cell in np.argsort(cost, axis=None, kind="stable").tolist():
+        if len(basis) == rows + cols - 1:
+            break
+        i, j = divmod(cell, cols)
+        a, b = find(i), find(rows + j)
+        if a != b:
+            root[a] = b
+            basis.add((i, j))
+    return basis
+
+
+def _potentials(cost: np.ndarray, basis: set, rows: int, cols: int):
+    """Dual values u, v with u[i] + v[j] == cost[i, j] on every basic cell, plus the tree rooted at row 0."""
+    adjacent: List[List[int]] = [[] for _ in range(rows + cols)]
+    for i, j in basis:
+        adjacent[i].append(rows + j)
+        adjacent[rows + j].append(i)
+    potential = [0.0] * (rows + cols)
+    parent = [-1] * (rows + cols)
+    depth = [0] * (rows + cols)
+    stack = [0]
+    visited = [False] * (rows + cols)
+    visited[0] = True
+    while stack:
+        node = stack.pop()
+        for other in adjacent[node]:
+            if visited[other]:
+                continue
+            visited[other] = True
+            parent[other] = node
+            depth[other] = depth[node] + 1
+            i, j = _cell(node, other, rows)
+            # u[i] + v[j] = c[i, j]
+            potential[other] = cost[i, j] - potential[node]
+            stack.append(other)
+    potential = np.array(potential)
+    return potential[:rows], potential[rows:], parent, depth
+
+
+def _tree_path(a: int, b: int, parent: List[int], depth: List[int]) -> List[int]:
+    """Nodes on the tree path from a to b, both included."""
+    head, tail = [a], [b]
+    while a != b:
+        if depth[a] >= depth[b]:
+            a = parent[a]
+            head.append(a)
+        else:
+            b = parent[b]
+            tail.append(b)
+    # Both halves end at the common ancestor
+    return head + tail[-2::-1]
+
+
+def transportation_cost(cost, flow) -> float:
+    return float((np.asarray(cost, dtype=np.float64) * flow).sum())
+
+
+def minimum_transportation_cost(providers: List[List[float]], recipients: List[List[float]],
+                                weights: List[List[float]]) -> int:
+    """
+    Solve the supply chain problem from Leetcode_problem.md.
+
+    Args:
+        providers: [Px, Py, i1, ..., ik] per provider.
+        recipients: [Rx, Ry, d1, ..., dk] per recipient.
+        weights: weights[p][r] multiplies the distance between provider p and recipient r.
+
+    Returns:
+        The minimum total transportation cost, rounded to the nearest integer.
+    """
+    providers = np.asarray(providers, dtype=np.float64)
+    recipients = np.asarray(recipients, dtype=np.float64)
+    distance = np.sqrt(((providers[:, None, :2] - recipients[None, :, :2]) ** 2).sum(axis=2))
+    cost = distance * np.asarray(weights, dtype=np.float64)
+    total = 0.0
+    for item in range(providers.shape[1] - 2):
+        supply = providers[:, 2 + item].astype(np.int64)
+        demand = recipients[:, 2 + item].astype(np.int64)
+        total += transportation_cost(cost, solve_transportation(cost, supply, demand))
+    return int(math.floor(total + 0.5))
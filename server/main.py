@@ -3,14 +3,54 @@ from dotenv import load_dotenv
 load_dotenv()  # take environment variables from .env.
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, File, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from typing import Optional
+from contextlib import asynccontextmanager
+import asyncio
+import os
 import uvicorn
 from socket_manager import ConnectionManager
-from db import get_db
-from agents import AgentSwarm
+from db import get_book, get_changes, get_lock, read
+from agents import AgentSwarm, Session, dispatch_executor, notification_cache
+from metrics import REGISTRY, Gauge
+from streaming import CoalescingStats, coalesce
 
 
-app = FastAPI()
+manager = ConnectionManager()
+
+# One agent runtime for the whole process, connections only get a Session
+swarm = AgentSwarm(manager)
+
+# Tokens are merged into one message_response frame per window, or sooner once the text gets long
+COALESCE_WINDOW_MS = float(os.getenv("COALESCE_WINDOW_MS", "40"))
+COALESCE_MAX_CHARS = int(os.getenv("COALESCE_MAX_CHARS", "256"))
+coalescing_stats = CoalescingStats()
+
+# Read when /metrics is scraped
+Gauge("ws_connections", "Open websocket connections.", function=lambda: len(manager.active_connections))
+Gauge("ws_outbox_messages", "Messages waiting in client outboxes.", function=lambda: manager.queued())
+Gauge("executor_queue_depth", "Tasks waiting for a free worker, by pool.", ["pool"], function=lambda: {
+    ("swarm",): swarm.executor.queued,
+    ("dispatch",): dispatch_executor.queued,
+    ("tools",): swarm.tools.executor.queued,
+})
+Gauge("db_version", "Version of the latest db write.", function=lambda: get_changes().version)
+Gauge("ws_coalescing", "Token coalescing into message_response frames since startup, see CoalescingStats.", ["stat"],
+      function=lambda: {(name,): value for name, value in coalescing_stats.snapshot().items()})
+Gauge("notification_cache", "Hits, misses, evictions and expirations of the notification text cache since startup, "
+      "and its size.", ["stat"], function=lambda: {(name,): value for name, value in notification_cache.stats().items()})
+chat_turns = Gauge("chat_turns_active", "Chat turns being streamed, including those waiting for a worker.")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Tools run on worker threads and broadcast back onto the loop that owns the sockets
+    swarm.bind_loop(asyncio.get_running_loop())
+    yield
+    swarm.shutdown()
+
+
+app = FastAPI(lifespan=lifespan)
 origins = [
     "http://localhost:3000",  # Your React frontend
     # Add other origins if needed
@@ -26,7 +66,25 @@ app.add_middleware(
     allow_headers=["*"],            # Allow all headers
 )
 
-manager = ConnectionManager()
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+
+def read_inventory(category=None):
+    book = get_book()
+    # The book's lock first, as a matching round holds it while it takes the db lock
+    with book.lock, get_lock():
+        book.sync()
+        inventory = book.inventory
+        if category is None:
+            return inventory.summary()
+        return {
+            "category": category,
+            "suppliers": inventory.suppliers(category),
+            "demanders": inventory.demanders(category),
+        }
+
 
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket, client_id: Optional[str] = None):
@@ -38,8 +96,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: Optional[str] = No
         return
     # save this client into server memory
     await manager.connect(websocket, client_id)
-    db = get_db()
-    swarm = AgentSwarm(db, manager, websocket)
+    session = Session(client_id, websocket, swarm)
     try:
         while True:
             data = await websocket.receive_json()
@@ -48,21 +105,40 @@ async def websocket_endpoint(websocket: WebSocket, client_id: Optional[str] = No
             print(event)
             if event == "get_db":
                 # Retrieve all calls from the database
-                db = get_db()
-                message = {
-                    "event": "db_response",
-                    "data": db,
-                }
+                # A client that sends the version it has only gets what changed since. Reading waits
+                # for a write in progress, so it happens on a worker thread
+                delta = await asyncio.to_thread(read, data.get("since_version"), data.get("epoch"))
+                if delta["full"]:
+                    message = {
+                        "event": "db_response",
+                        "data": delta["db"],
+                        "epoch": delta["epoch"],
+                        "version": delta["version"],
+                    }
+                else:
+                    message = {
+                        "event": "db_delta",
+                        "data": delta,
+                    }
                 
                 # Send the calls data back to the client
                 await manager.send_personal_message(
                     message,
                     websocket,
                 )
+            if event == "get_inventory":
+                # Who can give or still needs a category, from the matcher's indexes
+                result = await asyncio.to_thread(read_inventory, data.get("category"))
+                await manager.send_personal_message(
+                    {
+                        "event": "inventory_response",
+                        "data": result,
+                    },
+                    websocket,
+                )
             if event == "message":
                 print(data)
                 messages = data["messages"]
-                response = swarm.run(messages, stream=True)
                 
                 await manager.send_personal_message(
                     {
@@ -71,16 +147,26 @@ async def websocket_endpoint(websocket: WebSocket, client_id: Optional[str] = No
                     websocket,
                 )
 
-                for chunk in response:
-                    if "content" in chunk and chunk['content']:
-                        print(chunk['content'], end="", flush=True)
+                # The swarm stream blocks on the LLM and on tool calls, run it on a worker thread
+                async def contents():
+                    async for chunk in session.stream(messages):
+                        if "content" in chunk and chunk['content']:
+                            print(chunk['content'], end="", flush=True)
+                            yield chunk['content']
+
+                chat_turns.inc()
+                try:
+                    # whatever is still buffered is flushed before message_end
+                    async for text in coalesce(contents(), COALESCE_WINDOW_MS / 1000, COALESCE_MAX_CHARS, coalescing_stats):
                         await manager.send_personal_message(
                             {
                                 "event": "message_response",
-                                "data": chunk['content'],
+                                "data": text,
                              },
                             websocket,
                         )
+                finally:
+                    chat_turns.dec()
                 await manager.send_personal_message(
                     {
                         "event": "message_end",
@@ -90,7 +176,7 @@ async def websocket_endpoint(websocket: WebSocket, client_id: Optional[str] = No
 
     except WebSocketDisconnect:
         print("Disconnecting...", client_id)
-        await manager.disconnect(client_id)
+        await manager.disconnect(client_id, websocket)
     except Exception as e:
         print("Error:", str(e))
-        await manager.disconnect(client_id)
\ No newline at end of file
+        await manager.disconnect(client_id, websocket)
\ No newline at end of file
@@ -0,0 +1,511 @@
+import heapq
+import itertools
+import threading
+from concurrent.futures import Executor
+from typing import Callable, Dict, Iterable, List, Optional, Set, Tuple
+
+from distance import distance_matrix
+from flow import solve_transportation
+from spatial import SpatialIndex
+from table import LocationTable, is_supplier
+from travel import TravelCost
+
+Assignment = Tuple[str, str, str, List[str]]
+MatchResult = Tuple[List[Assignment], Dict[str, Dict[str, List[str]]], Dict[str, List[str]]]
+
+# "greedy" takes the nearest pair first, "optimal" minimises the total distance per category
+MATCH_MODES = ("greedy", "optimal")
+
+
+class MatchConflict(Exception):
+    """A batch of assignments no longer fits the locations it was matched against."""
+
+    def __init__(self, names: Set[str]):
+        super().__init__(f"Locations changed since they were matched: {sorted(names)}")
+        self.names = names
+
+
+def match(locations: dict, supplier_index: SpatialIndex, mode: str = "greedy",
+          travel: Optional[TravelCost] = None) -> MatchResult:
+    """Run the matching engine selected by `mode` over every location, see MATCH_MODES."""
+    if mode == "greedy":
+        return greedy_match(locations, supplier_index, travel=travel)
+    if mode == "optimal":
+        return optimal_match(locations, supplier_index, travel)
+    raise ValueError(f"Unknown match mode {mode!r}, expected one of {MATCH_MODES}")
+
+
+def greedy_match(locations: dict, supplier_index: SpatialIndex, k: int = 8,
+                 travel: Optional[TravelCost] = None) -> MatchResult:
+    """
+    Match suppliers to demanders based on category and proximity, nearest pair first.
+
+    Instead of pushing every (demander, supplier, category) combination onto the heap, each
+    (demander, category) keeps a lazy stream of its nearest suppliers from the spatial index and
+    only the head of every stream sits in the heap. Pairs come off in the same
+    (distance, demander, supplier, category) order as the full cross product would, so the
+    assignments are identical.
+
+    Args:
+        locations: Dictionary of locations, as in db["locations"].
+        supplier_index: Spatial index of the suppliers in `locations`.
+        k: How many suppliers a stream pulls from the index at a time.
+        travel: Rank pairs by this travel cost instead of distance. The index must then use
+            the haversine metric, see TravelCost.ranked.
+
+    Returns:
+        assignments: List of tuples (supplier, demander, category, list of items assigned).
+        remaining_supplies: Dictionary of suppliers with their remaining surplus_mapping.
+        remaining_demands: Dictionary of demanders with their remaining unmet categories.
+    """
+    demanders = _demand_counts(locations)  # demander: category: count still needed
+    demand_streams = [(name, category) for name, demand_count in demanders.items() for category in demand_count]
+    supply_left = {
+        category: sum(len(locations[name]["surplus_mapping"][category]) for name in supplier_index.members(category))
+        for category in {category for _, category in demand_streams}
+    }
+    assignments, surplus = _greedy(locations, supplier_index, None, demand_streams, (), demanders, k,
+                                   supply_left=supply_left, travel=travel)
+    return (assignments, *_remaining(locations, surplus, demanders))
+
+
+def _greedy(locations: dict, suppliers: SpatialIndex, demanders: SpatialIndex,
+            demand_streams: Iterable[Tuple[str, str]], supply_streams: Iterable[Tuple[str, str]],
+            needs: Dict[str, Dict[str, int]], k: int,
+            count_demand: Optional[Callable[[str], Dict[str, int]]] = None,
+            supply_left: Optional[Dict[str, int]] = None,
+            demand_left: Optional[Dict[str, int]] = None,
+            travel: Optional[TravelCost] = None) -> Tuple[List[Assignment], Dict[str, Dict[str, List[str]]]]:
+    """
+    Nearest-pair-first matching over lazy streams.
+
+    A demand stream (demander, category) walks the suppliers nearest to that demander, a supply
+    stream (supplier, category) walks the demanders nearest to that supplier. The heap only holds
+    the head of every stream, ordered by (distance, demander, supplier, category), and a stream
+    advances when its head is popped and the location on its far side has nothing to give or take.
+
+    `needs` is filled in (and updated) with demand counts of every demander touched, taken from
+    count_demand(name) or counted from its demand list; the returned surplus holds working copies
+    of the surplus_mapping of every supplier touched.
+
+    Streams skip the locations that ran out of the category during the round, and supply_left and
+    demand_left, the units each index holds per category, let a stream stop as soon as the other
+    side has nothing left anywhere, instead of walking every exhausted location.
+
+    With a travel cost provider, streams are re-ranked by travel cost and "distance" is that cost.
+    """
+    count_demand = count_demand or (lambda name: _count(locations[name]["demand"]))
+    supply_left = dict(supply_left) if supply_left is not None else None
+    demand_left = dict(demand_left) if demand_left is not None else None
+    surplus = {}  # supplier: working copy of its surplus_mapping, made on first use
+    order = itertools.count()  # the same pair can head a demand and a supply stream
+    drained: Dict[str, Set[str]] = {}  # category: suppliers that gave all of it this round
+    satisfied: Dict[str, Set[str]] = {}  # category: demanders that got all of it this round
+
+    # Each entry is (distance, demander_name, supplier_name, category, order, stream, from_supplier)
+    pq = []
+    for name, category in demand_streams:
+        data = locations[name]["data"]
+        stream = suppliers.nearest(category, data["lat"], data["lon"], k, drained.setdefault(category, set()))
+        if travel is not None:
+            stream = travel.ranked(stream, name, anchor_is_supplier=False)
+        _push_next(pq, order, stream, name, category, False)
+    for name, category in supply_streams:
+        data = locations[name]["data"]
+        stream = demanders.nearest(category, data["lat"], data["lon"], k, satisfied.setdefault(category, set()))
+        if travel is not None:
+            stream = travel.ranked(stream, name, anchor_is_supplier=True)
+        _push_next(pq, order, stream, name, category, True)
+
+    assignments = []
+
+    # Process the priority queue
+    while pq:
+        distance, demander, supplier, category, _, stream, from_supplier = heapq.heappop(pq)
+        if demander not in needs:
+            needs[demander] = count_demand(demander)
+        demand_count = needs[demander]
+        if supplier not in surplus:
+            surplus[supplier] = {c: list(items) for c, items in locations[supplier]["surplus_mapping"].items()}
+        supplies = surplus[supplier]
+
+        # Demand already fulfilled or no surplus left, move on to the next nearest pair
+        if demand_count.get(category, 0) <= 0:
+            if from_supplier and (demand_left is None or demand_left.get(category, 0) > 0):
+                _push_next(pq, order, stream, supplier, category, True)
+            continue
+        if not supplies.get(category):
+            if not from_supplier and (supply_left is None or supply_left.get(category, 0) > 0):
+                _push_next(pq, order, stream, demander, category, False)
+            continue
+
+        # Determine how many items can be assigned
+        assigned_quantity = min(len(supplies[category]), demand_count[category])
+        assignments.append((supplier, demander, category, supplies[category][:assigned_quantity]))
+
+        # Update supplier's surplus
+        supplies[category] = supplies[category][assigned_quantity:]
+        if not supplies[category]:
+            del supplies[category]
+            drained.setdefault(category, set()).add(supplier)
+
+        if supply_left is not None:
+            supply_left[category] -= assigned_quantity
+        if demand_left is not None:
+            demand_left[category] -= assigned_quantity
+
+        # Update demander's needs
+        demand_count[category] -= assigned_quantity
+        if demand_count[category] == 0:
+            del demand_count[category]
+            satisfied.setdefault(category, set()).add(demander)
+
+        # One side ran out, the stream continues only if it was anchored on the other side
+        if from_supplier and category in supplies:
+            _push_next(pq, order, stream, supplier, category, True)
+        elif not from_supplier and category in demand_count:
+            _push_next(pq, order, stream, demander, category, False)
+
+    return assignments, surplus
+
+
+def _push_next(pq: list, order, stream, anchor: str, category: str, from_supplier: bool):
+    for distance, other in stream:
+        if from_supplier:
+            heapq.heappush(pq, (distance, other, anchor, category, next(order), stream, True))
+        else:
+            heapq.heappush(pq, (distance, anchor, other, category, next(order), stream, False))
+        return
+
+
+def optimal_match(locations: dict, supplier_index: SpatialIndex, travel: Optional[TravelCost] = None) -> MatchResult:
+    """
+    Match suppliers to demanders with the lowest total travel distance.
+
+    Every category is an independent transportation problem: each supplier offers as many units
+    as it has items, each demander needs as many as it listed the category. As many units as
+    possible are assigned (the same amount the greedy matcher assigns), and among those
+    allocations the one with the smallest sum of distance x units is chosen, see
+    flow.solve_transportation. With a travel cost provider its costs replace the distances.
+
+    Returns:
+        The same (assignments, remaining_supplies, remaining_demands) as greedy_match, with the
+        assignments listed nearest first.
+    """
+    demanders = _demand_counts(locations)
+
+    # category: demanders that still need it
+    wanted_by: Dict[str, List[str]] = {}
+    for name, demand_count in demanders.items():
+        for category in demand_count:
+            wanted_by.setdefault(category, []).append(name)
+
+    assignments, surplus = _optimal(locations, supplier_index, wanted_by, demanders, travel=travel)
+    return (assignments, *_remaining(locations, surplus, demanders))
+
+
+def _optimal(locations: dict, suppliers: SpatialIndex, wanted_by: Dict[str, List[str]],
+             needs: Dict[str, Dict[str, int]],
+             count_demand: Optional[Callable[[str], Dict[str, int]]] = None,
+             travel: Optional[TravelCost] = None) -> Tuple[List[Assignment], Dict[str, Dict[str, List[str]]]]:
+    """Solve one transportation problem per category between its suppliers and `wanted_by[category]`."""
+    count_demand = count_demand or (lambda name: _count(locations[name]["demand"]))
+    surplus = {}
+    for demander_names in wanted_by.values():
+        for name in demander_names:
+            if name not in needs:
+                needs[name] = count_demand(name)
+
+    entries = []
+    for category, demander_names in wanted_by.items():
+        supplier_names = sorted(suppliers.members(category))
+        if not supplier_names or not demander_names:
+            continue
+        if travel is not None:
+            distances = travel.costs(demander_names, supplier_names).T
+        else:
+            distances = distance_matrix(
+                [suppliers.positions[name] for name in supplier_names],
+                [(locations[name]["data"]["lat"], locations[name]["data"]["lon"]) for name in demander_names],
+                suppliers.metric,
+            )
+        flow = solve_transportation(
+            distances,
+            [len(locations[name]["surplus_mapping"][category]) for name in supplier_names],
+            [needs[name][category] for name in demander_names],
+        )
+        for i, j in zip(*flow.nonzero()):
+            entries.append((float(distances[i, j]), demander_names[j], supplier_names[i], category, int(flow[i, j])))
+
+    assignments = []
+    for distance, demander, supplier, category, quantity in sorted(entries):
+        if supplier not in surplus:
+            surplus[supplier] = {c: list(items) for c, items in locations[supplier]["surplus_mapping"].items()}
+        supplies = surplus[supplier]
+        assignments.append((supplier, demander, category, supplies[category][:quantity]))
+        supplies[category] = supplies[category][quantity:]
+        if not supplies[category]:
+            del supplies[category]
+        needs[demander][category] -= quantity
+        if needs[demander][category] == 0:
+            del needs[demander][category]
+
+    return assignments, surplus
+
+
+def _count(demand: List[str]) -> Dict[str, int]:
+    # Count the number of demands per category
+    demand_count = {}
+    for category in demand:
+        demand_count[category] = demand_count.get(category, 0) + 1
+    return demand_count
+
+
+def _demand_counts(locations: dict) -> Dict[str, Dict[str, int]]:
+    """Demanders and how many times they listed each category."""
+    return {
+        name: _count(info["demand"])
+        for name, info in locations.items()
+        if not is_supplier(info) and "demand" in info
+    }
+
+
+def _remaining(locations: dict, surplus: dict, demanders: dict, suppliers: Iterable[str] = None):
+    # Prepare remaining supplies, of every supplier unless told which ones
+    remaining_supplies = {}
+    for name in (locations if suppliers is None else suppliers):
+        info = locations.get(name, {})
+        if is_supplier(info):
+            mapping = surplus.get(name, info["surplus_mapping"])
+            if mapping:
+                remaining_supplies[name] = mapping
+
+    # Prepare remaining demands, in the order they were asked for
+    remaining_demands = {
+        demander: [category for category in dict.fromkeys(locations[demander]["demand"]) if category in demand_count]
+        for demander, demand_count in demanders.items()
+        if demand_count
+    }
+
+    return remaining_supplies, remaining_demands
+
+
+class MatchBook:
+    """
+    The open supply and demand book, kept between matching rounds.
+
+    Both sides are held in spatial indexes by category, and in a LocationTable that counts what
+    each location still has or needs. save_items reports each write with record(), and sync() later
+    re-indexes those locations and queues the (location, category) pairs they touched; commit()
+    re-indexes the locations a round changed. A round then only matches the queued pairs against
+    the standing book.
+
+    The book has its own `lock`, held by a round from sync() to commit() and by anything reading
+    the indexes, so a round can match a snapshot of the locations (see ChangeLog.snapshot) while
+    writers carry on under the db lock. record() and written() only touch the list of writes, and
+    are called under the db lock.
+
+    This gives the same assignments as a full rematch: after every round each category has open
+    supply or open demand but not both, so any pair that can still be matched involves at least
+    one queued entry. A fresh book queues all of its demand, so its first round is a full match.
+
+    With a travel cost provider, pairs are ranked by travel cost, and the indexes measure
+    haversine distance whatever `metric` says, as the provider's lower bound is per km.
+
+    With an executor (a process pool), a round with at least `shard_threshold` queued entries,
+    such as the first one, is matched by geographic shards of `shard_size` degrees in parallel
+    instead; see sharding.sharded_match.
+    """
+
+    def __init__(self, locations: dict, cell_size: float = 0.05, metric: str = "euclidean",
+                 travel: Optional[TravelCost] = None, executor: Optional[Executor] = None,
+                 shard_size: float = 0.25, shard_threshold: int = 5000):
+        self.locations = locations
+        self.travel = travel
+        self.executor = executor
+        self.shard_size = shard_size
+        self.shard_threshold = shard_threshold
+        self.lock = threading.Lock()
+        self._written: Dict[str, Set[str]] = {}  # name: categories added since the last sync
+        if travel is not None:
+            metric = "haversine"
+            stale = travel.bind(locations)
+            if stale:
+                print(f"Travel costs are estimated for {len(stale)} locations missing from the matrix")
+        self.suppliers = SpatialIndex.from_suppliers(locations, cell_size, metric)
+        self.demanders = SpatialIndex.from_demanders(locations, cell_size, metric)
+        self.inventory = LocationTable.from_locations(locations)
+        self.pending_supply: Set[Tuple[str, str]] = set()
+        self.pending_demand: Set[Tuple[str, str]] = {
+            (name, category)
+            for name, categories in self.demanders.categories.items()
+            for category in categories
+        }
+
+    def record(self, name: str, categories: Iterable[str]):
+        """Note a write to a location and the categories it just added, for the next sync()."""
+        self._written.setdefault(name, set()).update(categories)
+
+    def written(self) -> Dict[str, Set[str]]:
+        """Take the writes recorded since the last call, to sync() them from a snapshot taken with them."""
+        written, self._written = self._written, {}
+        return written
+
+    def sync(self, locations: Optional[dict] = None, written: Optional[Dict[str, Set[str]]] = None):
+        """
+        Re-index the written locations as they are in `locations`, the live ones by default, and
+        queue the categories they added. Without `written`, takes the writes recorded so far.
+        """
+        locations = self.locations if locations is None else locations
+        for name, categories in (self.written() if written is None else written).items():
+            self._reindex(name, locations)
+            self._queue(name, categories)
+
+    def _queue(self, name: str, categories: Iterable[str]):
+        for category in categories:
+            if category in self.suppliers.categories.get(name, ()):
+                self.pending_supply.add((name, category))
+            if category in self.demanders.categories.get(name, ()):
+                self.pending_demand.add((name, category))
+
+    def match(self, mode: str = "greedy", k: int = 8, locations: Optional[dict] = None) -> MatchResult:
+        """
+        Match everything queued since the last round against the book, and clear the queue.
+
+        `locations` is a snapshot the book was synced from, and is only read. By default the
+        live locations are matched, after syncing the writes recorded so far.
+
+        Returns:
+            The same (assignments, remaining_supplies, remaining_demands) as greedy_match, except
+            that the remainders only cover the locations that took part in this round.
+        """
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode {mode!r}, expected one of {MATCH_MODES}")
+        if locations is None:
+            locations = self.locations
+            self.sync(locations)
+        # Entries can go stale if the location changed side or was matched since it was queued
+        demand_streams = sorted(
+            (name, category) for name, category in self.pending_demand
+            if category in self.demanders.categories.get(name, ())
+        )
+        supply_streams = sorted(
+            (name, category) for name, category in self.pending_supply
+            if category in self.suppliers.categories.get(name, ())
+        )
+        self.pending_demand = set()
+        self.pending_supply = set()
+
+        if self.executor is not None and len(demand_streams) + len(supply_streams) >= self.shard_threshold:
+            from sharding import sharded_match
+
+            return sharded_match(locations, mode, self.suppliers.metric, self.suppliers.cell_size,
+                                 self.shard_size, self.executor, self.travel)
+
+        needs = {}
+        if mode == "greedy":
+            assignments, surplus = _greedy(locations, self.suppliers, self.demanders,
+                                           demand_streams, supply_streams, needs, k, self.inventory.needs,
+                                           self.inventory.supply_total, self.inventory.demand_total, self.travel)
+        else:
+            wanted_by: Dict[str, List[str]] = {}
+            for category in sorted({category for _, category in demand_streams + supply_streams}):
+                wanted_by[category] = sorted(self.demanders.members(category))
+            assignments, surplus = _optimal(locations, self.suppliers, wanted_by, needs, self.inventory.needs,
+                                            self.travel)
+
+        for name, _ in demand_streams:
+            if name not in needs:
+                needs[name] = self.inventory.needs(name)
+        suppliers = dict.fromkeys([name for name, _ in supply_streams] + list(surplus))
+        return (assignments, *_remaining(locations, surplus, needs, suppliers))
+
+    def commit(self, assignments: List[Assignment]) -> Set[str]:
+        """
+        Apply a round's assignments to the locations and the indexes, and return the names that changed.
+
+        All or nothing: if any location can no longer give or take what the batch expects (it was
+        written after the snapshot the batch was matched against), nothing is applied. Every
+        location in the batch is re-synced and queued again, so the next round rematches them, and
+        MatchConflict is raised. Call it under both the db lock and the book's lock.
+        """
+        stale = conflicts(self.locations, assignments)
+        if stale:
+            for name in {supplier for supplier, _, _, _ in assignments} | {demander for _, demander, _, _ in assignments}:
+                self._reindex(name, self.locations)
+                self._queue(name, self.suppliers.categories.get(name, set()) | self.demanders.categories.get(name, set()))
+            raise MatchConflict(stale)
+        changed = commit_assignments(self.locations, assignments)
+        for name in changed:
+            self._reindex(name, self.locations)
+        return changed
+
+    def _reindex(self, name: str, locations: dict):
+        info = locations.get(name)
+        self.suppliers.update_supplier(name, info)
+        self.demanders.update_demander(name, info)
+        self.inventory.update(name, info)
+
+
+def conflicts(locations: dict, assignments: List[Assignment]) -> Set[str]:
+    """
+    The locations that could not honour a batch of assignments as it stands: a supplier whose
+    surplus no longer starts with the assigned items, or a demander that no longer needs as many.
+    """
+    supplies, needs, stale = {}, {}, set()
+    for supplier, demander, category, items in assignments:
+        if supplier not in supplies:
+            mapping = locations.get(supplier, {}).get("surplus_mapping", {})
+            supplies[supplier] = {c: list(left) for c, left in mapping.items()}
+        if demander not in needs:
+            needs[demander] = _count(locations.get(demander, {}).get("demand", []))
+        left = supplies[supplier].get(category, [])
+        if left[:len(items)] != list(items):
+            stale.add(supplier)
+        else:
+            supplies[supplier][category] = left[len(items):]
+        if needs[demander].get(category, 0) < len(items):
+            stale.add(demander)
+        else:
+            needs[demander][category] -= len(items)
+    return stale
+
+
+def commit_assignments(locations: dict, assignments: List[Assignment]) -> Set[str]:
+    """
+    Remove assigned items from the suppliers' surplus and the demanders' demand.
+
+    Returns:
+        The names of the locations that changed.
+    """
+    changed = set()
+    for supplier, demander, category, items in assignments:
+        # Remove items from supplier's surplus_mapping
+        if supplier in locations:
+            changed.add(supplier)
+            if "surplus_mapping" in locations[supplier]:
+                current_items = locations[supplier]["surplus_mapping"].get(category, [])
+                updated_items = current_items[len(items):]
+                if updated_items:
+                    locations[supplier]["surplus_mapping"][category] = updated_items
+                else:
+                    # If no items left in category, remove the category
+                    locations[supplier]["surplus_mapping"].pop(category, None)
+            # Remove the category from 'surplus' once its items are gone
+            if "surplus" in locations[supplier]:
+                if category in locations[supplier]["surplus"]:
+                    if category not in locations[supplier].get("surplus_mapping", {}):
+                        locations[supplier]["surplus"].remove(category)
+
+        # Remove items from demander's demand
+        if demander in locations:
+            changed.add(demander)
+            if "demand" in locations[demander]:
+                # Remove the assigned category as many times as items were assigned
+                for _ in range(len(items)):
+                    try:
+                        locations[demander]["demand"].remove(category)
+                    except ValueError:
+                        # In case the category isn't present enough times
+                        break
+    return changed
@@ -0,0 +1,224 @@
+import bisect
+import math
+import threading
+import time
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# Seconds, from a fast tool call up to a slow LLM turn
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Registry:
+    """
+    Every metric of the process, rendered in the Prometheus text format for /metrics.
+
+    Metrics are plain in-process counters behind a lock each, so recording one costs about
+    as much as a dict lookup and they can stay on in production. Gauges given a `function`
+    are read when the registry is rendered, which suits values the server already tracks,
+    such as the number of open connections.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, "_Metric"] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: "_Metric"):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Metric {metric.name!r} is already registered")
+            self._metrics[metric.name] = metric
+
+    def get(self, name: str) -> Optional["_Metric"]:
+        return self._metrics.get(name)
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self._metrics.values()):
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional[Registry] = REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        """The series for these label values, in the order of labelnames."""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} takes labels {self.labelnames}, got {key}")
+            with self._lock:
+                child = self._children.setdefault(key, self._child())
+        return child
+
+    def _only(self):
+        # the single series of a metric without labels
+        return self.labels()
+
+    def _child(self):
+        raise NotImplementedError
+
+    def samples(self) -> List[str]:
+        raise NotImplementedError
+
+
+class _Value:
+    __slots__ = ("value", "lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self.lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.inc(-amount)
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self._only().inc(amount)
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(child.value)}"
+                for key, child in sorted(self._children.items())]
+
+
+class Gauge(_Metric):
+    """
+    A value that goes up and down.
+
+    With a `function`, the gauge is computed when rendered instead: the function returns a
+    number, or for a labelled gauge a dict of label values tuple: number.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional[Registry] = REGISTRY,
+                 function: Optional[Callable[[], object]] = None):
+        super().__init__(name, help, labelnames, registry)
+        self.function = function
+
+    def _child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self._only().set(value)
+
+    def inc(self, amount: float = 1.0):
+        self._only().inc(amount)
+
+    def dec(self, amount: float = 1.0):
+        self._only().dec(amount)
+
+    def samples(self) -> List[str]:
+        if self.function is None:
+            values = {key: child.value for key, child in self._children.items()}
+        else:
+            try:
+                values = self.function()
+            except Exception as e:
+                print(f"Metric {self.name} failed: {e}")
+                return []
+            if not isinstance(values, dict):
+                values = {(): values}
+        return [f"{self.name}{_labels(self.labelnames, key)} {_number(value)}" for key, value in sorted(values.items())]
+
+
+class _Buckets:
+    __slots__ = ("upper", "counts", "sum", "lock")
+
+    def __init__(self, upper: Tuple[float, ...]):
+        self.upper = upper
+        self.counts = [0] * (len(upper) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value: float):
+        i = bisect.bisect_left(self.upper, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), registry: Optional[Registry] = REGISTRY,
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(bucket for bucket in buckets if bucket != math.inf))
+        super().__init__(name, help, labelnames, registry)
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self._only().observe(value)
+
+    def time(self):
+        return self._only().time()
+
+    def samples(self) -> List[str]:
+        lines = []
+        for key, child in sorted(self._children.items()):
+            with child.lock:
+                counts, total = list(child.counts), child.sum
+            cumulative = 0
+            for upper, count in zip(self.buckets + (math.inf,), counts):
+                cumulative += count
+                labels = _labels(self.labelnames + ("le",), key + (_number(upper),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, key)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+def _labels(names: Tuple[str, ...], values: Tuple[str, ...]) -> str:
+    if not names:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for value in values)
+    return "{" + ",".join(f'{name}="{value}"' for name, value in zip(names, escaped)) + "}"
+
+
+def _number(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if value == -math.inf:
+        return "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
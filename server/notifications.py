@@ -0,0 +1,108 @@
+import json
+from typing import Dict, List, Sequence, Tuple
+
+# (origin, destination, category, items, origin address), the inputs of the two notifications of a dispatch
+Record = Tuple[str, str, str, List[str], str]
+
+SIDES = ("origin", "destination")
+
+# Structured output of a batched call: one entry per record, echoing its id and names so a
+# reply that mixed records up can be told apart
+NOTIFICATION_FORMAT = {
+    "type": "json_schema",
+    "json_schema": {
+        "name": "notifications",
+        "strict": True,
+        "schema": {
+            "type": "object",
+            "properties": {
+                "notifications": {
+                    "type": "array",
+                    "items": {
+                        "type": "object",
+                        "properties": {
+                            "id": {"type": "integer"},
+                            "origin": {"type": "string"},
+                            "destination": {"type": "string"},
+                            "origin_message": {"type": "string"},
+                            "destination_message": {"type": "string"},
+                        },
+                        "required": ["id", "origin", "destination", "origin_message", "destination_message"],
+                        "additionalProperties": False,
+                    },
+                },
+            },
+            "required": ["notifications"],
+            "additionalProperties": False,
+        },
+    },
+}
+
+
+def render(record: Record) -> Dict[str, str]:
+    """The origin and destination messages of a dispatch, from fixed templates."""
+    origin, destination, category, items, address = record
+    listed = ", ".join(items[:-1]) + " and " + items[-1] if len(items) > 1 else "".join(items)
+    return {
+        "origin": f"Hi {origin}! {destination} is coming to pick up {listed} ({category}) from you. "
+                  f"Please have the items packaged neatly and ready to go.",
+        "destination": f"Hi {destination}! {origin} has extra {category} you can use: {listed}. "
+                       f"Please send someone to pick it up at {address}.",
+    }
+
+
+def batch_prompt(records: Sequence[Record]) -> str:
+    """One prompt asking for both notifications of every record."""
+    dispatches = [
+        {"id": i, "origin": origin, "destination": destination, "category": category, "items": list(items),
+         "origin_address": address}
+        for i, (origin, destination, category, items, address) in enumerate(records)
+    ]
+    return f"""
+    Write two friendly text messages for each dispatch below.
+
+    The origin message goes to the origin location, notifying them that the destination will be coming to pick up the items of the category from them. They should be prepared to package the items neatly.
+
+    The destination message goes to the destination location, notifying them the origin location has extra food of the category that they can use, with the items available and the origin address. They should be prepared to send someone to pick it up.
+
+    Answer with one entry per dispatch, with its id, origin and destination exactly as given.
+
+    Dispatches:
+    {json.dumps(dispatches)}
+    """
+
+
+def parse_batch(content: str, records: Sequence[Record]) -> Dict[int, Dict[str, str]]:
+    """
+    The messages of a batched reply, as {record index: {"origin": message, "destination": message}}.
+
+    Only entries that match a record (a known id, not seen before, with the record's origin and
+    destination) are kept, and only their non-empty messages. A reply that is not valid JSON gives
+    nothing; the caller writes whatever is missing one by one.
+    """
+    try:
+        reply = json.loads(content or "")
+    except ValueError:
+        return {}
+    entries = reply.get("notifications") if isinstance(reply, dict) else None
+    if not isinstance(entries, list):
+        return {}
+
+    written: Dict[int, Dict[str, str]] = {}
+    for entry in entries:
+        if not isinstance(entry, dict):
+            continue
+        i = entry.get("id")
+        if not isinstance(i, int) or isinstance(i, bool) or not 0 <= i < len(records) or i in written:
+            continue
+        origin, destination = records[i][:2]
+        if entry.get("origin") != origin or entry.get("destination") != destination:
+            continue
+        messages = {}
+        for side in SIDES:
+            message = entry.get(f"{side}_message")
+            if isinstance(message, str) and message.strip():
+                messages[side] = message.strip()
+        if messages:
+            written[i] = messages
+    return written
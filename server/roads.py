@@ -0,0 +1,113 @@
+import csv
+import heapq
+import math
+from typing import Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from spatial import SpatialIndex
+
+# Coordinates are rounded to this many decimals (about 1 cm) to tell which edges share a node
+NODE_PRECISION = 7
+
+
+class RoadNetwork:
+    """
+    A directed road graph with travel times, in compressed sparse row form.
+
+    Loaded from a road-network extract given as a CSV of edges, one road segment per row:
+
+        from_lat,from_lon,to_lat,to_lon,seconds,oneway
+
+    Edges that share coordinates share a node. `seconds` may be replaced by `length_m` and
+    `speed_kph` columns, and `oneway` (1/0, true/false) defaults to two-way. An OSM export with
+    one row per way segment fits this directly.
+    """
+
+    def __init__(self, lats: np.ndarray, lons: np.ndarray, tails: np.ndarray, heads: np.ndarray, seconds: np.ndarray):
+        self.lats = lats
+        self.lons = lons
+        self.forward = _csr(len(lats), tails, heads, seconds)
+        self.backward = _csr(len(lats), heads, tails, seconds)
+
+    def __len__(self):
+        return len(self.lats)
+
+    @classmethod
+    def from_csv(cls, path: str) -> "RoadNetwork":
+        nodes = {}
+        tails, heads, seconds = [], [], []
+
+        def node(lat: str, lon: str) -> int:
+            key = (round(float(lat), NODE_PRECISION), round(float(lon), NODE_PRECISION))
+            return nodes.setdefault(key, len(nodes))
+
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                tail = node(row["from_lat"], row["from_lon"])
+                head = node(row["to_lat"], row["to_lon"])
+                if row.get("seconds"):
+                    cost = float(row["seconds"])
+                else:
+                    cost = float(row["length_m"]) / (float(row["speed_kph"]) / 3.6)
+                tails.append(tail)
+                heads.append(head)
+                seconds.append(cost)
+                if str(row.get("oneway", "0")).strip().lower() not in ("1", "true", "yes"):
+                    tails.append(head)
+                    heads.append(tail)
+                    seconds.append(cost)
+
+        coordinates = np.array(list(nodes), dtype=np.float64).reshape(-1, 2)
+        return cls(coordinates[:, 0], coordinates[:, 1], np.array(tails, dtype=np.int64),
+                   np.array(heads, dtype=np.int64), np.array(seconds, dtype=np.float64))
+
+    def snap(self, positions: Iterable[Tuple[float, float]]) -> Tuple[List[int], List[float]]:
+        """The node closest to each (lat, lon), and how far it is in km."""
+        index = SpatialIndex(cell_size=0.01, metric="haversine")
+        for node, (lat, lon) in enumerate(zip(self.lats.tolist(), self.lons.tolist())):
+            index.add("road", str(node), lat, lon)
+        nodes, distances = [], []
+        for lat, lon in positions:
+            km, node = next(index.nearest("road", lat, lon, k=1))
+            nodes.append(int(node))
+            distances.append(km)
+        return nodes, distances
+
+    def travel_times(self, source: int, targets: Optional[Iterable[int]] = None, reverse: bool = False) -> np.ndarray:
+        """
+        Shortest travel time in seconds from `source` to every node (to `source` from every node
+        with reverse=True), inf where there is no path.
+
+        With `targets`, the search stops once all of them are settled, and only their times are exact.
+        """
+        indptr, indices, weights = self.backward if reverse else self.forward
+        times = [math.inf] * len(self)
+        times[source] = 0.0
+        remaining = set(targets) if targets is not None else None
+        settled = bytearray(len(self))
+        heap = [(0.0, source)]
+        while heap:
+            time, node = heapq.heappop(heap)
+            if settled[node]:
+                continue
+            settled[node] = True
+            if remaining is not None:
+                remaining.discard(node)
+                if not remaining:
+                    break
+            for i in range(indptr[node], indptr[node + 1]):
+                head = indices[i]
+                candidate = time + weights[i]
+                if candidate < times[head]:
+                    times[head] = candidate
+                    heapq.heappush(heap, (candidate, head))
+        return np.array(times)
+
+
+def _csr(count: int, tails: np.ndarray, heads: np.ndarray, weights: np.ndarray):
+    order = np.argsort(tails, kind="stable")
+    indptr = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(tails, minlength=count), out=indptr[1:])
+    # plain lists, the search reads them one element at a time
+    return indptr.tolist(), heads[order].tolist(), weights[order].tolist()
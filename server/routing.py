@@ -0,0 +1,100 @@
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from distance import distance_matrix
+from travel import TravelCost
+
+Assignment = Tuple[str, str, str, List[str]]
+
+
+def plan_tours(positions: Dict[str, Tuple[float, float]], assignments: Sequence[Assignment], metric: str = "euclidean",
+               travel: Optional[TravelCost] = None, max_stops: int = 8, capacity: Optional[int] = None,
+               time_budget: float = 0.05) -> List[dict]:
+    """
+    Group each demander's pickups into multi-stop tours.
+
+    The demander's driver leaves from the demander, picks up at every supplier it was matched
+    with and comes back. Tours are built by nearest insertion, at most `max_stops` suppliers and
+    `capacity` items each, then improved with 2-opt until `time_budget` seconds have been spent
+    on the whole round; after that tours are left as inserted.
+
+    Costs are straight-line distances in `metric` between `positions` (name: (lat, lon)), or
+    travel costs when a provider is given.
+
+    Returns:
+        One dict per tour: the demander, its stops in visiting order (each with the category and
+        items picked up there), its cost, and what the same pickups cost as separate round trips.
+    """
+    deadline = time.perf_counter() + time_budget
+    pickups: Dict[str, Dict[str, List[dict]]] = {}  # demander: supplier: pickups, in assignment order
+    for supplier, demander, category, items in assignments:
+        pickups.setdefault(demander, {}).setdefault(supplier, []).append({"category": category, "items": list(items)})
+
+    tours = []
+    for demander, by_supplier in pickups.items():
+        names = [demander] + list(by_supplier)
+        if travel is not None:
+            costs = travel.costs(names, names)
+        else:
+            points = [positions[name] for name in names]
+            costs = distance_matrix(points, points, metric)
+        costs = costs.tolist()
+        loads = [0] + [sum(len(pickup["items"]) for pickup in by_supplier[name]) for name in names[1:]]
+
+        for route in _insert(costs, loads, max_stops, capacity):
+            if time.perf_counter() < deadline:
+                route = _two_opt(costs, route, deadline)
+            tours.append({
+                "demander": demander,
+                "stops": [{"supplier": names[i], "pickups": by_supplier[names[i]]} for i in route],
+                "cost": _cost(costs, route),
+                "separate_cost": sum(costs[0][i] + costs[i][0] for i in route),
+            })
+    return tours
+
+
+def _cost(costs: List[List[float]], route: List[int]) -> float:
+    """Cost of leaving node 0, visiting `route` in order and coming back."""
+    path = [0] + route + [0]
+    return sum(costs[a][b] for a, b in zip(path, path[1:]))
+
+
+def _insert(costs: List[List[float]], loads: List[int], max_stops: int, capacity: Optional[int]) -> List[List[int]]:
+    """
+    Nearest insertion: repeatedly take the stop closest to the tour so far and put it where it
+    adds the least. A stop that would break the tour's limits starts the next tour.
+    """
+    left = list(range(1, len(costs)))
+    routes = []
+    while left:
+        route, load = [], 0
+        while left:
+            visited = [0] + route
+            nearest = min(left, key=lambda stop: (min(min(costs[v][stop], costs[stop][v]) for v in visited), stop))
+            if route and (len(route) >= max_stops or (capacity is not None and load + loads[nearest] > capacity)):
+                break
+            path = [0] + route + [0]
+            position = min(
+                range(len(path) - 1),
+                key=lambda i: costs[path[i]][nearest] + costs[nearest][path[i + 1]] - costs[path[i]][path[i + 1]],
+            )
+            route.insert(position, nearest)
+            load += loads[nearest]
+            left.remove(nearest)
+        routes.append(route)
+    return routes
+
+
+def _two_opt(costs: List[List[float]], route: List[int], deadline: float) -> List[int]:
+    """Reverse segments of the route while that makes it cheaper. Costs may be asymmetric."""
+    best = _cost(costs, route)
+    improved = True
+    while improved and time.perf_counter() < deadline:
+        improved = False
+        for i in range(len(route) - 1):
+            for j in range(i + 1, len(route)):
+                candidate = route[:i] + route[i:j + 1][::-1] + route[j + 1:]
+                cost = _cost(costs, candidate)
+                if cost < best - 1e-12:
+                    route, best, improved = candidate, cost, True
+    return route
@@ -0,0 +1,73 @@
+import threading
+import time
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Any, Callable, Optional
+
+from metrics import Histogram
+
+round_submissions = Histogram(
+    "match_round_submissions", "Requests for a matching round served by one combined round.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+round_wait_seconds = Histogram("match_round_wait_seconds", "Time a request for a matching round waited for its round.")
+
+
+class _Batch:
+    __slots__ = ("size", "future")
+
+    def __init__(self):
+        self.size = 0
+        self.future: Future = Future()
+
+
+class MatchScheduler:
+    """
+    Combine the matching rounds requested at about the same time into one.
+
+    The first request opens a batch, and starts a job on `executor` that waits up to `window`
+    seconds, or until `max_batch` requests have joined, then runs one round for everybody.
+    Every request in the batch gets the same result back, and picks out its own share. While a
+    round runs, new requests collect in the next batch. Only the job takes a worker, the
+    requests just wait on the batch's future.
+
+    With a window of 0 a round starts straight away, and only requests that arrive while
+    one is being started share it.
+    """
+
+    def __init__(self, run_round: Callable[[], Any], window: float = 0.05, max_batch: int = 32,
+                 executor: Optional[Executor] = None):
+        self.run_round = run_round
+        self.window = window
+        self.max_batch = max_batch
+        self.executor = executor or ThreadPoolExecutor(max_workers=1, thread_name_prefix="match")
+        self._cond = threading.Condition()
+        self._open: Optional[_Batch] = None
+
+    def schedule(self) -> Future:
+        """Join the open batch, opening one if there is none, and return the future of its round."""
+        start = time.perf_counter()
+        with self._cond:
+            batch = self._open
+            if batch is None:
+                batch = self._open = _Batch()
+                self.executor.submit(self._lead, batch, start)
+            batch.size += 1
+            if batch.size >= self.max_batch:
+                self._cond.notify_all()
+        batch.future.add_done_callback(lambda _: round_wait_seconds.observe(time.perf_counter() - start))
+        return batch.future
+
+    def _lead(self, batch: _Batch, start: float):
+        deadline = start + self.window
+        with self._cond:
+            while batch.size < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            self._open = None
+        round_submissions.observe(batch.size)
+        try:
+            batch.future.set_result(self.run_round())
+        except BaseException as e:
+            batch.future.set_exception(e)
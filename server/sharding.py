@@ -0,0 +1,94 @@
+import copy
+import math
+from concurrent.futures import Executor
+from typing import Dict, List, Optional, Tuple
+
+from matching import MatchResult, commit_assignments, match
+from spatial import SpatialIndex
+from table import is_supplier
+from travel import TravelCost
+
+
+def shard_of(lat: float, lon: float, shard_size: float) -> Tuple[int, int]:
+    """The grid square, `shard_size` degrees wide, a location belongs to."""
+    return (math.floor(lat / shard_size), math.floor(lon / shard_size))
+
+
+def partition(locations: dict, shard_size: float) -> Dict[Tuple[int, int], dict]:
+    """Split locations into geographic shards, as {shard: {name: info}}."""
+    shards: Dict[Tuple[int, int], dict] = {}
+    for name, info in locations.items():
+        key = shard_of(info["data"]["lat"], info["data"]["lon"], shard_size)
+        shards.setdefault(key, {})[name] = info
+    return shards
+
+
+def _match_shard(locations: dict, mode: str, metric: str, cell_size: float,
+                 travel: Optional[TravelCost], bind: bool) -> Tuple[list, dict]:
+    """
+    Match one shard on its own, usually in a worker process.
+
+    Returns the assignments, and the locations that still have surplus or demand afterwards,
+    reduced to what they have left.
+    """
+    if bind and travel is not None:
+        # a provider unpickled in a worker has no locations yet
+        travel.bind(locations)
+    index = SpatialIndex.from_suppliers(locations, cell_size, metric)
+    assignments = match(locations, index, mode, travel)[0]
+    # the worker owns its copy of the shard, so the leftovers can be taken from it directly
+    commit_assignments(locations, assignments)
+    return assignments, _leftovers(locations)
+
+
+def _leftovers(locations: dict) -> dict:
+    left = {}
+    for name, info in locations.items():
+        if is_supplier(info):
+            if info["surplus_mapping"]:
+                left[name] = info
+        elif info.get("demand"):
+            left[name] = info
+    return left
+
+
+def sharded_match(locations: dict, mode: str = "greedy", metric: str = "euclidean", cell_size: float = 0.05,
+                  shard_size: float = 0.25, executor: Optional[Executor] = None,
+                  travel: Optional[TravelCost] = None) -> MatchResult:
+    """
+    Match every location, one geographic shard per task, then reconcile across shard borders.
+
+    Each shard is matched on its own with the engine selected by `mode`, in parallel on
+    `executor` (a process pool; in this process if None). Surplus and demand a shard could not
+    place, typically near its border, are then matched against each other in one more round
+    over the leftovers of every shard. After that round no category has both supply and
+    demand left, so as many units are assigned as by an unsharded match; pairs across a border
+    can be further apart than the unsharded nearest pair, the price of matching shards apart.
+
+    Returns:
+        The same (assignments, remaining_supplies, remaining_demands) as match() over all locations.
+        `locations` itself is not changed.
+    """
+    shards = partition(locations, shard_size)
+    # Biggest shards first, so the longest tasks do not start last
+    keys = sorted(shards, key=lambda key: (-len(shards[key]), key))
+    if executor is None:
+        results = {key: _match_shard(copy.deepcopy(shards[key]), mode, metric, cell_size, travel, False) for key in keys}
+    else:
+        # arguments are pickled for the worker, so every shard travels as a copy
+        futures = {key: executor.submit(_match_shard, shards[key], mode, metric, cell_size, travel, True) for key in keys}
+        results = {key: future.result() for key, future in futures.items()}
+
+    assignments: List = []
+    leftovers: dict = {}
+    for key in sorted(results):
+        shard_assignments, shard_leftovers = results[key]
+        assignments.extend(shard_assignments)
+        leftovers.update(shard_leftovers)
+
+    # Every location that still has something to give or take is a leftover, so the remainders
+    # of this round are those of the whole match
+    index = SpatialIndex.from_suppliers(leftovers, cell_size, metric)
+    border_assignments, remaining_supplies, remaining_demands = match(leftovers, index, mode, travel)
+    assignments.extend(border_assignments)
+    return assignments, remaining_supplies, remaining_demands
@@ -1,38 +1,186 @@
-from typing import Dict
-from fastapi import WebSocket
+import asyncio
+import collections
+import json
+import time
+from typing import Dict, Optional
+from fastapi import WebSocket, WebSocketDisconnect
+from metrics import Counter, Histogram
+
+broadcast_seconds = Histogram(
+    "ws_broadcast_seconds", "Fan-out of one broadcast: serialising it once and queueing it for every client.",
+    buckets=(0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+broadcast_messages = Counter("ws_broadcast_messages_total", "Broadcast messages per client, by outcome.", ["result"])
+messages_sent = Counter("ws_messages_sent_total", "Messages written to client sockets.")
+
+
+def encode(data: dict) -> str:
+    # Same wire format as WebSocket.send_json
+    return json.dumps(data, separators=(",", ":"), ensure_ascii=False)
+
+
+# one connected client: its socket, its bounded outbox and the task that drains it
+class Client:
+    __slots__ = ("client_id", "websocket", "queue", "writer", "sent", "dropped", "full_since", "closed")
+
+    def __init__(self, client_id: str, websocket: WebSocket, queue_size: int):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self.writer: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.dropped = 0
+        # when the outbox was found full, None once the writer has taken from it since
+        self.full_since: Optional[float] = None
+        # set once the client is evicted or replaced, nothing drains its outbox any more
+        self.closed = asyncio.Event()
+
+    def close(self):
+        self.closed.set()
+        if self.writer is not None and self.writer is not asyncio.current_task():
+            self.writer.cancel()
+
+    def stalled(self, now: float) -> float:
+        """Seconds the outbox has been full without the writer taking anything from it."""
+        if self.full_since is None:
+            self.full_since = now
+        return now - self.full_since
 
 
 # manages the connection across mukt clients and sate of ws
 class ConnectionManager:
     # initializes ws and adds to active connections inside of a dictionary
-    def __init__(self):
-        self.active_connections: Dict[str, WebSocket] = {}
+    def __init__(self, queue_size: int = 256, send_timeout: float = 10.0):
+        self.active_connections: Dict[str, Client] = {}
+        self._by_socket: Dict[int, Client] = {}
+        # a client that stalls for send_timeout seconds with a full outbox, or on a single send, is evicted
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
 
     # establish connection btwn a client and ws. waits for ws to start and adds accepted client to active connections
     async def connect(self, websocket: WebSocket, client_id: str):
         await websocket.accept()
-        self.active_connections[client_id] = websocket
+        client = Client(client_id, websocket, self.queue_size)
+        client.writer = asyncio.create_task(self._write(client))
+        previous = self.active_connections.get(client_id)
+        self.active_connections[client_id] = client
+        self._by_socket[id(websocket)] = client
+        if previous is not None:
+            # its handler still finds it by socket, and learns it was replaced on its next send
+            previous.close()
 
     # disconnects client from ws
-    async def disconnect(self, client_id: str):
-        try:
-            del self.active_connections[client_id]
-        except KeyError:
-            pass
+    async def disconnect(self, client_id: str, websocket: Optional[WebSocket] = None):
+        if websocket is not None:
+            gone = self._by_socket.pop(id(websocket), None)
+            if gone is not None:
+                gone.close()
+        client = self.active_connections.get(client_id)
+        # a reconnect under the same id may already have replaced this socket
+        if client is None or (websocket is not None and client.websocket is not websocket):
+            return
+        del self.active_connections[client_id]
+        self._by_socket.pop(id(client.websocket), None)
+        client.close()
 
     async def send_personal_message(self, data: dict, websocket: WebSocket):
-        await websocket.send_json(data)
-        return "success"
+        """
+        Queue a message for one client, behind what is already in its outbox so the order is kept.
 
-    # shows data to all clients with active connections to the ws
-    async def broadcast(self, data: dict):
+        Waits while the outbox is full, up to send_timeout seconds, after which the client is
+        evicted. Raises WebSocketDisconnect once the client is evicted or replaced, so its
+        handler stops instead of waiting on an outbox nothing drains.
+        """
+        client = self._by_socket.get(id(websocket))
+        if client is None:
+            await websocket.send_json(data)
+            return "success"
+        if client.closed.is_set():
+            raise WebSocketDisconnect(1013)
+        text = encode(data)
         try:
-            for connection in self.active_connections.values():
-                await connection.send_json(data)
+            client.queue.put_nowait(text)
             return "success"
+        except asyncio.QueueFull:
+            client.stalled(asyncio.get_running_loop().time())
+        put = asyncio.ensure_future(client.queue.put(text))
+        closed = asyncio.ensure_future(client.closed.wait())
+        done, _ = await asyncio.wait({put, closed}, timeout=self.send_timeout, return_when=asyncio.FIRST_COMPLETED)
+        closed.cancel()
+        if put in done:
+            return "success"
+        put.cancel()
+        if not client.closed.is_set():
+            await self._evict(client, "send queue full")
+        raise WebSocketDisconnect(1013)
+
+    # shows data to all clients with active connections to the ws
+    async def broadcast(self, data: dict) -> Dict[str, str]:
+        """
+        Queue a message for every client without waiting on any socket.
+
+        The message is serialized once. A client whose outbox is full misses this message,
+        and if it has not taken anything from its outbox for send_timeout seconds it is
+        evicted instead of holding everyone else back. The time counts from when its outbox
+        was found full, so a client that was only idle before is not taken for a stalled one.
+
+        Returns:
+            Per-client report: "queued", "dropped" or "evicted".
+        """
+        start = time.perf_counter()
+        text = encode(data)
+        now = asyncio.get_running_loop().time()
+        report = {}
+        for client_id, client in list(self.active_connections.items()):
+            try:
+                client.queue.put_nowait(text)
+                report[client_id] = "queued"
+            except asyncio.QueueFull:
+                client.dropped += 1
+                if client.stalled(now) > self.send_timeout:
+                    report[client_id] = "evicted"
+                    await self._evict(client, "send queue full")
+                else:
+                    report[client_id] = "dropped"
+        broadcast_seconds.observe(time.perf_counter() - start)
+        for result, count in collections.Counter(report.values()).items():
+            broadcast_messages.labels(result).inc(count)
+        return report
+
+    def queued(self) -> int:
+        """Messages waiting in every client's outbox."""
+        return sum(client.queue.qsize() for client in self.active_connections.values())
+
+    def stats(self) -> Dict[str, dict]:
+        return {
+            client_id: {"queued": client.queue.qsize(), "sent": client.sent, "dropped": client.dropped}
+            for client_id, client in self.active_connections.items()
+        }
+
+    async def _write(self, client: Client):
+        try:
+            while True:
+                text = await client.queue.get()
+                client.full_since = None
+                await asyncio.wait_for(client.websocket.send_text(text), self.send_timeout)
+                client.sent += 1
+                messages_sent.inc()
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
-            print(f"Broadcast failed: {e}")
-            return e
+            await self._evict(client, repr(e))
+
+    async def _evict(self, client: Client, reason):
+        print(f"Evicting client {client.client_id}: {reason}")
+        if self.active_connections.get(client.client_id) is client:
+            del self.active_connections[client.client_id]
+        # the entry by socket stays until the handler disconnects, so its sends see the client closed
+        client.close()
+        try:
+            # 1013: try again later
+            await client.websocket.close(code=1013)
+        except Exception:
+            pass
 
 
-manager = ConnectionManager()
\ No newline at end of file
+manager = ConnectionManager()
@@ -0,0 +1,230 @@
+import math
+from typing import Dict, Iterator, Optional, Set, Tuple
+
+import numpy as np
+
+from distance import distances_from, lower_bound, check_metric
+from table import needs, supplies
+
+
+class SpatialIndex:
+    """
+    Per-category grid index over location coordinates.
+
+    Each category keeps its own buckets of square cells (cell_size degrees wide),
+    so a nearest-neighbour query only looks at locations that actually carry the
+    category, and only at the cells closest to the query point. Distances are
+    measured with `metric` (see distance.METRICS), a whole ring of cells at a time.
+    """
+
+    def __init__(self, cell_size: float = 0.05, metric: str = "euclidean"):
+        check_metric(metric)
+        self.cell_size = cell_size
+        self.metric = metric
+        self.max_abs_lat = 0.0  # only grows, which keeps the search bound conservative
+        self.positions: Dict[str, Tuple[float, float]] = {}
+        self.categories: Dict[str, Set[str]] = {}  # name: categories it is indexed under
+        self._cells: Dict[str, Dict[Tuple[int, int], Set[str]]] = {}  # category: cell: names
+        self._counts: Dict[str, int] = {}
+        self._arrays: Dict[Tuple[str, Tuple[int, int]], tuple] = {}  # (category, cell): _cell_arrays
+
+    @classmethod
+    def from_suppliers(cls, locations: dict, cell_size: float = 0.05, metric: str = "euclidean") -> "SpatialIndex":
+        """Build an index of every location that still has surplus, by category."""
+        index = cls(cell_size, metric)
+        for name, info in locations.items():
+            index.update_supplier(name, info)
+        return index
+
+    @classmethod
+    def from_demanders(cls, locations: dict, cell_size: float = 0.05, metric: str = "euclidean") -> "SpatialIndex":
+        """Build an index of every location that still has unmet demand, by category."""
+        index = cls(cell_size, metric)
+        for name, info in locations.items():
+            index.update_demander(name, info)
+        return index
+
+    def _cell(self, lat: float, lon: float) -> Tuple[int, int]:
+        return (math.floor(lat / self.cell_size), math.floor(lon / self.cell_size))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def count(self, category: str) -> int:
+        return self._counts.get(category, 0)
+
+    def members(self, category: str) -> Iterator[str]:
+        """Every location indexed under the category, in no particular order."""
+        for names in self._cells.get(category, {}).values():
+            yield from names
+
+    def add(self, category: str, name: str, lat: float, lon: float):
+        if name in self.positions and self.positions[name] != (lat, lon):
+            # The location moved, re-bucket every category it is indexed under
+            for other in list(self.categories[name]):
+                self.remove(other, name)
+        if category in self.categories.get(name, ()):
+            return
+        self.positions[name] = (lat, lon)
+        self.max_abs_lat = max(self.max_abs_lat, abs(lat))
+        self.categories.setdefault(name, set()).add(category)
+        cells = self._cells.setdefault(category, {})
+        cell = self._cell(lat, lon)
+        cells.setdefault(cell, set()).add(name)
+        self._arrays.pop((category, cell), None)
+        self._counts[category] = self._counts.get(category, 0) + 1
+
+    def remove(self, category: str, name: str):
+        if category not in self.categories.get(name, ()):
+            return
+        cells = self._cells[category]
+        cell = self._cell(*self.positions[name])
+        cells[cell].discard(name)
+        self._arrays.pop((category, cell), None)
+        if not cells[cell]:
+            del cells[cell]
+        self._counts[category] -= 1
+        self.categories[name].discard(category)
+        if not self.categories[name]:
+            del self.categories[name]
+            del self.positions[name]
+
+    def discard(self, name: str):
+        """Remove a location from every category."""
+        for category in list(self.categories.get(name, ())):
+            self.remove(category, name)
+
+    def update_supplier(self, name: str, info: Optional[dict]):
+        """
+        Re-sync a single location after its surplus changed.
+
+        A location is indexed under every category it has items of, see table.supplies.
+        """
+        categories = supplies(info)
+        if not categories:
+            self.discard(name)
+            return
+        self._sync(name, info, set(categories))
+
+    def update_demander(self, name: str, info: Optional[dict]):
+        """
+        Re-sync a single location after its demand changed.
+
+        A location is indexed under every category it still needs, see table.needs.
+        """
+        categories = needs(info)
+        if not categories:
+            self.discard(name)
+            return
+        self._sync(name, info, set(categories))
+
+    def _sync(self, name: str, info: dict, categories: Set[str]):
+        lat, lon = info["data"]["lat"], info["data"]["lon"]
+        for category in list(self.categories.get(name, ())):
+            if category not in categories:
+                self.remove(category, name)
+        for category in categories:
+            self.add(category, name, lat, lon)
+
+    def nearest(self, category: str, lat: float, lon: float, k: int = 8,
+                exclude: Optional[Set[str]] = None) -> Iterator[Tuple[float, str]]:
+        """
+        Lazily yield (distance, name) for every location in the category, nearest first.
+
+        Ties are broken by name. Rings of cells around the query point are scanned until
+        at least k candidates are known to be closer than anything not yet scanned, and
+        those are yielded before the search widens again. Names in `exclude` at the time
+        they come up are skipped; the set may grow while the generator is in use.
+        """
+        cells = self._cells.get(category)
+        if not cells:
+            return
+        total = self._counts[category]
+        max_abs_lat = max(self.max_abs_lat, abs(lat))
+        cx, cy = self._cell(lat, lon)
+        # Candidates scanned but not yielded yet, kept as arrays so only yielded ones become tuples
+        distances = np.empty(0)
+        names = np.empty(0, dtype=object)
+        seen = 0
+        ring = 0  # rings [0, ring) have been scanned
+        far = None  # (ring, cell) of the occupied cells not scanned yet, furthest first
+        while True:
+            # Anything outside the scanned rings is strictly further than this
+            bound = lower_bound((ring - 1) * self.cell_size, max_abs_lat, self.metric) * (1 - 1e-9)
+            ready = distances < bound if seen < total else np.ones(len(distances), dtype=bool)
+            if ready.any():
+                order = np.flatnonzero(ready)
+                order = order[np.argsort(distances[order], kind="stable")]
+                batch = distances[order], names[order]
+                distances, names = distances[~ready], names[~ready]
+                yield from _in_order(*batch, exclude)
+            if seen == total:
+                return
+
+            # Widen the search until at least k more candidates are in hand
+            target = min(total, seen + k)
+            scanned = []
+            while seen < target:
+                if far is None and 8 * ring > len(cells):
+                    # Scanning rings of empty space costs more than sorting the occupied cells by ring
+                    far = sorted(
+                        ((max(abs(x - cx), abs(y - cy)), (x, y)) for x, y in cells),
+                        reverse=True,
+                    )
+                    while far and far[-1][0] < ring:
+                        far.pop()
+                if far is None:
+                    ring_cells = [cell for cell in _ring_cells(cx, cy, ring) if cell in cells]
+                elif far:
+                    # Jump straight to the next ring that has any locations
+                    ring = far[-1][0]
+                    ring_cells = []
+                    while far and far[-1][0] == ring:
+                        ring_cells.append(far.pop()[1])
+                else:
+                    break
+                for cell in ring_cells:
+                    scanned.append(self._cell_arrays(category, cell))
+                    seen += len(scanned[-1][2])
+                ring += 1
+            if scanned:
+                lats, lons, cell_names = (np.concatenate(column) for column in zip(*scanned))
+                distances = np.concatenate((distances, distances_from(lat, lon, lats, lons, self.metric)))
+                names = np.concatenate((names, cell_names))
+
+    def _cell_arrays(self, category: str, cell: Tuple[int, int]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Coordinates and names of one cell as arrays, cached until the cell changes."""
+        arrays = self._arrays.get((category, cell))
+        if arrays is None:
+            cell_names = list(self._cells[category][cell])
+            coordinates = np.array([self.positions[name] for name in cell_names], dtype=np.float64)
+            arrays = coordinates[:, 0], coordinates[:, 1], np.array(cell_names, dtype=object)
+            self._arrays[(category, cell)] = arrays
+        return arrays
+
+
+def _in_order(distances: np.ndarray, names: np.ndarray, exclude: Optional[Set[str]],
+              chunk: int = 16) -> Iterator[Tuple[float, str]]:
+    """Yield (distance, name) from arrays sorted by distance, with equal distances ordered by name."""
+    i = 0
+    while i < len(distances):
+        j = min(len(distances), i + chunk)
+        while j < len(distances) and distances[j] == distances[j - 1]:
+            j += 1
+        for candidate in sorted(zip(distances[i:j].tolist(), names[i:j].tolist())):
+            if exclude is None or candidate[1] not in exclude:
+                yield candidate
+        i = j
+
+
+def _ring_cells(cx: int, cy: int, ring: int) -> Iterator[Tuple[int, int]]:
+    """Cells at exactly Chebyshev distance `ring` from (cx, cy)."""
+    if ring == 0:
+        yield (cx, cy)
+        return
+    for x in range(cx - ring, cx + ring + 1):
+        yield (x, cy - ring)
+        yield (x, cy + ring)
+    for y in range(cy - ring + 1, cy + ring):
+        yield (cx - ring, y)
+        yield (cx + ring, y)
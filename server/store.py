@@ -0,0 +1,221 @@
+import json
+import sqlite3
+import threading
+from typing import Any, Dict, Iterable, List, Optional
+
+# The list fields of a location that are stored row by row, everything else stays in the doc column
+ITEM_FIELDS = ("surplus", "surplus_mapping", "demand")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS locations (
+    name TEXT PRIMARY KEY,
+    lat REAL,
+    lon REAL,
+    address TEXT,
+    fields TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS entries (
+    location TEXT NOT NULL REFERENCES locations(name) ON DELETE CASCADE,
+    field TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    category TEXT NOT NULL,
+    item TEXT,
+    PRIMARY KEY (location, field, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS entries_by_category ON entries (category, field, location);
+CREATE INDEX IF NOT EXISTS locations_by_coordinates ON locations (lat, lon);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+# Statements are constant strings so sqlite3's statement cache prepares each of them once per connection
+UPSERT_LOCATION = (
+    "INSERT INTO locations (name, lat, lon, address, fields, doc) VALUES (?, ?, ?, ?, ?, ?) "
+    "ON CONFLICT (name) DO UPDATE SET lat = excluded.lat, lon = excluded.lon, address = excluded.address, "
+    "fields = excluded.fields, doc = excluded.doc"
+)
+DELETE_ENTRIES = "DELETE FROM entries WHERE location = ?"
+INSERT_ENTRY = "INSERT INTO entries (location, field, position, category, item) VALUES (?, ?, ?, ?, ?)"
+DELETE_LOCATION = "DELETE FROM locations WHERE name = ?"
+UPSERT_META = "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)"
+DELETE_META = "DELETE FROM meta WHERE key = ?"
+
+
+class SQLiteStore:
+    """
+    A durable copy of the db dict in one SQLite file.
+
+    db.py keeps serving get_db() from memory and writes every change through here, so the data
+    survives restarts and can be queried without copying the whole dict. The file runs in WAL
+    mode: writes go through one connection under a lock, and every reading thread gets its own
+    connection, so reads never wait for a write to finish.
+
+    Each location is one row in `locations` (coordinates and address as columns, anything else as
+    JSON), and each entry of its surplus, surplus_mapping and demand lists is one row in
+    `entries`. Top-level keys other than "locations", such as "dispatchs", go to `meta`.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._writer = self._connect()
+        self._writer.execute("PRAGMA journal_mode=WAL")
+        self._writer.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        # autocommit mode, transactions are opened explicitly with BEGIN
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA foreign_keys=ON")
+        return conn
+
+    def _reader(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def is_empty(self) -> bool:
+        return self._reader().execute("SELECT 1 FROM locations LIMIT 1").fetchone() is None
+
+    def load(self) -> Dict[str, Any]:
+        """Rebuild the whole db dict."""
+        conn = self._reader()
+        conn.execute("BEGIN")
+        try:
+            locations = {
+                name: _location(fields, doc)
+                for name, fields, doc in conn.execute("SELECT name, fields, doc FROM locations ORDER BY rowid")
+            }
+            rows = conn.execute("SELECT location, field, category, item FROM entries ORDER BY location, field, position")
+            for name, field, category, item in rows:
+                _add_entry(locations[name], field, category, item)
+            db = {key: json.loads(value) for key, value in conn.execute("SELECT key, value FROM meta")}
+        finally:
+            conn.execute("COMMIT")
+        db["locations"] = locations
+        return db
+
+    def load_location(self, name: str) -> Optional[dict]:
+        conn = self._reader()
+        conn.execute("BEGIN")
+        try:
+            row = conn.execute("SELECT fields, doc FROM locations WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            location = _location(*row)
+            rows = conn.execute(
+                "SELECT field, category, item FROM entries WHERE location = ? ORDER BY field, position", (name,)
+            )
+            for field, category, item in rows:
+                _add_entry(location, field, category, item)
+        finally:
+            conn.execute("COMMIT")
+        return location
+
+    def locations_with(self, category: str, field: str = "surplus") -> List[str]:
+        """Names of the locations whose `field` ("surplus" or "demand") lists `category`."""
+        rows = self._reader().execute(
+            "SELECT DISTINCT location FROM entries WHERE category = ? AND field = ? ORDER BY location",
+            (category, field),
+        )
+        return [name for name, in rows]
+
+    def locations_within(self, lat_min: float, lat_max: float, lon_min: float, lon_max: float) -> List[str]:
+        """Names of the locations inside a latitude/longitude box."""
+        rows = self._reader().execute(
+            "SELECT name FROM locations WHERE lat BETWEEN ? AND ? AND lon BETWEEN ? AND ? ORDER BY name",
+            (lat_min, lat_max, lon_min, lon_max),
+        )
+        return [name for name, in rows]
+
+    def save(self, db: Dict[str, Any], names: Iterable[str] = (), keys: Iterable[str] = ()):
+        """
+        Write the current state of some locations and top-level keys of `db` in one transaction.
+
+        A name or key that is no longer in `db` is deleted. This is what save_items and the matcher
+        commit call with what they just changed.
+        """
+        locations = db.get("locations", {})
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name in names:
+                    if name in locations:
+                        _write_location(conn, name, locations[name])
+                    else:
+                        conn.execute(DELETE_LOCATION, (name,))
+                for key in keys:
+                    if key in db:
+                        conn.execute(UPSERT_META, (key, json.dumps(db[key])))
+                    else:
+                        conn.execute(DELETE_META, (key,))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def replace(self, db: Dict[str, Any]):
+        """Overwrite everything with the contents of a db dict, as set_db does."""
+        with self._lock:
+            conn = self._writer
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute("DELETE FROM entries")
+                conn.execute("DELETE FROM locations")
+                conn.execute("DELETE FROM meta")
+                for name, location in db.get("locations", {}).items():
+                    _write_location(conn, name, location)
+                for key, value in db.items():
+                    if key != "locations":
+                        conn.execute(UPSERT_META, (key, json.dumps(value)))
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+    def close(self):
+        self._writer.close()
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+
+def _write_location(conn: sqlite3.Connection, name: str, location: dict):
+    data = location.get("data", {})
+    doc = {key: value for key, value in location.items() if key not in ITEM_FIELDS}
+    fields = ",".join(field for field in ITEM_FIELDS if field in location)
+    conn.execute(UPSERT_LOCATION, (name, data.get("lat"), data.get("lon"), data.get("address"), fields, json.dumps(doc)))
+    conn.execute(DELETE_ENTRIES, (name,))
+    rows = [(name, field, i, category, None) for field in ("surplus", "demand")
+            for i, category in enumerate(location.get(field, ()))]
+    mapping = location.get("surplus_mapping", {})
+    position = 0
+    for category, items in mapping.items():
+        # an empty category is kept as a single row without an item
+        for item in items or [None]:
+            rows.append((name, "surplus_mapping", position, category, item))
+            position += 1
+    conn.executemany(INSERT_ENTRY, rows)
+
+
+def _location(fields: str, doc: str) -> dict:
+    location = json.loads(doc)
+    for field in fields.split(",") if fields else ():
+        location[field] = {} if field == "surplus_mapping" else []
+    return location
+
+
+def _add_entry(location: dict, field: str, category: str, item: Optional[str]):
+    if field == "surplus_mapping":
+        items = location[field].setdefault(category, [])
+        if item is not None:
+            items.append(item)
+    else:
+        location[field].append(category)
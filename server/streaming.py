@@ -0,0 +1,136 @@
+import asyncio
+import threading
+from concurrent.futures import Executor
+from typing import AsyncIterator, Callable, Dict, Iterator, Optional, TypeVar
+
+T = TypeVar("T")
+
+_DONE = object()
+
+
+async def stream_in_thread(make_iterator: Callable[[], Iterator[T]],
+                           executor: Optional[Executor] = None,
+                           stopped: Optional[threading.Event] = None) -> AsyncIterator[T]:
+    """
+    Drive a blocking iterator on a worker thread and yield its items on the event loop.
+
+    The iterator is created and consumed entirely on the worker (so a blocking
+    constructor such as swarm.run(..., stream=True) stays off the loop too), and every
+    item is handed back through an asyncio.Queue. If the consumer stops early, for
+    example because the websocket closed, the worker stops at its next item.
+
+    Args:
+        make_iterator: Called on the worker thread to create the iterator.
+        executor: Where to run the worker, the loop's default executor if None.
+        stopped: Set once the consumer stops, so work the iterator waits on can give up too.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stopped = stopped if stopped is not None else threading.Event()
+
+    def produce():
+        try:
+            for item in make_iterator():
+                if stopped.is_set():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, (item, None))
+        except BaseException as e:
+            loop.call_soon_threadsafe(queue.put_nowait, (_DONE, e))
+        else:
+            loop.call_soon_threadsafe(queue.put_nowait, (_DONE, None))
+
+    loop.run_in_executor(executor, produce)
+    try:
+        while True:
+            item, error = await queue.get()
+            if item is _DONE:
+                if error is not None:
+                    raise error
+                break
+            yield item
+    finally:
+        stopped.set()
+
+
+class CoalescingStats:
+    """Counters for coalesce(): how many frames it saved and how long it held text back."""
+
+    def __init__(self):
+        self.chunks = 0
+        self.frames = 0
+        self.total_delay = 0.0  # summed over every chunk, from arrival to flush
+        self.max_delay = 0.0
+
+    @property
+    def frames_saved(self) -> int:
+        return self.chunks - self.frames
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "chunks": self.chunks,
+            "frames": self.frames,
+            "frames_saved": self.frames_saved,
+            "mean_added_latency_ms": 1000 * self.total_delay / self.chunks if self.chunks else 0.0,
+            "max_added_latency_ms": 1000 * self.max_delay,
+        }
+
+
+async def coalesce(chunks: AsyncIterator[str], window: float = 0.04, max_chars: int = 256,
+                   stats: Optional[CoalescingStats] = None) -> AsyncIterator[str]:
+    """
+    Merge a stream of small text chunks (often single tokens) into fewer, larger ones.
+
+    Text is held back for at most `window` seconds after the first chunk of a batch arrived,
+    or until the batch reaches `max_chars`, whichever comes first. Whatever is left is
+    flushed when the stream ends. A window of 0 passes every chunk straight through.
+    """
+    loop = asyncio.get_running_loop()
+    iterator = chunks.__aiter__()
+    buffer = []
+    arrivals = []
+    size = 0
+    pending = None
+
+    def flush():
+        nonlocal size
+        now = loop.time()
+        text = "".join(buffer)
+        if stats is not None:
+            stats.frames += 1
+            for arrived in arrivals:
+                stats.total_delay += now - arrived
+                stats.max_delay = max(stats.max_delay, now - arrived)
+        buffer.clear()
+        arrivals.clear()
+        size = 0
+        return text
+
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            timeout = max(0.0, arrivals[0] + window - loop.time()) if buffer else None
+            done, _ = await asyncio.wait({pending}, timeout=timeout)
+            if not done:
+                # The window closed before the next chunk arrived
+                yield flush()
+                continue
+            try:
+                chunk = pending.result()
+            except StopAsyncIteration:
+                break
+            finally:
+                if pending.done():
+                    pending = None
+            buffer.append(chunk)
+            arrivals.append(loop.time())
+            size += len(chunk)
+            if stats is not None:
+                stats.chunks += 1
+            if size >= max_chars or window <= 0:
+                yield flush()
+        if buffer:
+            yield flush()
+    finally:
+        if pending is not None:
+            pending.cancel()
@@ -0,0 +1,200 @@
+from typing import Dict, List, Optional, Set
+
+import numpy as np
+
+
+def is_supplier(info: dict) -> bool:
+    """
+    Whether a location gives rather than receives.
+
+    A location with a surplus_mapping is a supplier, even once it has run out, and never
+    demands whatever its demand list says. Every index of the book classifies locations this way.
+    """
+    return "surplus_mapping" in info
+
+
+def supplies(info: Optional[dict]) -> Dict[str, int]:
+    """category: items left to give, for one location dict."""
+    if not info or not is_supplier(info):
+        return {}
+    return {category: len(items) for category, items in info["surplus_mapping"].items() if items}
+
+
+def needs(info: Optional[dict]) -> Dict[str, int]:
+    """category: units still needed, for one location dict."""
+    counts = {}
+    if info and not is_supplier(info):
+        for category in info.get("demand", ()):
+            counts[category] = counts.get(category, 0) + 1
+    return counts
+
+
+class LocationTable:
+    """
+    What every location can give or still needs, by category, in columns.
+
+    One row per location, with per category how many items it has left to give (supply) and how
+    many units it still needs (demand), in int32 matrices with one column per category. Category
+    names are interned to column ids once, and rows of removed locations are reused.
+
+    For every category the rows that give or need it are kept in a set, so "who has dairy, and
+    how much" reads the k rows involved instead of scanning a column. The per-category totals
+    are kept alongside, and let the matcher stop looking for a category as soon as one side has
+    nothing left.
+
+    The table is an index over db["locations"], which keeps the item names, coordinates and
+    addresses, and stays the format the store, the agents and the websocket use.
+    """
+
+    def __init__(self, capacity: int = 1024, categories: int = 8):
+        self.names: List[Optional[str]] = []
+        self.rows: Dict[str, int] = {}
+        self.categories: List[str] = []
+        self.category_ids: Dict[str, int] = {}
+        self._free: List[int] = []
+        self.supply = np.zeros((capacity, categories), dtype=np.int32)
+        self.demand = np.zeros((capacity, categories), dtype=np.int32)
+        self.supply_rows: List[Set[int]] = []  # per column, the rows with supply
+        self.demand_rows: List[Set[int]] = []
+        self.supply_total: Dict[str, int] = {}
+        self.demand_total: Dict[str, int] = {}
+
+    @classmethod
+    def from_locations(cls, locations: dict) -> "LocationTable":
+        table = cls(capacity=max(len(locations), 1))
+        for name, info in locations.items():
+            table.update(name, info)
+        return table
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self.rows
+
+    @property
+    def nbytes(self) -> int:
+        """Bytes held by the count matrices."""
+        return self.supply.nbytes + self.demand.nbytes
+
+    def category_id(self, category: str) -> int:
+        """The column of a category, added on first use."""
+        column = self.category_ids.get(category)
+        if column is None:
+            column = self.category_ids[category] = len(self.categories)
+            self.categories.append(category)
+            self.supply_rows.append(set())
+            self.demand_rows.append(set())
+            if column >= self.supply.shape[1]:
+                self.supply = _grow(self.supply, axis=1)
+                self.demand = _grow(self.demand, axis=1)
+        return column
+
+    def update(self, name: str, info: Optional[dict]):
+        """Re-sync a single location after it was written, or drop it if `info` is None."""
+        if not info:
+            self.remove(name)
+            return
+        row = self.rows.get(name)
+        if row is None:
+            row = self._allocate(name)
+        self._set(row, self.supply, self.supply_rows, self.supply_total, supplies(info))
+        self._set(row, self.demand, self.demand_rows, self.demand_total, needs(info))
+
+    def remove(self, name: str):
+        row = self.rows.pop(name, None)
+        if row is None:
+            return
+        self._set(row, self.supply, self.supply_rows, self.supply_total, {})
+        self._set(row, self.demand, self.demand_rows, self.demand_total, {})
+        self.names[row] = None
+        self._free.append(row)
+
+    def suppliers(self, category: str) -> Dict[str, int]:
+        """supplier: items left, for every supplier of the category."""
+        return self._members(self.supply, self.supply_rows, category)
+
+    def demanders(self, category: str) -> Dict[str, int]:
+        """demander: units outstanding, for every demander of the category."""
+        return self._members(self.demand, self.demand_rows, category)
+
+    def supplies(self, name: str) -> Dict[str, int]:
+        """category: items left, for one location."""
+        return self._counts(self.supply, name)
+
+    def needs(self, name: str) -> Dict[str, int]:
+        """category: units outstanding, for one location."""
+        return self._counts(self.demand, name)
+
+    def summary(self) -> Dict[str, Dict[str, int]]:
+        """Per category: how many suppliers and demanders, and how many units each side holds."""
+        return {
+            category: {
+                "suppliers": len(self.supply_rows[self.category_ids[category]]),
+                "supply": self.supply_total.get(category, 0),
+                "demanders": len(self.demand_rows[self.category_ids[category]]),
+                "demand": self.demand_total.get(category, 0),
+            }
+            for category in sorted(set(self.supply_total) | set(self.demand_total))
+        }
+
+    def _set(self, row: int, matrix: np.ndarray, members: List[Set[int]], totals: Dict[str, int],
+             counts: Dict[str, int]):
+        # Replace the counts of one row, keeping the member sets and totals in step
+        columns = {self.category_id(category): quantity for category, quantity in counts.items()}
+        for column in np.flatnonzero(matrix[row]).tolist():
+            if column not in columns:
+                self._change(row, matrix, members, totals, column, 0)
+        for column, quantity in columns.items():
+            self._change(row, matrix, members, totals, column, quantity)
+
+    def _change(self, row: int, matrix: np.ndarray, members: List[Set[int]], totals: Dict[str, int],
+                column: int, quantity: int):
+        old = int(matrix[row, column])
+        if old == quantity:
+            return
+        matrix[row, column] = quantity
+        category = self.categories[column]
+        totals[category] = totals.get(category, 0) + quantity - old
+        if not totals[category]:
+            del totals[category]
+        if quantity:
+            members[column].add(row)
+        else:
+            members[column].discard(row)
+
+    def _members(self, matrix: np.ndarray, members: List[Set[int]], category: str) -> Dict[str, int]:
+        column = self.category_ids.get(category)
+        if column is None:
+            return {}
+        rows = list(members[column])
+        return dict(zip([self.names[row] for row in rows], matrix[rows, column].tolist()))
+
+    def _counts(self, matrix: np.ndarray, name: str) -> Dict[str, int]:
+        row = self.rows.get(name)
+        if row is None:
+            return {}
+        counts = matrix[row]
+        return {self.categories[column]: int(counts[column]) for column in np.flatnonzero(counts)}
+
+    def _allocate(self, name: str) -> int:
+        if self._free:
+            row = self._free.pop()
+            self.names[row] = name
+        else:
+            row = len(self.names)
+            self.names.append(name)
+            if row >= len(self.supply):
+                self.supply = _grow(self.supply, axis=0)
+                self.demand = _grow(self.demand, axis=0)
+        self.rows[name] = row
+        return row
+
+
+def _grow(array: np.ndarray, axis: int) -> np.ndarray:
+    # Double along one axis, keeping the contents
+    shape = list(array.shape)
+    shape[axis] = max(1, shape[axis]) * 2
+    grown = np.zeros(shape, dtype=array.dtype)
+    grown[tuple(slice(0, size) for size in array.shape)] = array
+    return grown
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The server modules import each other by name, as when the server is run from its directory
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+from flow import solve_transportation, transportation_cost
+
+
+def reference_cost(cost: np.ndarray, supply, demand) -> float:
+    """Minimum cost of shipping min(supply, demand) units, by successive shortest paths (Bellman-Ford)."""
+    m, n = cost.shape
+    source, sink = m + n, m + n + 1
+    edges = []  # [tail, head, capacity, cost], each followed by its reverse
+
+    def add(tail, head, capacity, unit_cost):
+        edges.append([tail, head, capacity, unit_cost])
+        edges.append([head, tail, 0, -unit_cost])
+
+    for i in range(m):
+        add(source, i, int(supply[i]), 0.0)
+        for j in range(n):
+            add(i, m + j, int(min(supply[i], demand[j])), float(cost[i, j]))
+    for j in range(n):
+        add(m + j, sink, int(demand[j]), 0.0)
+
+    total = 0.0
+    while True:
+        distance = [np.inf] * (m + n + 2)
+        via = [None] * (m + n + 2)
+        distance[source] = 0.0
+        for _ in range(m + n + 1):
+            changed = False
+            for e, (tail, head, capacity, unit_cost) in enumerate(edges):
+                if capacity > 0 and distance[tail] + unit_cost < distance[head] - 1e-12:
+                    distance[head], via[head], changed = distance[tail] + unit_cost, e, True
+            if not changed:
+                break
+        if via[sink] is None:
+            return total
+        path, node = [], sink
+        while node != source:
+            path.append(via[node])
+            node = edges[via[node]][0]
+        units = min(edges[e][2] for e in path)
+        for e in path:
+            edges[e][2] -= units
+            edges[e ^ 1][2] += units
+        total += units * distance[sink]
+
+
+@pytest.mark.parametrize("seed", range(100))
+def test_solve_transportation_is_optimal(seed):
+    rng = np.random.default_rng(seed)
+    m, n = rng.integers(1, 8, 2)
+    cost = rng.random((m, n)) * 10
+    if seed % 3 == 0:
+        cost = np.round(cost)  # ties and degenerate bases
+    supply, demand = rng.integers(0, 6, m), rng.integers(0, 6, n)
+
+    flow = solve_transportation(cost, supply, demand)
+
+    assert (flow >= 0).all()
+    assert (flow.sum(axis=1) <= supply).all() and (flow.sum(axis=0) <= demand).all()
+    assert flow.sum() == min(supply.sum(), demand.sum())
+    assert transportation_cost(cost, flow) == pytest.approx(reference_cost(cost, supply, demand), abs=1e-9)
@@ -0,0 +1,74 @@
+import os
+
+import pytest
+
+pytest.importorskip("swarm")
+# agents builds its LLM clients at import, nothing is sent in these tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+
+import agents
+from matching import MatchBook
+
+
+def location(lat, lon, **fields):
+    return {**fields, "data": {"lat": lat, "lon": lon, "address": "1 Test St"}}
+
+
+@pytest.fixture
+def swarm(monkeypatch):
+    db = {"locations": {
+        "Store": location(42.30, -83.20, surplus=["fruits"], surplus_mapping={"fruits": ["apple", "pear"]}),
+        "Pantry": location(42.31, -83.21, demand=["fruits"]),
+    }}
+    swarm = agents.AgentSwarm(None, db=db, book=MatchBook(db["locations"]), workers=1)
+    monkeypatch.setattr(swarm, "broadcast", lambda data: None)
+    yield swarm
+    swarm.shutdown()
+
+
+def write_during_match(monkeypatch, swarm, writes):
+    """Replace the Store's fruits with the next of `writes` after each of the first len(writes) matches."""
+    book, match = swarm.book, swarm.book.match
+    writes = list(writes)
+
+    def racing_match(*args, **kwargs):
+        result = match(*args, **kwargs)
+        if writes:
+            swarm.save_items({}, "Store", "supply", ["fruits"], {"fruits": writes.pop(0)})
+        return result
+
+    monkeypatch.setattr(book, "match", racing_match)
+
+
+def conflicts(outcome):
+    return agents.match_conflicts.labels(outcome).value
+
+
+def test_round_retries_after_a_conflicting_write(monkeypatch, swarm):
+    retried = conflicts("retried")
+    write_during_match(monkeypatch, swarm, [["plum", "fig"]])
+
+    assignments, _, _ = swarm.match_round()
+
+    assert assignments == [("Store", "Pantry", "fruits", ["plum"])]
+    assert swarm.db["dispatchs"] == assignments
+    assert swarm.db["locations"]["Store"]["surplus_mapping"] == {"fruits": ["fig"]}
+    assert swarm.db["locations"]["Pantry"]["demand"] == []
+    assert conflicts("retried") == retried + 1
+
+
+def test_round_gives_up_after_the_last_retry(monkeypatch, swarm):
+    swarm.match_retries = 1
+    retried, gave_up = conflicts("retried"), conflicts("gave_up")
+    write_during_match(monkeypatch, swarm, [["plum"], ["fig"]])
+
+    assignments, _, _ = swarm.match_round()
+
+    assert assignments == []
+    assert "dispatchs" not in swarm.db
+    assert swarm.db["locations"]["Pantry"]["demand"] == ["fruits"]
+    assert (conflicts("retried"), conflicts("gave_up")) == (retried + 1, gave_up + 1)
+
+    # Nothing was lost, the next round matches what the last write left
+    assignments, _, _ = swarm.match_round()
+    assert assignments == [("Store", "Pantry", "fruits", ["fig"])]
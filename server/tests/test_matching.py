@@ -0,0 +1,132 @@
+import copy
+import heapq
+import random
+
+import pytest
+
+from distance import calculate_distance
+from matching import MatchBook, commit_assignments, greedy_match, optimal_match
+from spatial import SpatialIndex
+
+CATEGORIES = ["fruits", "vegetables", "grains", "dairy", "meat", "seafood", "baked goods"]
+
+
+def random_locations(seed: int, suppliers: int, demanders: int, spread: float, grid: bool = False) -> dict:
+    """Suppliers and demanders around Dearborn. On a grid, many pairs tie on distance."""
+    r = random.Random(seed)
+
+    def position():
+        lat, lon = r.uniform(-spread, spread), r.uniform(-spread, spread)
+        return (42.3 + round(lat, 2), -83.2 + round(lon, 2)) if grid else (42.3 + lat, -83.2 + lon)
+
+    locations = {}
+    for i in range(suppliers):
+        mapping = {c: [f"{c}{j}" for j in range(r.randint(0, 4))] for c in r.sample(CATEGORIES, r.randint(1, 4))}
+        lat, lon = position()
+        locations[f"S{i}"] = {"surplus": list(mapping), "surplus_mapping": mapping, "data": {"lat": lat, "lon": lon}}
+    for i in range(demanders):
+        lat, lon = position()
+        locations[f"D{i}"] = {"demand": [r.choice(CATEGORIES) for _ in range(r.randint(0, 6))],
+                              "data": {"lat": lat, "lon": lon}}
+    return locations
+
+
+def brute_force_match(locations: dict) -> list:
+    """Every (distance, demander, supplier, category) pair on one heap, nearest first."""
+    supply = {name: {c: list(items) for c, items in info["surplus_mapping"].items()}
+              for name, info in locations.items() if "surplus_mapping" in info}
+    need = {}
+    for name, info in locations.items():
+        if "surplus_mapping" not in info:
+            for category in info.get("demand", ()):
+                need.setdefault(name, {})[category] = need.get(name, {}).get(category, 0) + 1
+    heap = []
+    for demander, counts in need.items():
+        d = locations[demander]["data"]
+        for supplier, mapping in supply.items():
+            s = locations[supplier]["data"]
+            for category in counts:
+                if category in mapping:
+                    heap.append((calculate_distance(d["lat"], d["lon"], s["lat"], s["lon"]), demander, supplier, category))
+    heapq.heapify(heap)
+    assignments = []
+    while heap:
+        _, demander, supplier, category = heapq.heappop(heap)
+        left, wanted = supply[supplier][category], need[demander][category]
+        quantity = min(len(left), wanted)
+        if quantity:
+            assignments.append((supplier, demander, category, left[:quantity]))
+            supply[supplier][category] = left[quantity:]
+            need[demander][category] = wanted - quantity
+    return assignments
+
+
+def travelled(locations: dict, assignments: list) -> float:
+    total = 0.0
+    for supplier, demander, _, items in assignments:
+        s, d = locations[supplier]["data"], locations[demander]["data"]
+        total += len(items) * calculate_distance(s["lat"], s["lon"], d["lat"], d["lon"])
+    return total
+
+
+def write(locations: dict, r: random.Random, name: str) -> list:
+    """Add supply or demand to a location the way save_items does, and return the categories."""
+    info = locations[name]
+    if r.random() < 0.5:
+        groups = r.sample(CATEGORIES, r.randint(1, 3))
+        info.setdefault("surplus", []).extend(groups)
+        info.setdefault("surplus_mapping", {}).update(
+            {c: [f"{c}-{r.random():.6f}" for _ in range(r.randint(1, 3))] for c in groups})
+    else:
+        groups = [r.choice(CATEGORIES) for _ in range(r.randint(1, 4))]
+        info.setdefault("demand", []).extend(groups)
+    return groups
+
+
+@pytest.mark.parametrize("seed", range(60))
+def test_greedy_matches_brute_force(seed):
+    locations = random_locations(seed, seed % 40 + 1, seed % 37 + 1, spread=[0.01, 0.5, 5][seed % 3], grid=seed % 2 == 0)
+    index = SpatialIndex.from_suppliers(locations, cell_size=[0.05, 0.01, 0.3][seed % 3])
+
+    assignments, _, _ = greedy_match(locations, index, k=[1, 8, 3][seed % 3])
+
+    assert assignments == brute_force_match(locations)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_incremental_rounds_match_a_full_rematch(seed):
+    r = random.Random(seed)
+    locations = random_locations(seed, 15, 25, spread=0.3)
+    book = MatchBook(locations, cell_size=[0.01, 0.05, 0.3][seed % 3])
+    reference = copy.deepcopy(locations)
+
+    for _ in range(20):
+        assignments, _, _ = book.match()
+        assert assignments == greedy_match(reference, SpatialIndex.from_suppliers(reference))[0]
+        book.commit(assignments)
+        commit_assignments(reference, assignments)
+        assert locations == reference
+        for _ in range(r.randint(1, 3)):
+            name = r.choice(list(locations))
+            book.record(name, write(locations, r, name))
+            reference[name] = copy.deepcopy(locations[name])
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_incremental_optimal_rounds_cost_the_same_as_a_full_rematch(seed):
+    r = random.Random(seed)
+    locations = random_locations(seed, 15, 25, spread=0.3)
+    book = MatchBook(locations)
+    reference = copy.deepcopy(locations)
+
+    for _ in range(10):
+        assignments, _, _ = book.match("optimal")
+        full, _, _ = optimal_match(reference, SpatialIndex.from_suppliers(reference))
+        assert sum(len(items) for *_, items in assignments) == sum(len(items) for *_, items in full)
+        assert travelled(locations, assignments) == pytest.approx(travelled(reference, full))
+        book.commit(assignments)
+        commit_assignments(reference, assignments)
+        for _ in range(r.randint(1, 3)):
+            name = r.choice(list(locations))
+            book.record(name, write(locations, r, name))
+            reference[name] = copy.deepcopy(locations[name])
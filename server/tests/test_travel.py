@@ -0,0 +1,104 @@
+import copy
+import math
+import random
+
+import numpy as np
+import pytest
+
+import travel
+from distance import calculate_distance
+from roads import RoadNetwork
+
+
+def random_network(r: random.Random, nodes: int) -> RoadNetwork:
+    """A few one-way and two-way roads between random points, not always connected."""
+    lats = np.array([42.3 + r.uniform(-0.05, 0.05) for _ in range(nodes)])
+    lons = np.array([-83.2 + r.uniform(-0.05, 0.05) for _ in range(nodes)])
+    tails, heads, seconds = [], [], []
+    for _ in range(nodes * 2):
+        tail, head = r.sample(range(nodes), 2)
+        time = r.uniform(10, 300)
+        tails.append(tail), heads.append(head), seconds.append(time)
+        if r.random() < 0.6:
+            tails.append(head), heads.append(tail), seconds.append(time)
+    return RoadNetwork(lats, lons, np.array(tails, dtype=np.int64), np.array(heads, dtype=np.int64),
+                       np.array(seconds, dtype=np.float64))
+
+
+def shortest_times(network: RoadNetwork) -> np.ndarray:
+    """All-pairs shortest times by Floyd-Warshall, independent of RoadNetwork.travel_times."""
+    n = len(network)
+    times = np.full((n, n), np.inf)
+    np.fill_diagonal(times, 0.0)
+    indptr, indices, weights = network.forward
+    for tail in range(n):
+        for i in range(indptr[tail], indptr[tail + 1]):
+            times[tail, indices[i]] = min(times[tail, indices[i]], weights[i])
+    for k in range(n):
+        times = np.minimum(times, times[:, k:k + 1] + times[k:k + 1, :])
+    return times
+
+
+def random_locations(r: random.Random, count: int) -> dict:
+    return {
+        f"L{i}": {"data": {"lat": 42.3 + r.uniform(-0.06, 0.06), "lon": -83.2 + r.uniform(-0.06, 0.06)}}
+        for i in range(count)
+    }
+
+
+def expected_matrix(network: RoadNetwork, times: np.ndarray, locations: dict) -> np.ndarray:
+    """Walk to the nearest node, drive the shortest route, walk from the nearest node."""
+    positions = [(info["data"]["lat"], info["data"]["lon"]) for info in locations.values()]
+    nodes, km = network.snap(positions)
+    access = np.array(km) * travel.ACCESS_SECONDS_PER_KM
+    expected = access[:, None] + times[np.ix_(nodes, nodes)] + access[None, :]
+    np.fill_diagonal(expected, 0.0)
+    expected[~np.isfinite(expected)] = np.nan
+    return expected
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_built_matrix_matches_shortest_paths(seed, tmp_path):
+    r = random.Random(seed)
+    network = random_network(r, r.randint(2, 25))
+    locations = random_locations(r, r.randint(1, 15))
+    path = str(tmp_path / "travel.npy")
+
+    matrix = travel.build(path, network, locations, capacity=len(locations) + 2)
+
+    np.testing.assert_allclose(matrix.matrix[:len(locations), :len(locations)],
+                               expected_matrix(network, shortest_times(network), locations),
+                               rtol=1e-5, equal_nan=True)
+    assert np.isnan(matrix.matrix[len(locations):]).all()
+    names = list(locations)
+    for i, a in enumerate(names):
+        for j, b in enumerate(names):
+            km = calculate_distance(locations[a]["data"]["lat"], locations[a]["data"]["lon"],
+                                    locations[b]["data"]["lat"], locations[b]["data"]["lon"])
+            seconds = float(matrix.matrix[i, j])
+            if km > 0 and not math.isnan(seconds):
+                assert matrix.seconds_per_km * km <= seconds * (1 + 1e-5)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_updated_matrix_matches_a_rebuild(seed, tmp_path):
+    r = random.Random(seed)
+    network = random_network(r, 20)
+    locations = random_locations(r, 10)
+    path = str(tmp_path / "travel.npy")
+    travel.build(path, network, locations, capacity=13)
+
+    moved = copy.deepcopy(locations)
+    for name in r.sample(list(moved), 3):
+        moved[name]["data"] = random_locations(r, 1)["L0"]["data"]
+    moved.update({f"N{i}": info for i, info in enumerate(random_locations(r, 2).values())})
+    stale = travel.TravelMatrix(path).stale(moved)
+    assert len(stale) == 5
+    assert travel.update(path, network, moved) == stale
+
+    updated = travel.TravelMatrix(path)
+    order = [updated.index[name] for name in moved]
+    np.testing.assert_allclose(updated.matrix[np.ix_(order, order)],
+                               expected_matrix(network, shortest_times(network), moved),
+                               rtol=1e-5, equal_nan=True)
+    assert updated.stale(moved) == []
@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import Any, Callable, Hashable, Optional
+
+from cache import TTLCache
+from metrics import Counter
+
+tool_timeouts = Counter("swarm_tool_timeouts_total", "Tool functions the turn stopped waiting for, by reason.",
+                        ["tool", "reason"])
+tool_cache_lookups = Counter("swarm_tool_cache_total", "Tool results looked up by db version.", ["tool", "result"])
+
+
+class CountingExecutor(ThreadPoolExecutor):
+    """A ThreadPoolExecutor that counts the tasks waiting for a free worker, see `queued`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.queued = 0
+        self._queued_lock = threading.Lock()
+
+    def submit(self, fn, /, *args, **kwargs) -> Future:
+        self._count(1)
+
+        def started():
+            self._count(-1)
+            return fn(*args, **kwargs)
+
+        try:
+            future = super().submit(started)
+        except BaseException:
+            self._count(-1)
+            raise
+        # a task cancelled before it started never ran started()
+        future.add_done_callback(lambda future: future.cancelled() and self._count(-1))
+        return future
+
+    def _count(self, delta: int):
+        with self._queued_lock:
+            self.queued += delta
+
+
+class ToolTimeout(Exception):
+    """A tool did not finish within its timeout. It may still be running."""
+
+
+class ToolCancelled(Exception):
+    """The turn that called a tool was abandoned before the tool finished."""
+
+
+class ToolRunner:
+    """
+    Run heavy tool functions on their own worker pool, so a chat turn can stop waiting for them.
+
+    A turn waits for its tool until `timeout` seconds have passed or its `cancel` event is set,
+    for example because the websocket closed. A call that has not started yet is then dropped;
+    one that has keeps running to the end on its worker, since threads cannot be interrupted,
+    and whatever it does (committing a round, sending notifications) still happens.
+
+    Results can be cached against the db version they were computed on, as (epoch, version),
+    see changes.ChangeLog. A result stays valid until the next write changes the version.
+    """
+
+    def __init__(self, workers: int = 16, timeout: float = 30.0, cache_size: int = 256, poll: float = 0.05):
+        self.executor = CountingExecutor(max_workers=workers, thread_name_prefix="tools")
+        self.timeout = timeout
+        self.poll = poll
+        self.results = TTLCache(maxsize=cache_size)
+
+    def run(self, name: str, fn: Callable[..., Any], *args, timeout: Optional[float] = None,
+            cancel: Optional[threading.Event] = None, **kwargs) -> Any:
+        """Call fn(*args, **kwargs) on the pool and wait for it, see the class docstring."""
+        future = self.executor.submit(fn, *args, **kwargs)
+        try:
+            return self.wait(name, future, timeout, cancel)
+        except (ToolTimeout, ToolCancelled):
+            future.cancel()
+            raise
+
+    def wait(self, name: str, future: Future, timeout: Optional[float] = None,
+             cancel: Optional[threading.Event] = None) -> Any:
+        """
+        Wait for the result of work started elsewhere, such as a batched matching round, as run()
+        does. The future is left alone when the wait gives up, as others may be waiting on it too.
+        """
+        deadline = time.perf_counter() + (self.timeout if timeout is None else timeout)
+        while True:
+            remaining = deadline - time.perf_counter()
+            # with a cancel event, wake up every `poll` seconds to check it
+            wait = min(self.poll, remaining) if cancel is not None else remaining
+            try:
+                return future.result(timeout=max(0.0, wait))
+            except TimeoutError:
+                if cancel is not None and cancel.is_set():
+                    tool_timeouts.labels(name, "cancelled").inc()
+                    raise ToolCancelled(name)
+                if time.perf_counter() >= deadline:
+                    tool_timeouts.labels(name, "timeout").inc()
+                    raise ToolTimeout(name)
+
+    def cached(self, name: str, version: Hashable) -> Any:
+        """The result `name` stored for this db version, or None."""
+        result = self.results.get((name, version))
+        tool_cache_lookups.labels(name, "miss" if result is None else "hit").inc()
+        return result
+
+    def store(self, name: str, version: Hashable, result: Any):
+        self.results.set((name, version), result)
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,320 @@
+"""
+Travel costs between locations, for matching by drive time instead of straight-line distance.
+
+A TravelMatrix is built offline from a road-network extract (see roads.RoadNetwork) and kept as
+two files: a memory-mapped .npy matrix of float32 seconds, where [i, j] is the drive from
+location i to location j, and a .json sidecar with the location names and coordinates it was
+built for. Opening one maps the file and reads the sidecar, nothing else, so a lookup is one
+array access. After locations are added or moved, only their rows and columns are recomputed.
+
+    python travel.py build --roads roads.csv --out travel.npy
+    python travel.py update --roads roads.csv --out travel.npy [--names "Kroger,Cinnabon"]
+
+Then start the server with TRAVEL_MATRIX_PATH=travel.npy.
+"""
+import argparse
+import heapq
+import json
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from distance import distance_matrix
+
+# The leg between a location and the nearest node of the road network, at 30 km/h
+ACCESS_SECONDS_PER_KM = 120.0
+
+
+class TravelCost:
+    """
+    Travel cost from a demander to a supplier, the trip a pantry makes to pick items up.
+
+    A provider also gives `seconds_per_km`, a lower bound on cost per straight-line (haversine)
+    kilometre. The matcher walks candidates nearest first by straight line and uses it to
+    know when no unseen candidate can be cheaper, see ranked().
+    """
+
+    seconds_per_km = 0.0
+
+    def bind(self, locations: dict) -> List[str]:
+        """Called with db["locations"] by the MatchBook using it. Returns locations it has no costs for."""
+        return []
+
+    def cost(self, demander: str, supplier: str) -> float:
+        raise NotImplementedError
+
+    def costs(self, demanders: Sequence[str], suppliers: Sequence[str]) -> np.ndarray:
+        """(len(demanders), len(suppliers)) array of costs."""
+        return np.array([[self.cost(demander, supplier) for supplier in suppliers] for demander in demanders],
+                        dtype=np.float64).reshape(len(demanders), len(suppliers))
+
+    def ranked(self, stream: Iterator[Tuple[float, str]], anchor: str,
+               anchor_is_supplier: bool) -> Iterator[Tuple[float, str]]:
+        """
+        Turn a stream of (km, name), nearest first by straight line, into (cost, name), cheapest first.
+
+        Costs are looked up as the stream is read, and a candidate is yielded once everything not
+        read yet is known to cost more. Ties are broken by name.
+        """
+        cost = (lambda name: self.cost(name, anchor)) if anchor_is_supplier else (lambda name: self.cost(anchor, name))
+        heap = []
+        for km, name in stream:
+            bound = km * self.seconds_per_km
+            while heap and heap[0][0] < bound:
+                yield heapq.heappop(heap)
+            heapq.heappush(heap, (cost(name), name))
+        while heap:
+            yield heapq.heappop(heap)
+
+
+class TravelMatrix(TravelCost):
+    """
+    Precomputed drive times between the locations, memory-mapped from disk.
+
+    Pairs the matrix does not cover (a location added or moved since it was built, or no road
+    between them) are estimated from the straight-line distance at the matrix's average seconds
+    per km, which is never below its lower bound.
+    """
+
+    def __init__(self, path: str, writable: bool = False):
+        self.path = path
+        with open(_sidecar(path)) as f:
+            meta = json.load(f)
+        self.names: List[str] = meta["names"]
+        self.coordinates: Dict[str, Tuple[float, float]] = {
+            name: tuple(position) for name, position in zip(self.names, meta["coordinates"])
+        }
+        self.index: Dict[str, int] = {name: i for i, name in enumerate(self.names)}
+        self.locations: dict = {}
+        self.seconds_per_km = meta["min_seconds_per_km"]
+        self.mean_seconds_per_km = meta["mean_seconds_per_km"]
+        self.matrix = np.load(path, mmap_mode="r+" if writable else "r")
+
+    def __reduce__(self):
+        # Reopened from disk in a worker process instead of copying the mapped matrix
+        return self.__class__, (self.path,)
+
+    @property
+    def capacity(self) -> int:
+        return self.matrix.shape[0]
+
+    def stale(self, locations: dict) -> List[str]:
+        """Locations the matrix has no row for, or has at other coordinates."""
+        return [
+            name for name, info in locations.items()
+            if self.coordinates.get(name) != (info["data"]["lat"], info["data"]["lon"])
+        ]
+
+    def bind(self, locations: dict) -> List[str]:
+        """
+        Use the matrix for these locations, as in db["locations"]. Rows of locations that moved
+        since it was built are ignored until they are recomputed. Returns the stale names.
+        """
+        self.locations = locations
+        self.index = {name: i for i, name in enumerate(self.names)}
+        stale = self.stale(locations)
+        for name in stale:
+            self.index.pop(name, None)
+        return stale
+
+    def cost(self, demander: str, supplier: str) -> float:
+        i, j = self.index.get(demander), self.index.get(supplier)
+        if i is not None and j is not None:
+            seconds = float(self.matrix[i, j])
+            if not math.isnan(seconds):
+                return seconds
+        return self._estimate([demander], [supplier])[0, 0]
+
+    def costs(self, demanders: Sequence[str], suppliers: Sequence[str]) -> np.ndarray:
+        rows = np.array([self.index.get(name, -1) for name in demanders], dtype=np.int64)
+        columns = np.array([self.index.get(name, -1) for name in suppliers], dtype=np.int64)
+        result = self.matrix[np.ix_(np.maximum(rows, 0), np.maximum(columns, 0))].astype(np.float64)
+        missing = np.isnan(result) | (rows < 0)[:, None] | (columns < 0)[None, :]
+        if missing.any():
+            estimate = self._estimate(demanders, suppliers)
+            result[missing] = estimate[missing]
+        return result
+
+    def _estimate(self, demanders: Sequence[str], suppliers: Sequence[str]) -> np.ndarray:
+        return distance_matrix([self._position(name) for name in demanders],
+                               [self._position(name) for name in suppliers], "haversine") * self.mean_seconds_per_km
+
+    def _position(self, name: str) -> Tuple[float, float]:
+        info = self.locations.get(name)
+        if info is None:
+            return self.coordinates[name]
+        return info["data"]["lat"], info["data"]["lon"]
+
+
+def _sidecar(path: str) -> str:
+    return os.path.splitext(path)[0] + ".json"
+
+
+# Building, offline
+
+_network = None
+
+
+def _init_worker(network):
+    global _network
+    _network = network
+
+
+def _times(task):
+    node, targets, reverse = task
+    return _network.travel_times(node, targets, reverse)[targets]
+
+
+def _routes(network, sources: List[int], targets: List[int], reverse: bool, workers: int) -> Dict[int, np.ndarray]:
+    """Travel times from (to, with reverse) every source node to every target node."""
+    tasks = [(node, targets, reverse) for node in dict.fromkeys(sources)]
+    if workers <= 1:
+        _init_worker(network)
+        return {task[0]: _times(task) for task in tasks}
+    with ProcessPoolExecutor(workers, initializer=_init_worker, initargs=(network,)) as pool:
+        return {task[0]: times for task, times in zip(tasks, pool.map(_times, tasks, chunksize=16))}
+
+
+def _access(network, positions: List[Tuple[float, float]]) -> Tuple[List[int], np.ndarray]:
+    """The road node of every location, and the seconds from the location to it."""
+    nodes, km = network.snap(positions)
+    return nodes, np.array(km) * ACCESS_SECONDS_PER_KM
+
+
+def _ratios(matrix: np.ndarray, positions: np.ndarray, rows: Iterable[int],
+            columns: Iterable[int] = ()) -> Tuple[float, float, int]:
+    """Min and summed seconds per km, and how many pairs were summed, over the given rows and columns."""
+    low, total, count = math.inf, 0.0, 0
+    lines = [(i, matrix[i, :len(positions)]) for i in rows] + [(j, matrix[:len(positions), j]) for j in columns]
+    for i, line in lines:
+        km = distance_matrix(positions[i], positions, "haversine")[0]
+        seconds = line.astype(np.float64)
+        usable = (km > 0) & np.isfinite(seconds)
+        if usable.any():
+            ratio = seconds[usable] / km[usable]
+            low = min(low, float(ratio.min()))
+            total += float(ratio.sum())
+            count += int(usable.sum())
+    return low, total, count
+
+
+def build(path: str, network, locations: dict, capacity: Optional[int] = None, workers: int = 1) -> TravelMatrix:
+    """
+    Compute the drive time between every pair of locations and write the matrix to `path`.
+
+    `capacity` leaves room for locations added later without a rebuild.
+    """
+    names = list(locations)
+    positions = [(info["data"]["lat"], info["data"]["lon"]) for info in locations.values()]
+    capacity = max(capacity or 0, len(names))
+    matrix = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(capacity, capacity))
+    matrix[:] = np.nan
+    nodes, access = _access(network, positions)
+    routes = _routes(network, nodes, nodes, False, workers)
+    for i, node in enumerate(nodes):
+        row = access[i] + routes[node] + access
+        row[i] = 0.0
+        row[~np.isfinite(row)] = np.nan
+        matrix[i, :len(names)] = row
+    matrix.flush()
+
+    low, total, count = _ratios(matrix, np.array(positions).reshape(-1, 2), range(len(names)))
+    _write_sidecar(path, names, positions, low, total, count)
+    del matrix
+    return TravelMatrix(path)
+
+
+def update(path: str, network, locations: dict, names: Optional[Iterable[str]] = None, workers: int = 1) -> List[str]:
+    """
+    Recompute the rows and columns of the given locations, by default every location the matrix
+    is stale for, and add new locations in the spare capacity. Returns the names recomputed.
+    """
+    travel = TravelMatrix(path, writable=True)
+    names = list(names) if names is not None else travel.stale(locations)
+    names = [name for name in dict.fromkeys(names) if name in locations]
+    known = list(travel.names) + [name for name in names if name not in travel.index]
+    if len(known) > travel.capacity:
+        raise ValueError(f"{len(known)} locations do not fit a matrix of {travel.capacity}, rebuild it with more capacity")
+
+    positions = [
+        (locations[name]["data"]["lat"], locations[name]["data"]["lon"]) if name in locations
+        else travel.coordinates[name]
+        for name in known
+    ]
+    index = {name: i for i, name in enumerate(known)}
+    nodes, access = _access(network, positions)
+    changed = [index[name] for name in names]
+    matrix = travel.matrix
+    # Rows: from each changed location to all; columns: from all to each changed location
+    outbound = _routes(network, [nodes[i] for i in changed], nodes, False, workers)
+    inbound = _routes(network, [nodes[i] for i in changed], nodes, True, workers)
+    for i in changed:
+        row = access[i] + outbound[nodes[i]] + access
+        column = access + inbound[nodes[i]] + access[i]
+        row[i] = column[i] = 0.0
+        row[~np.isfinite(row)] = np.nan
+        column[~np.isfinite(column)] = np.nan
+        matrix[i, :len(known)] = row
+        matrix[:len(known), i] = column
+    matrix.flush()
+
+    with open(_sidecar(path)) as f:
+        meta = json.load(f)
+    # the new columns too, as the bound must hold for travel into a changed location as well
+    low, total, count = _ratios(matrix, np.array(positions).reshape(-1, 2), changed, changed)
+    low = min(low, meta["min_seconds_per_km"])
+    # the mean is refreshed from the new rows and columns only, a rebuild recomputes it exactly
+    total += meta["mean_seconds_per_km"] * meta["pairs"]
+    count += meta["pairs"]
+    _write_sidecar(path, known, positions, low, total, count)
+    return names
+
+
+def _write_sidecar(path: str, names: List[str], positions: List[Tuple[float, float]], low: float,
+                   total: float, count: int):
+    mean = total / count if count else ACCESS_SECONDS_PER_KM
+    with open(_sidecar(path), "w") as f:
+        json.dump({
+            "names": names,
+            "coordinates": [list(position) for position in positions],
+            "min_seconds_per_km": low if math.isfinite(low) else 0.0,
+            "mean_seconds_per_km": mean,
+            "pairs": count,
+        }, f)
+
+
+def main():
+    from roads import RoadNetwork
+    from store import SQLiteStore
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("command", choices=("build", "update"))
+    parser.add_argument("--roads", required=True, help="CSV of road segments, see roads.RoadNetwork")
+    parser.add_argument("--out", default=os.getenv("TRAVEL_MATRIX_PATH", "travel.npy"))
+    parser.add_argument("--db", default=os.getenv("DB_PATH"), help="SQLite store to read the locations from, "
+                                                                   "the seed data in db.py if not given")
+    parser.add_argument("--capacity", type=int, help="room for this many locations (build)")
+    parser.add_argument("--names", help="comma separated locations to recompute (update), every stale one if not given")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    if args.db:
+        locations = SQLiteStore(args.db).load()["locations"]
+    else:
+        from db import get_db
+        locations = get_db()["locations"]
+    network = RoadNetwork.from_csv(args.roads)
+    print(f"{len(network)} road nodes, {len(locations)} locations")
+    if args.command == "build":
+        travel = build(args.out, network, locations, args.capacity, args.workers)
+        print(f"Wrote {args.out}, {len(travel.names)} locations, capacity {travel.capacity}")
+    else:
+        names = args.names.split(",") if args.names else None
+        print(f"Recomputed {len(update(args.out, network, locations, names, args.workers))} locations")
+
+
+if __name__ == "__main__":
+    main()